@@ -0,0 +1,241 @@
+"""
+Admission control for the heavy endpoints (uploads and chat turns).
+
+A request is admitted when it fits within three limits: concurrent requests
+overall, concurrent requests per user, and a memory budget shared by the
+running requests, each of which declares an estimate based on the size of
+the file it processes. Requests that do not fit wait in a bounded FIFO
+queue. A request that cannot be admitted within the queue timeout, or finds
+the queue full, is rejected at once with a 429 and a Retry-After hint, so
+the process is never oversubscribed. The limits apply per API process.
+"""
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import Counter, deque
+from typing import Any, Deque, Dict, Optional
+
+from fastapi import HTTPException, status
+
+logger = logging.getLogger(__name__)
+
+# Heavy requests running at the same time, in total and per user.
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", 8))
+ADMISSION_MAX_PER_USER = int(os.getenv("ADMISSION_MAX_PER_USER", 2))
+# Memory the running requests may use together, in MB.
+ADMISSION_MEMORY_BUDGET_MB = int(os.getenv("ADMISSION_MEMORY_BUDGET_MB", 4096))
+# Estimated memory per byte of the file a request processes.
+ADMISSION_MEMORY_FACTOR = float(os.getenv("ADMISSION_MEMORY_FACTOR", 3))
+# Requests that may wait for admission, and how long each may wait, in seconds.
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 32))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", 10))
+
+# Retry-After bounds, and the value used before any request has finished.
+_MIN_RETRY_AFTER_SECONDS = 1
+_MAX_RETRY_AFTER_SECONDS = 60
+_DEFAULT_RETRY_AFTER_SECONDS = 5
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; `retry_after` is a hint in seconds."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Admission:
+    """A running request's share of the limits; release it when the request is done."""
+
+    def __init__(self, controller: "AdmissionController", user_id: str, memory_bytes: int, kind: str):
+        self.user_id = user_id
+        self.memory_bytes = memory_bytes
+        self.kind = kind
+        self.admitted_at = time.monotonic()
+        self._controller = controller
+        self._released = False
+
+    def release(self) -> None:
+        """Returns the request's share of the limits. Calling it again has no effect."""
+        if not self._released:
+            self._released = True
+            self._controller._release(self)
+
+
+class _Waiter:
+    def __init__(self, user_id: str, memory_bytes: int, kind: str, future: asyncio.Future):
+        self.user_id = user_id
+        self.memory_bytes = memory_bytes
+        self.kind = kind
+        self.future = future
+
+
+class AdmissionController:
+    """
+    Admits requests within the concurrency and memory limits.
+
+    Waiting requests are admitted in arrival order, except that a request
+    held back only by its user's limit does not block other users' requests
+    behind it. A request larger than the whole memory budget is admitted
+    when nothing else is running. Must be used from a single event loop.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = ADMISSION_MAX_CONCURRENT,
+        max_per_user: int = ADMISSION_MAX_PER_USER,
+        memory_budget_bytes: int = ADMISSION_MEMORY_BUDGET_MB * 1024 * 1024,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        queue_timeout_seconds: float = ADMISSION_QUEUE_TIMEOUT_SECONDS,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.memory_budget_bytes = memory_budget_bytes
+        self.max_queue = max_queue
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._running = 0
+        self._running_per_user: Counter = Counter()
+        self._memory_bytes = 0
+        self._waiters: Deque[_Waiter] = deque()
+        # Durations of recent requests, for the Retry-After estimate.
+        self._durations: Deque[float] = deque(maxlen=50)
+
+    def _fits_globally(self, memory_bytes: int) -> bool:
+        return self._running < self.max_concurrent and (
+            self._running == 0 or self._memory_bytes + memory_bytes <= self.memory_budget_bytes
+        )
+
+    def _fits_user(self, user_id: str) -> bool:
+        return self._running_per_user[user_id] < self.max_per_user
+
+    def _grant(self, user_id: str, memory_bytes: int, kind: str) -> Admission:
+        self._running += 1
+        self._running_per_user[user_id] += 1
+        self._memory_bytes += memory_bytes
+        self.admitted += 1
+        return Admission(self, user_id, memory_bytes, kind)
+
+    def _release(self, admission: Admission) -> None:
+        self._running -= 1
+        self._running_per_user[admission.user_id] -= 1
+        if self._running_per_user[admission.user_id] <= 0:
+            del self._running_per_user[admission.user_id]
+        self._memory_bytes -= admission.memory_bytes
+        self._durations.append(time.monotonic() - admission.admitted_at)
+        self._wake()
+
+    def _wake(self) -> None:
+        for waiter in list(self._waiters):
+            if waiter.future.done():
+                continue
+            if not self._fits_globally(waiter.memory_bytes):
+                # Keep the order, so large requests are not starved by smaller ones behind them.
+                break
+            if self._fits_user(waiter.user_id):
+                self._waiters.remove(waiter)
+                waiter.future.set_result(self._grant(waiter.user_id, waiter.memory_bytes, waiter.kind))
+
+    def retry_after(self) -> int:
+        """Estimates when a rejected request may be admitted, in seconds."""
+        if not self._durations:
+            return _DEFAULT_RETRY_AFTER_SECONDS
+        average = sum(self._durations) / len(self._durations)
+        estimate = average * (1 + len(self._waiters) / max(self.max_concurrent, 1))
+        return min(max(math.ceil(estimate), _MIN_RETRY_AFTER_SECONDS), _MAX_RETRY_AFTER_SECONDS)
+
+    def _reject(self, user_id: str, kind: str, reason: str) -> AdmissionRejected:
+        self.rejected += 1
+        logger.warning(
+            f"[Admission] Rejected {kind} of user {user_id}: {reason} ({self._running} running, {len(self._waiters)} waiting)"
+        )
+        return AdmissionRejected(reason, self.retry_after())
+
+    async def admit(self, user_id: str, memory_bytes: int, kind: str = "request") -> Admission:
+        """
+        Waits until a request may run.
+
+        Args:
+            user_id: The user making the request.
+            memory_bytes: Estimated memory the request needs.
+            kind: Label of the request, for logs.
+
+        Returns:
+            The admission, to be released when the request is done.
+
+        Raises:
+            AdmissionRejected: If the queue is full, the user already has as
+                many requests waiting as they may run, or the request was not
+                admitted within the queue timeout.
+        """
+        memory_bytes = max(int(memory_bytes), 0)
+        if not self._waiters and self._fits_globally(memory_bytes) and self._fits_user(user_id):
+            return self._grant(user_id, memory_bytes, kind)
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject(user_id, kind, "Too many requests are waiting.")
+        if sum(w.user_id == user_id for w in self._waiters) >= self.max_per_user:
+            raise self._reject(user_id, kind, "Too many of your requests are waiting.")
+
+        waiter = _Waiter(user_id, memory_bytes, kind, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        # Waiters ahead may be held back only by their own user's limit.
+        self._wake()
+        try:
+            return await asyncio.wait_for(waiter.future, self.queue_timeout_seconds)
+        except asyncio.TimeoutError:
+            self._waiters.remove(waiter)
+            # Smaller requests behind it may fit now.
+            self._wake()
+            self.timed_out += 1
+            raise self._reject(user_id, kind, f"Not admitted within {self.queue_timeout_seconds:g}s.")
+        except asyncio.CancelledError:
+            # The client went away; give back an admission granted just before.
+            if waiter.future.done() and not waiter.future.cancelled():
+                waiter.future.result().release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                # The request may have been holding back smaller ones behind it.
+                self._wake()
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the current load and the admission counters."""
+        return {
+            "running": self._running,
+            "waiting": len(self._waiters),
+            "memory_mb": round(self._memory_bytes / (1024 * 1024), 1),
+            "memory_budget_mb": round(self.memory_budget_bytes / (1024 * 1024), 1),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+admission_controller = AdmissionController()
+
+
+def estimate_memory(file_size_bytes: Optional[int]) -> int:
+    """Estimates the memory needed to process a file of the given size."""
+    return int((file_size_bytes or 0) * ADMISSION_MEMORY_FACTOR)
+
+
+async def admit_request(user_id: str, memory_bytes: int, kind: str) -> Admission:
+    """
+    Admits a request through the shared controller.
+
+    Raises:
+        HTTPException: 429 with a Retry-After header if the request is not admitted.
+    """
+    try:
+        return await admission_controller.admit(user_id, memory_bytes, kind)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"The server is busy. {e} Retry in {e.retry_after}s.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
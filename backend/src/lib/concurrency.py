@@ -0,0 +1,30 @@
+"""Helpers for running blocking work without stalling the event loop."""
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+# Bounded pool for blocking calls (storage downloads, pandas work, sync SDKs)
+# made from coroutines, so they cannot starve the event loop or each other.
+BLOCKING_POOL_SIZE = int(os.getenv("BLOCKING_POOL_SIZE", 16))
+
+_blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_POOL_SIZE, thread_name_prefix="mardata-blocking")
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Runs a blocking function in the shared, bounded thread pool.
+
+    Args:
+        func: The function to call.
+        *args: Positional arguments for `func`.
+        **kwargs: Keyword arguments for `func`.
+
+    Returns:
+        The function's return value.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_blocking_executor, functools.partial(func, *args, **kwargs))
@@ -6,6 +6,8 @@ from gotrue.errors import AuthApiError
 from supabase import Client
 
 from ..lib.supabase_client import get_supabase_client
+from ..lib.concurrency import run_blocking
+from ..lib.jwt_verifier import jwt_verifier, TokenVerificationError, LocalVerificationUnavailable
 from ..models.user import User
 
 # Configure logging
@@ -14,12 +16,16 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Scheme for bearer token authentication
 bearer_scheme = HTTPBearer()
 
-async def get_current_user(
+async def get_current_user_remote(
     token: HTTPAuthorizationCredentials = Depends(bearer_scheme),
     supabase: Client = Depends(get_supabase_client), # Gets the service_role client
 ) -> User:
     """
-    Dependency to get the current user from a JWT, validated by the service client.
+    Dependency to get the current user from a JWT, validated by Supabase Auth.
+
+    Unlike `get_current_user`, this rejects tokens of users that were signed
+    out or deleted before the token expired, at the cost of a round-trip to
+    Supabase Auth; use it for revocation-sensitive routes.
     """
     logging.info("Attempting to get current user from token.")
     if not token or not token.credentials:
@@ -28,11 +34,12 @@ async def get_current_user(
 
     try:
         # Use the service_role client to validate the user's JWT
-        user_response = supabase.auth.get_user(token.credentials)
+        user_response = await run_blocking(supabase.auth.get_user, token.credentials)
         logging.info(f"Supabase auth response: {user_response}")
 
         if not user_response or not user_response.user or not user_response.user.id:
             logging.warning("User not found in Supabase response. Token may be invalid or expired.")
+            jwt_verifier.forget(token.credentials)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid or expired authentication token.",
@@ -46,14 +53,52 @@ async def get_current_user(
 
     except AuthApiError as e:
         logging.error(f"AuthApiError in get_current_user: {e.message}")
+        jwt_verifier.forget(token.credentials)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"Invalid authentication credentials: {e.message}",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Unexpected error in get_current_user: {e}", exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"An unexpected error occurred during authentication: {e}",
         )
+
+
+async def get_current_user(
+    token: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+    supabase: Client = Depends(get_supabase_client), # Gets the service_role client
+) -> User:
+    """
+    Dependency to get the current user from a JWT, verified locally.
+
+    The token's signature, audience and expiry are checked in-process (see
+    `jwt_verifier`) and the user is cached for a short TTL, so most requests
+    make no call to Supabase Auth. Falls back to `get_current_user_remote`
+    when the token cannot be checked locally (no JWT secret configured for
+    HS256 tokens, or the signing keys cannot be fetched).
+    """
+    if not token or not token.credentials:
+        logging.warning("No auth token found in request.")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing token")
+
+    user = jwt_verifier.cached_user(token.credentials)
+    if user is not None:
+        return user
+    try:
+        # Runs in the thread pool since it may have to fetch the signing keys.
+        return await run_blocking(jwt_verifier.verify, token.credentials)
+    except TokenVerificationError as e:
+        logging.warning(f"Token rejected by local verification: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=f"Invalid authentication credentials: {e}",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    except LocalVerificationUnavailable as e:
+        logging.info(f"Local token verification unavailable ({e}); validating with Supabase Auth.")
+        return await get_current_user_remote(token, supabase)
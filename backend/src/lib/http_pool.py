@@ -0,0 +1,141 @@
+"""Shared, keep-alive HTTP connection pools for outbound API calls."""
+import os
+import logging
+import threading
+from typing import Any, Dict, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Pool limits for LLM API connections, shared by all models and by sync and async calls.
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", 100))
+LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+# Seconds an idle connection is kept open for reuse.
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", 30))
+# Timeout for a whole LLM API request, in seconds.
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", 60))
+# The reuse counters are logged every this many requests.
+LLM_HTTP_STATS_LOG_INTERVAL = int(os.getenv("LLM_HTTP_STATS_LOG_INTERVAL", 100))
+
+
+class ConnectionMetrics:
+    """
+    Counts requests and newly opened connections for a pair of HTTP clients.
+
+    New connections are detected from httpcore's "connection.connect_tcp"
+    trace events; every other request reused a pooled connection.
+    """
+
+    def __init__(self, name: str, log_interval: int = LLM_HTTP_STATS_LOG_INTERVAL):
+        self.name = name
+        # The counters are logged every this many requests; 0 disables the log.
+        self.log_interval = log_interval
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+        self._lock = threading.Lock()
+
+    def _record_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+            requests = self.requests
+        if self.log_interval and requests % self.log_interval == 0:
+            logger.info(f"[HTTP pool] {self.name}: {self.stats()}")
+
+    def _record_trace(self, event_name: str) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self.new_connections += 1
+        elif event_name == "connection.start_tls.complete":
+            with self._lock:
+                self.tls_handshakes += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the counters and the share of requests served by a reused connection."""
+        with self._lock:
+            reused = max(self.requests - self.new_connections, 0)
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "tls_handshakes": self.tls_handshakes,
+                "reused_connections": reused,
+                "reuse_ratio": round(reused / self.requests, 3) if self.requests else None,
+            }
+
+
+def _limits(max_connections: int, max_keepalive_connections: int, keepalive_expiry: float) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+
+
+def _async_client(metrics: ConnectionMetrics, limits: httpx.Limits, timeout: float) -> httpx.AsyncClient:
+    async def async_trace(event_name: str, info: Dict[str, Any]) -> None:
+        metrics._record_trace(event_name)
+
+    async def on_async_request(request: httpx.Request) -> None:
+        request.extensions["trace"] = async_trace
+        metrics._record_request()
+
+    return httpx.AsyncClient(limits=limits, timeout=timeout, event_hooks={"request": [on_async_request]})
+
+
+def create_pooled_clients(name: str) -> Tuple[httpx.Client, httpx.AsyncClient, ConnectionMetrics]:
+    """
+    Creates a sync and an async HTTP client with keep-alive pools and shared metrics.
+
+    The async client must only be used from one event loop, since its
+    pooled connections belong to the loop that opened them.
+
+    Args:
+        name: A label for the clients in logs.
+
+    Returns:
+        The sync client, the async client and their connection metrics.
+    """
+    metrics = ConnectionMetrics(name)
+    limits = _limits(LLM_HTTP_MAX_CONNECTIONS, LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS, LLM_HTTP_KEEPALIVE_EXPIRY)
+
+    def trace(event_name: str, info: Dict[str, Any]) -> None:
+        metrics._record_trace(event_name)
+
+    def on_request(request: httpx.Request) -> None:
+        request.extensions["trace"] = trace
+        metrics._record_request()
+
+    client = httpx.Client(limits=limits, timeout=LLM_HTTP_TIMEOUT, event_hooks={"request": [on_request]})
+    return client, _async_client(metrics, limits, LLM_HTTP_TIMEOUT), metrics
+
+
+def create_pooled_async_client(
+    name: str,
+    max_connections: int,
+    max_keepalive_connections: int,
+    keepalive_expiry: float,
+    timeout: float,
+    stats_log_interval: int
+) -> Tuple[httpx.AsyncClient, ConnectionMetrics]:
+    """
+    Creates an async HTTP client with a keep-alive pool of the given size.
+
+    Like the async client of `create_pooled_clients`, it must only be used
+    from the event loop it was first used in.
+
+    Args:
+        name: A label for the client in logs.
+        max_connections: The maximum number of open connections.
+        max_keepalive_connections: The maximum number of idle connections kept open.
+        keepalive_expiry: Seconds an idle connection is kept open for reuse.
+        timeout: The timeout for a whole request, in seconds.
+        stats_log_interval: The reuse counters are logged every this many
+            requests; 0 disables the log.
+
+    Returns:
+        The client and its connection metrics.
+    """
+    metrics = ConnectionMetrics(name, stats_log_interval)
+    limits = _limits(max_connections, max_keepalive_connections, keepalive_expiry)
+    return _async_client(metrics, limits, timeout), metrics
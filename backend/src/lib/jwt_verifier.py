@@ -0,0 +1,240 @@
+"""
+Local verification of Supabase access tokens.
+
+Tokens are checked in-process instead of with a call to Supabase Auth per
+request: HS256 tokens against the project's JWT secret, asymmetric tokens
+(RS256/ES256) against the project's published signing keys (JWKS). The keys
+are cached and refreshed in the background before they go stale, and
+refreshed at once when a token names an unknown key, e.g. after rotation.
+Verified users are kept in a small TTL cache, so a token is verified once
+per TTL rather than on every request.
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+import jwt
+
+from ..models.user import User
+
+logger = logging.getLogger(__name__)
+
+# Legacy projects sign tokens with HS256 and this secret; leave unset to rely on JWKS.
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+# Endpoint serving the project's public signing keys.
+SUPABASE_JWKS_URL = os.getenv(
+    "SUPABASE_JWKS_URL", f"{os.getenv('SUPABASE_URL', '').rstrip('/')}/auth/v1/.well-known/jwks.json"
+)
+# Expected "aud" claim of access tokens.
+SUPABASE_JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+# Seconds after which the signing keys are refreshed in the background.
+JWKS_REFRESH_SECONDS = float(os.getenv("JWKS_REFRESH_SECONDS", 600))
+# Minimum seconds between refreshes triggered by unknown key IDs.
+JWKS_MIN_REFRESH_INTERVAL = 30.0
+# How long a verified token maps to its user, and how many tokens are kept.
+AUTH_TOKEN_CACHE_TTL_SECONDS = float(os.getenv("AUTH_TOKEN_CACHE_TTL_SECONDS", 60))
+AUTH_TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_TOKEN_CACHE_MAX_ENTRIES", 10000))
+# Allowed clock skew when checking expiry, in seconds.
+JWT_LEEWAY_SECONDS = int(os.getenv("JWT_LEEWAY_SECONDS", 10))
+
+_ASYMMETRIC_ALGORITHMS = {"RS256", "ES256", "EdDSA"}
+
+
+class TokenVerificationError(Exception):
+    """Raised when a token is invalid, expired or signed with an unknown key."""
+
+
+class LocalVerificationUnavailable(Exception):
+    """Raised when a token cannot be checked locally (no secret or key to check it with)."""
+
+
+class JWKSCache:
+    """
+    The project's signing keys, fetched from SUPABASE_JWKS_URL.
+
+    The first lookup fetches the keys; afterwards they are refreshed in a
+    background thread once they are older than `refresh_seconds`, while
+    lookups keep using the current keys.
+    """
+
+    def __init__(self, url: str = SUPABASE_JWKS_URL, refresh_seconds: float = JWKS_REFRESH_SECONDS):
+        self.url = url
+        self.refresh_seconds = refresh_seconds
+        self.refreshes = 0
+        self._keys: Dict[str, jwt.PyJWK] = {}
+        self._fetched_at: Optional[float] = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _fetch(self) -> None:
+        response = httpx.get(self.url, timeout=5)
+        response.raise_for_status()
+        keys = {}
+        for jwk in response.json().get("keys", []):
+            try:
+                keys[jwk.get("kid")] = jwt.PyJWK(jwk)
+            except jwt.PyJWKError as e:
+                logger.warning(f"[JWKS] Skipping unusable key {jwk.get('kid')}: {e}")
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+            self.refreshes += 1
+        logger.info(f"[JWKS] Loaded {len(keys)} signing keys.")
+
+    def _refresh_in_background(self) -> None:
+        def refresh():
+            try:
+                self._fetch()
+            except Exception as e:
+                logger.warning(f"[JWKS] Background refresh failed; keeping the current keys: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=refresh, name="jwks-refresh", daemon=True).start()
+
+    def get_key(self, kid: Optional[str]) -> Optional[jwt.PyJWK]:
+        """
+        Returns the signing key with the given ID.
+
+        Returns:
+            The key, or None if the project publishes no such key.
+
+        Raises:
+            httpx.HTTPError: If the keys have never been fetched and fetching fails.
+        """
+        now = time.monotonic()
+        with self._lock:
+            fetched_at = self._fetched_at
+            key = self._keys.get(kid)
+            # Nothing cached yet, or the key may have been rotated in: fetch before answering.
+            fetch_now = fetched_at is None or (key is None and now - fetched_at > JWKS_MIN_REFRESH_INTERVAL)
+            refresh = not fetch_now and now - fetched_at > self.refresh_seconds and not self._refreshing
+            if refresh:
+                self._refreshing = True
+        if fetch_now:
+            self._fetch()
+            with self._lock:
+                return self._keys.get(kid)
+        if refresh:
+            self._refresh_in_background()
+        return key
+
+
+class TokenCache:
+    """An LRU map from token digest to the verified user, valid until the TTL or the token's expiry."""
+
+    def __init__(self, ttl_seconds: float = AUTH_TOKEN_CACHE_TTL_SECONDS, max_entries: int = AUTH_TOKEN_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[User, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> Optional[User]:
+        key = self._digest(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, token: str, user: User, expires_at: float) -> None:
+        with self._lock:
+            self._entries[self._digest(token)] = (user, min(expires_at, time.time() + self.ttl_seconds))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, token: str) -> None:
+        with self._lock:
+            self._entries.pop(self._digest(token), None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class JWTVerifier:
+    """Verifies access tokens locally and caches the resulting users."""
+
+    def __init__(self, secret: Optional[str] = SUPABASE_JWT_SECRET, jwks: Optional[JWKSCache] = None):
+        self.secret = secret
+        self.jwks = jwks or JWKSCache()
+        self.tokens = TokenCache()
+
+    def _signing_key(self, token: str) -> Tuple[Any, str]:
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.InvalidTokenError as e:
+            raise TokenVerificationError(f"Malformed token: {e}") from e
+        algorithm = header.get("alg")
+        if algorithm == "HS256":
+            if not self.secret:
+                raise LocalVerificationUnavailable("SUPABASE_JWT_SECRET is not set.")
+            return self.secret, algorithm
+        if algorithm in _ASYMMETRIC_ALGORITHMS:
+            try:
+                key = self.jwks.get_key(header.get("kid"))
+            except httpx.HTTPError as e:
+                raise LocalVerificationUnavailable(f"Signing keys could not be fetched: {e}") from e
+            if key is None:
+                raise TokenVerificationError("Token is signed with an unknown key.")
+            return key, algorithm
+        raise TokenVerificationError(f"Unsupported token algorithm: {algorithm}")
+
+    def cached_user(self, token: str) -> Optional[User]:
+        """Returns the user of a recently verified token, or None."""
+        return self.tokens.get(token)
+
+    def verify(self, token: str) -> User:
+        """
+        Verifies a token and caches the user it belongs to.
+
+        Args:
+            token: The bearer token.
+
+        Returns:
+            The authenticated user.
+
+        Raises:
+            TokenVerificationError: If the token is invalid or expired.
+            LocalVerificationUnavailable: If there is nothing to verify the
+                token with; the caller should validate it remotely instead.
+        """
+        key, algorithm = self._signing_key(token)
+        try:
+            claims = jwt.decode(
+                token,
+                key,
+                algorithms=[algorithm],
+                audience=SUPABASE_JWT_AUDIENCE,
+                leeway=JWT_LEEWAY_SECONDS,
+                options={"require": ["exp", "sub"]},
+            )
+        except jwt.InvalidTokenError as e:
+            raise TokenVerificationError(str(e)) from e
+        user = User(id=claims["sub"], email=claims.get("email") or None)
+        self.tokens.put(token, user, float(claims["exp"]))
+        return user
+
+    def forget(self, token: str) -> None:
+        """Drops a token from the cache, e.g. after it failed remote validation."""
+        self.tokens.discard(token)
+
+
+jwt_verifier = JWTVerifier()
@@ -0,0 +1,174 @@
+"""
+Response caches for LLM calls.
+
+Answers are stored under a fingerprint of the normalized prompt and the
+model settings (see `prompt_fingerprint`), so a repeated question on the
+same data is answered without calling the API. Two backends are
+available: an in-memory LRU, and SQLite, which survives restarts and is
+shared by every process using the same file. Both expire entries after a
+TTL and evict the least recently used entries beyond a maximum count.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Backend: "memory", "sqlite" or "none".
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory")
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", 24 * 3600))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 1000))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+
+
+def normalize_prompt(text: str) -> str:
+    """Normalizes Unicode and collapses whitespace, which varies with prompt indentation."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def prompt_fingerprint(prompt: str, settings: Dict[str, Any]) -> str:
+    """
+    Returns the cache key for a prompt.
+
+    Args:
+        prompt: The full prompt text.
+        settings: Everything else that changes the answer (models,
+            temperature, stop sequences, ...). Must be JSON-serializable.
+
+    Returns:
+        A hex SHA-256 digest.
+    """
+    payload = json.dumps({"prompt": normalize_prompt(prompt), "settings": settings}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class InMemoryLLMCache:
+    """A process-local LRU cache of answers, with a TTL."""
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES, ttl_seconds: int = LLM_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached answer for `key`, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.time() - self.ttl_seconds:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: str, value: str) -> None:
+        """Stores an answer, evicting the least recently used entries beyond the maximum."""
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the hit and miss counters and the number of entries."""
+        with self._lock:
+            return {"backend": "memory", "entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class SQLiteLLMCache:
+    """
+    An LRU cache of answers in a SQLite file, with a TTL.
+
+    The connection is shared by all threads of the process behind a lock;
+    other processes may open the same file.
+    """
+
+    def __init__(
+        self,
+        path: str = LLM_CACHE_PATH,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        ttl_seconds: int = LLM_CACHE_TTL_SECONDS
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed_at ON llm_cache (accessed_at)")
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached answer for `key`, or None if it is missing or expired."""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value FROM llm_cache WHERE key = ? AND created_at >= ?", (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        """Stores an answer, dropping expired entries and the least recently used beyond the maximum."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                " SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the hit and miss counters and the number of entries."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            return {"backend": "sqlite", "entries": entries, "hits": self.hits, "misses": self.misses}
+
+
+def create_llm_cache(backend: str = LLM_CACHE_BACKEND):
+    """
+    Creates the configured response cache.
+
+    Args:
+        backend: "memory", "sqlite" or "none".
+
+    Returns:
+        A cache instance, or None when caching is disabled.
+
+    Raises:
+        ValueError: If the backend name is not known.
+    """
+    if backend == "none":
+        return None
+    if backend == "memory":
+        return InMemoryLLMCache()
+    if backend == "sqlite":
+        return SQLiteLLMCache()
+    raise ValueError(f"Unknown LLM cache backend: {backend}")
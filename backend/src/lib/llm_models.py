@@ -1,6 +1,8 @@
 import os
+import json
 from dotenv import load_dotenv
 from .model_rotator import GroqModelRotator
+from .llm_cache import create_llm_cache
 
 load_dotenv()
 
@@ -11,5 +13,15 @@ general_purpose_models = [
     "gpt-oss-120b",
 ]
 
+# Per-model (requests per minute, tokens per minute) budgets, as JSON, e.g.
+# {"llama-3.3-70b-versatile": [30, 12000]}. Unlisted models use LLM_DEFAULT_RPM/TPM.
+model_limits = {model: tuple(limits) for model, limits in json.loads(os.getenv("GROQ_MODEL_LIMITS", "{}")).items()}
+
 # Rotator for the Orchestrator and Synthesis agents
-llm_llama_70b = GroqModelRotator(models=general_purpose_models, temperature=0.7)
\ No newline at end of file
+llm_llama_70b = GroqModelRotator(
+    models=general_purpose_models,
+    temperature=0.7,
+    model_limits=model_limits,
+    hedging=os.getenv("LLM_HEDGING_ENABLED", "false").lower() == "true",
+    response_cache=create_llm_cache()
+)
@@ -1,13 +1,20 @@
 import os
+import time
+import asyncio
 from dotenv import load_dotenv
 from langchain_groq import ChatGroq
-from groq import APIStatusError, NotFoundError
+from groq import APIConnectionError, APIStatusError, InternalServerError, NotFoundError, RateLimitError
 import logging
+import threading
+from pydantic import PrivateAttr
 from langchain_core.language_models.chat_models import BaseChatModel
-from langchain_core.outputs import GenerationChunk, ChatResult, ChatGenerationChunk
-from typing import Any, List, Optional, Iterator, AsyncIterator
-from langchain_core.messages import BaseMessage
+from langchain_core.outputs import GenerationChunk, ChatGeneration, ChatResult, ChatGenerationChunk
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Iterator, AsyncIterator, Tuple
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
 from langchain_core.callbacks import CallbackManagerForLLMRun
+from .http_pool import LLM_HTTP_TIMEOUT, create_pooled_clients
+from .model_router import ModelRouter, NoModelAvailableError
+from .llm_cache import prompt_fingerprint
 
 load_dotenv()
 
@@ -15,15 +22,81 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Completion tokens reserved per call before the actual usage is known.
+ESTIMATED_COMPLETION_TOKENS = int(os.getenv("LLM_ESTIMATED_COMPLETION_TOKENS", 512))
+# Longest time a call waits for a throttled model to become available, in seconds.
+ROUTER_MAX_WAIT_SECONDS = float(os.getenv("LLM_ROUTER_MAX_WAIT_SECONDS", 20))
+# How long a model that the API reports as missing is kept out of rotation, in seconds.
+MODEL_NOT_FOUND_COOL_DOWN_SECONDS = 600
+
+# Hedging (opt-in): when the chosen model is slower than this percentile of
+# its recent latencies (time to first token, for streams), the call is also
+# sent to another model and the first answer wins. Hedges need at least
+# LLM_HEDGE_MIN_SAMPLES samples and are limited to LLM_HEDGE_BUDGET_PER_MINUTE.
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 95))
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))
+HEDGE_BUDGET_PER_MINUTE = int(os.getenv("LLM_HEDGE_BUDGET_PER_MINUTE", 10))
+
+
+class _Attempt(NamedTuple):
+    """The outcome of sending a call to one model."""
+    model: str
+    started: float
+    result: Any = None  # A ChatResult, or the first chunk of a stream
+    stream: Optional[AsyncIterator[ChatGenerationChunk]] = None
+    error: Optional[Exception] = None
+    retryable: bool = False
+
+
 class GroqModelRotator(BaseChatModel):
+    """
+    Chat model that routes each call to one of several Groq models.
+
+    Routing is done by a `ModelRouter`: every call goes to the available
+    model with the lowest expected latency, models whose request or token
+    budget is spent or whose circuit breaker is open are skipped, and a call
+    that fails with a rate limit, a missing model or a server error moves on
+    to the next model. Routing state is per model and lock-protected, so
+    concurrent calls do not interfere with one another.
+
+    One ChatGroq instance is kept per model, and all of them share a sync
+    and an async HTTP client with keep-alive connection pools (see
+    `lib.http_pool`), so calls reuse open connections instead of paying a
+    TCP and TLS handshake each time.
+
+    With `hedging` enabled, async calls that run past the tail of the
+    model's recent latency are duplicated to a second model (see
+    HEDGE_PERCENTILE); the first answer is used and the other call is
+    cancelled.
+
+    With a `response_cache` (see `lib.llm_cache`), answers are stored under
+    a fingerprint of the normalized prompt, the models and the temperature,
+    and a repeated prompt is answered from the cache without an API call.
+    """
     models: list[str]
     temperature: float = 0.7
     api_key: str = os.getenv("GROQ_API_KEY")
-    current_model_index: int = 0
+    # Optional (requests per minute, tokens per minute) budget per model.
+    model_limits: Dict[str, Tuple[int, int]] = {}
+    # Duplicate slow async calls to a second model (see HEDGE_PERCENTILE).
+    hedging: bool = False
+    # InMemoryLLMCache, SQLiteLLMCache or None.
+    response_cache: Optional[Any] = None
+
+    _llms: Dict[str, ChatGroq] = PrivateAttr(default_factory=dict)
+    _llms_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _http_clients: Optional[tuple] = PrivateAttr(default=None)
+    _router: ModelRouter = PrivateAttr()
+
+    def model_post_init(self, __context: Any) -> None:
+        super().model_post_init(__context)
+        self._router = ModelRouter(
+            self.models, self.model_limits, hedges_per_minute=HEDGE_BUDGET_PER_MINUTE if self.hedging else 0
+        )
 
     @property
     def model_name(self) -> str:
-        return self.models[self.current_model_index]
+        return self._router.preferred_model()
 
     def _generate(
         self,
@@ -32,26 +105,29 @@ class GroqModelRotator(BaseChatModel):
         run_manager: Optional[CallbackManagerForLLMRun] = None,
         **kwargs: Any,
     ) -> ChatResult:
-        max_retries = len(self.models)
-        for attempt in range(max_retries):
+        cache_key = self._cache_key(messages, stop, kwargs)
+        cached = self._cached_answer(cache_key)
+        if cached is not None:
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=cached))])
+        estimated_tokens = self._estimate_tokens(messages)
+        tried: List[str] = []
+        while True:
+            model = self._acquire_model(estimated_tokens, tried)
+            started = time.monotonic()
             try:
-                llm = self._get_llm()
                 # The actual call to the underlying ChatGroq model
-                response = llm._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
-                return response
-            except (APIStatusError, NotFoundError) as e:
-                if isinstance(e, NotFoundError) or (isinstance(e, APIStatusError) and e.status_code == 429):
-                    logger.warning(f"API error with model: {self.models[self.current_model_index]}. Rotating. Error: {e}")
-                    self._rotate_model()
-                    if attempt == max_retries - 1:
-                        logger.error("All models failed. Raising exception.")
-                        raise e
-                else:
-                    raise e # Re-raise other API errors
+                response = self._get_llm(model)._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
             except Exception as e:
-                logger.error(f"An unexpected error occurred: {e}")
-                raise e
-        raise Exception("Should not reach here")
+                tried.append(model)
+                if not self._record_error(model, e) or len(tried) == len(self.models):
+                    raise e
+                continue
+            except BaseException:
+                self._router.release(model)
+                raise
+            self._router.record_success(model, time.monotonic() - started, estimated_tokens, self._used_tokens(response))
+            self._store_answer(cache_key, response.generations[0].message.content)
+            return response
 
 
     def _stream(
@@ -61,27 +137,38 @@ class GroqModelRotator(BaseChatModel):
         run_manager: Optional[CallbackManagerForLLMRun] = None,
         **kwargs: Any,
     ) -> Iterator[GenerationChunk]:
-        max_retries = len(self.models)
-        for attempt in range(max_retries):
+        cache_key = self._cache_key(messages, stop, kwargs)
+        cached = self._cached_answer(cache_key)
+        if cached is not None:
+            yield ChatGenerationChunk(message=AIMessageChunk(content=cached))
+            return
+        estimated_tokens = self._estimate_tokens(messages)
+        tried: List[str] = []
+        while True:
+            model = self._acquire_model(estimated_tokens, tried)
+            started = time.monotonic()
+            used_tokens = None
+            yielded = False
+            parts = []
             try:
-                llm = self._get_llm()
                 # The actual call to the underlying ChatGroq model stream
-                for chunk in llm._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                for chunk in self._get_llm(model)._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                    used_tokens = self._used_tokens(chunk) or used_tokens
+                    yielded = True
+                    parts.append(chunk.text)
                     yield chunk
-                return # If stream is successful, exit the loop
-            except (APIStatusError, NotFoundError) as e:
-                if isinstance(e, NotFoundError) or (isinstance(e, APIStatusError) and e.status_code == 429):
-                    logger.warning(f"API error with model: {self.models[self.current_model_index]}. Rotating. Error: {e}")
-                    self._rotate_model()
-                    if attempt == max_retries - 1:
-                        logger.error("All models failed. Raising exception.")
-                        raise e
-                else:
-                    raise e # Re-raise other API errors
             except Exception as e:
-                logger.error(f"An unexpected error occurred: {e}")
-                raise e
-        raise Exception("Should not reach here")
+                tried.append(model)
+                # Once part of the answer was sent, another model cannot take over.
+                if not self._record_error(model, e) or yielded or len(tried) == len(self.models):
+                    raise e
+                continue
+            except BaseException:
+                self._router.release(model)
+                raise
+            self._router.record_success(model, time.monotonic() - started, estimated_tokens, used_tokens)
+            self._store_answer(cache_key, "".join(parts))
+            return # If stream is successful, exit the loop
 
     async def _agenerate(
         self,
@@ -90,26 +177,35 @@ class GroqModelRotator(BaseChatModel):
         run_manager: Optional[CallbackManagerForLLMRun] = None,
         **kwargs: Any,
     ) -> ChatResult:
-        max_retries = len(self.models)
-        for attempt in range(max_retries):
+        cache_key = self._cache_key(messages, stop, kwargs)
+        cached = self._cached_answer(cache_key)
+        if cached is not None:
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=cached))])
+        estimated_tokens = self._estimate_tokens(messages)
+        tried: List[str] = []
+
+        async def attempt(model: str) -> _Attempt:
+            started = time.monotonic()
             try:
-                llm = self._get_llm()
                 # The actual call to the underlying ChatGroq model
-                response = await llm._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
-                return response
-            except (APIStatusError, NotFoundError) as e:
-                if isinstance(e, NotFoundError) or (isinstance(e, APIStatusError) and e.status_code == 429):
-                    logger.warning(f"API error with model: {self.models[self.current_model_index]}. Rotating. Error: {e}")
-                    self._rotate_model()
-                    if attempt == max_retries - 1:
-                        logger.error("All models failed. Raising exception.")
-                        raise e
-                else:
-                    raise e # Re-raise other API errors
+                response = await self._get_llm(model)._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
             except Exception as e:
-                logger.error(f"An unexpected error occurred: {e}")
-                raise e
-        raise Exception("Should not reach here")
+                return _Attempt(model, started, error=e, retryable=self._record_error(model, e))
+            except BaseException:
+                self._router.release(model)
+                raise
+            self._router.record_success(model, time.monotonic() - started, estimated_tokens, self._used_tokens(response))
+            return _Attempt(model, started, result=response)
+
+        while True:
+            model = await self._aacquire_model(estimated_tokens, tried)
+            tried.append(model)
+            outcome = await self._ahedge(attempt, model, tried, estimated_tokens, first_token=False)
+            if outcome.error is None:
+                self._store_answer(cache_key, outcome.result.generations[0].message.content)
+                return outcome.result
+            if not outcome.retryable or len(tried) >= len(self.models):
+                raise outcome.error
 
     async def _astream(
         self,
@@ -118,39 +214,253 @@ class GroqModelRotator(BaseChatModel):
         run_manager: Optional[CallbackManagerForLLMRun] = None,
         **kwargs: Any,
     ) -> AsyncIterator[ChatGenerationChunk]:
-        max_retries = len(self.models)
-        for attempt in range(max_retries):
+        cache_key = self._cache_key(messages, stop, kwargs)
+        cached = self._cached_answer(cache_key)
+        if cached is not None:
+            yield ChatGenerationChunk(message=AIMessageChunk(content=cached))
+            return
+        estimated_tokens = self._estimate_tokens(messages)
+        tried: List[str] = []
+
+        async def attempt(model: str) -> _Attempt:
+            """Starts the stream and waits for its first chunk."""
+            started = time.monotonic()
+            # The actual call to the underlying ChatGroq model async stream
+            stream = self._get_llm(model)._astream(messages, stop=stop, run_manager=run_manager, **kwargs)
             try:
-                llm = self._get_llm()
-                # The actual call to the underlying ChatGroq model async stream
-                async for chunk in llm._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
-                    yield chunk
-                return # If stream is successful, exit the loop
-            except (APIStatusError, NotFoundError) as e:
-                if isinstance(e, NotFoundError) or (isinstance(e, APIStatusError) and e.status_code == 429):
-                    logger.warning(f"API error with model: {self.models[self.current_model_index]}. Rotating. Error: {e}")
-                    self._rotate_model()
-                    if attempt == max_retries - 1:
-                        logger.error("All models failed. Raising exception.")
-                        raise e
-                else:
-                    raise e # Re-raise other API errors
+                first_chunk = await stream.__anext__()
+            except StopAsyncIteration:
+                first_chunk = None
+            except Exception as e:
+                return _Attempt(model, started, error=e, retryable=self._record_error(model, e))
+            except BaseException:
+                self._router.release(model)
+                raise
+            return _Attempt(model, started, result=first_chunk, stream=stream)
+
+        while True:
+            model = await self._aacquire_model(estimated_tokens, tried)
+            tried.append(model)
+            outcome = await self._ahedge(attempt, model, tried, estimated_tokens, first_token=True)
+            if outcome.error is not None:
+                if not outcome.retryable or len(tried) >= len(self.models):
+                    raise outcome.error
+                continue
+
+            # Once part of the answer was sent, another model cannot take over.
+            model = outcome.model
+            first_token_latency = time.monotonic() - outcome.started
+            used_tokens = None
+            parts = []
+            try:
+                if outcome.result is not None:
+                    used_tokens = self._used_tokens(outcome.result)
+                    parts.append(outcome.result.text)
+                    yield outcome.result
+                    async for chunk in outcome.stream:
+                        used_tokens = self._used_tokens(chunk) or used_tokens
+                        parts.append(chunk.text)
+                        yield chunk
             except Exception as e:
-                logger.error(f"An unexpected error occurred: {e}")
+                self._record_error(model, e)
                 raise e
-        raise Exception("Should not reach here")
-
-    def _get_llm(self) -> ChatGroq:
-        model_name = self.models[self.current_model_index]
-        return ChatGroq(
-            model=model_name,
-            temperature=self.temperature,
-            api_key=self.api_key
-        )
+            except BaseException:
+                self._router.release(model)
+                raise
+            self._router.record_success(
+                model, time.monotonic() - outcome.started, estimated_tokens, used_tokens,
+                first_token_latency=first_token_latency
+            )
+            self._store_answer(cache_key, "".join(parts))
+            return # If stream is successful, exit the loop
+
+    async def _ahedge(
+        self,
+        attempt: Callable[[str], Awaitable[_Attempt]],
+        model: str,
+        tried: List[str],
+        estimated_tokens: int,
+        first_token: bool
+    ) -> _Attempt:
+        """
+        Runs `attempt` on `model`, duplicating it to a second model when it is slow.
+
+        Without hedging, or without enough latency samples for `model`, this
+        is just `await attempt(model)`. Otherwise, if no result arrives within
+        the HEDGE_PERCENTILE latency, a hedge is sent to another untried model
+        (budget permitting) and the first successful attempt is returned; the
+        other one is cancelled, or closed if it already started streaming.
+        """
+        delay = None
+        if self.hedging:
+            delay = self._router.latency_percentile(model, HEDGE_PERCENTILE, first_token=first_token, min_samples=HEDGE_MIN_SAMPLES)
+        primary = asyncio.ensure_future(attempt(model))
+        if delay is None:
+            return await primary
+
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+        except BaseException:
+            primary.cancel()
+            raise
+        if done:
+            return primary.result()
+        hedge_model = self._router.acquire_hedge(estimated_tokens, exclude=tried)
+        if hedge_model is None:
+            return await primary
+        tried.append(hedge_model)
+        logger.info(f"Model {model} has not answered within {delay:.2f}s; hedging with {hedge_model}.")
+
+        pending = {primary, asyncio.ensure_future(attempt(hedge_model))}
+        failed = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = None
+                for task in done:
+                    outcome = task.result()
+                    if outcome.error is not None:
+                        failed = outcome
+                    elif winner is None:
+                        winner = outcome
+                    else:
+                        await self._adiscard(outcome)
+                if winner is not None:
+                    logger.info(f"Hedged call answered by {winner.model}.")
+                    return winner
+            return failed
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _adiscard(self, outcome: _Attempt) -> None:
+        """Closes a stream that lost a hedge race and frees its model reservation."""
+        if outcome.stream is not None:
+            self._router.release(outcome.model)
+            await outcome.stream.aclose()
+
+    def _acquire_model(self, estimated_tokens: int, tried: List[str]) -> str:
+        """Reserves a model, sleeping while every untried model is throttled."""
+        waited = 0.0
+        while True:
+            model, wait = self._router.acquire(estimated_tokens, exclude=tried)
+            if model:
+                return model
+            if wait is None or waited + wait > ROUTER_MAX_WAIT_SECONDS:
+                raise NoModelAvailableError(wait)
+            logger.info(f"All models are throttled; waiting {wait:.1f}s.")
+            time.sleep(wait)
+            waited += wait
+
+    async def _aacquire_model(self, estimated_tokens: int, tried: List[str]) -> str:
+        """Async variant of `_acquire_model`; waits without blocking the event loop."""
+        waited = 0.0
+        while True:
+            model, wait = self._router.acquire(estimated_tokens, exclude=tried)
+            if model:
+                return model
+            if wait is None or waited + wait > ROUTER_MAX_WAIT_SECONDS:
+                raise NoModelAvailableError(wait)
+            logger.info(f"All models are throttled; waiting {wait:.1f}s.")
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def _record_error(self, model: str, error: Exception) -> bool:
+        """
+        Reports a failed call to the router.
+
+        Returns:
+            True if the call may be retried on another model.
+        """
+        if isinstance(error, RateLimitError):
+            retry_after = error.response.headers.get("retry-after")
+            try:
+                cool_down = float(retry_after) if retry_after else None
+            except ValueError:
+                cool_down = None
+            logger.warning(f"Model {model} is rate limited (retry after {retry_after}). Error: {error}")
+            self._router.record_failure(model, rate_limited=True, cool_down=cool_down)
+            return True
+        if isinstance(error, NotFoundError):
+            logger.warning(f"Model {model} was not found. Error: {error}")
+            self._router.record_failure(model, cool_down=MODEL_NOT_FOUND_COOL_DOWN_SECONDS)
+            return True
+        if isinstance(error, (InternalServerError, APIConnectionError)) or (
+            isinstance(error, APIStatusError) and error.status_code >= 500
+        ):
+            logger.warning(f"Model {model} failed with a server or connection error. Error: {error}")
+            self._router.record_failure(model)
+            return True
+        # Other errors (e.g. an invalid request) would fail on every model.
+        logger.error(f"An unexpected error occurred: {error}")
+        self._router.release(model)
+        return False
+
+    def _cache_key(self, messages: List[BaseMessage], stop: Optional[List[str]], kwargs: Dict[str, Any]) -> Optional[str]:
+        """Returns the response cache key for a call, or None without a cache."""
+        if self.response_cache is None:
+            return None
+        prompt = "\n".join(f"{message.type}: {message.content}" for message in messages)
+        settings = {"models": self.models, "temperature": self.temperature, "stop": stop, "kwargs": kwargs}
+        return prompt_fingerprint(prompt, settings)
+
+    def _cached_answer(self, cache_key: Optional[str]) -> Optional[str]:
+        if cache_key is None:
+            return None
+        answer = self.response_cache.get(cache_key)
+        if answer is not None:
+            logger.info(f"LLM response cache hit: {self.response_cache.stats()}")
+        return answer
+
+    def _store_answer(self, cache_key: Optional[str], answer: Any) -> None:
+        if cache_key is not None and isinstance(answer, str) and answer:
+            self.response_cache.set(cache_key, answer)
+
+    @staticmethod
+    def _estimate_tokens(messages: List[BaseMessage]) -> int:
+        """Estimates prompt plus completion tokens, at about four characters per token."""
+        prompt_chars = sum(len(str(message.content)) for message in messages)
+        return prompt_chars // 4 + ESTIMATED_COMPLETION_TOKENS
+
+    @staticmethod
+    def _used_tokens(result: Any) -> Optional[int]:
+        """Reads the total token usage from a ChatResult or a stream chunk, if reported."""
+        if isinstance(result, ChatResult):
+            usage = (result.llm_output or {}).get("token_usage") or {}
+            return usage.get("total_tokens")
+        usage = getattr(getattr(result, "message", None), "usage_metadata", None)
+        return usage.get("total_tokens") if usage else None
+
+    def _get_llm(self, model_name: str) -> ChatGroq:
+        llm = self._llms.get(model_name)
+        if llm is not None:
+            return llm
+        with self._llms_lock:
+            if model_name not in self._llms:
+                if self._http_clients is None:
+                    self._http_clients = create_pooled_clients("groq")
+                http_client, http_async_client, _ = self._http_clients
+                self._llms[model_name] = ChatGroq(
+                    model=model_name,
+                    temperature=self.temperature,
+                    api_key=self.api_key,
+                    request_timeout=LLM_HTTP_TIMEOUT,
+                    # Retries are left to the router, which moves on to another model instead.
+                    max_retries=0,
+                    http_client=http_client,
+                    http_async_client=http_async_client
+                )
+            return self._llms[model_name]
+
+    def connection_stats(self) -> Dict[str, Any]:
+        """Returns the connection reuse counters of the shared HTTP clients."""
+        if self._http_clients is None:
+            return {"requests": 0, "new_connections": 0, "tls_handshakes": 0, "reused_connections": 0, "reuse_ratio": None}
+        return self._http_clients[2].stats()
 
-    def _rotate_model(self):
-        self.current_model_index = (self.current_model_index + 1) % len(self.models)
-        logger.info(f"Rotated to model: {self.models[self.current_model_index]}")
+    def routing_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Returns the budgets, latency estimates and breaker states of the models."""
+        return self._router.stats()
 
     @property
     def _llm_type(self) -> str:
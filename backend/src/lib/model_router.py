@@ -0,0 +1,339 @@
+"""
+Routing of LLM calls across several models.
+
+Each model has token buckets for its requests-per-minute and
+tokens-per-minute budgets, an exponentially weighted moving average (EWMA)
+of its latency, and a circuit breaker. A call is routed to the available
+model with the lowest expected latency, i.e. its latency average scaled by
+the calls it is already serving; models that have not answered yet are
+tried first. Models whose budget is spent or whose breaker is open are
+skipped until they can take calls again.
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Default per-model budgets, used for models without explicit limits.
+DEFAULT_MODEL_RPM = int(os.getenv("LLM_DEFAULT_RPM", 30))
+DEFAULT_MODEL_TPM = int(os.getenv("LLM_DEFAULT_TPM", 6000))
+# Weight of the newest sample in the latency average.
+LATENCY_EWMA_ALPHA = float(os.getenv("LLM_LATENCY_EWMA_ALPHA", 0.3))
+# Consecutive failures that open a breaker, and seconds before a half-open probe.
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", 3))
+CIRCUIT_RESET_SECONDS = float(os.getenv("LLM_CIRCUIT_RESET_SECONDS", 30))
+# Number of recent latency samples kept per model, for percentiles.
+LATENCY_WINDOW = 100
+# How often to look again at a model whose half-open probe is still running.
+PROBE_POLL_SECONDS = 1.0
+
+
+class NoModelAvailableError(Exception):
+    """Raised when every model is throttled or failing."""
+
+    def __init__(self, retry_after: Optional[float]):
+        detail = f" Retry in {retry_after:.1f}s." if retry_after is not None else ""
+        super().__init__(f"No LLM model is currently available.{detail}")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    A token bucket refilled continuously at `capacity` tokens per minute.
+
+    Not thread-safe on its own; the router serializes access.
+    """
+
+    def __init__(self, capacity: float):
+        self.capacity = capacity
+        self.tokens = capacity
+        self.refill_per_second = capacity / 60.0
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    def available(self, now: float) -> float:
+        """Returns the current balance (negative while paying back underestimated usage)."""
+        self._refill(now)
+        return self.tokens
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Returns the seconds until `amount` tokens are available (0 if they are now)."""
+        self._refill(now)
+        # A request larger than the bucket only has to wait for a full bucket.
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_second
+
+    def consume(self, amount: float) -> None:
+        """Takes `amount` tokens; the balance may go negative when usage was underestimated."""
+        self.tokens -= amount
+
+    def drain(self, now: float) -> None:
+        """Empties the bucket, e.g. after the API reported that the budget is spent."""
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0)
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failure_threshold` consecutive failures (or at
+    once on a rate limit), open -> half-open when the cool-down elapses,
+    then one probe call decides between closed and open again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_seconds: float = CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.open_until = 0.0
+        self.probe_in_flight = False
+
+    def wait_time(self, now: float) -> Optional[float]:
+        """Returns the seconds until a call may be sent, or None while a half-open probe is running."""
+        if self.state == self.OPEN:
+            return max(self.open_until - now, 0.0)
+        if self.state == self.HALF_OPEN and self.probe_in_flight:
+            return None
+        return 0.0
+
+    def on_acquire(self, now: float) -> None:
+        if self.state == self.OPEN and now >= self.open_until:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            self.probe_in_flight = True
+
+    def on_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self.probe_in_flight = False
+
+    def on_failure(self, now: float, cool_down: Optional[float] = None) -> None:
+        self.failures += 1
+        self.probe_in_flight = False
+        if cool_down is not None or self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.open_until = now + (cool_down if cool_down is not None else self.reset_seconds)
+
+
+class _ModelState:
+    def __init__(self, name: str, rpm: int, tpm: int):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.breaker = CircuitBreaker()
+        self.latency_ewma: Optional[float] = None
+        self.latency_samples: deque = deque(maxlen=LATENCY_WINDOW)
+        self.first_token_samples: deque = deque(maxlen=LATENCY_WINDOW)
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+
+    def routing_key(self) -> Tuple[float, int]:
+        # Unmeasured models count as instant so that each one gets sampled;
+        # ties go to the model serving fewer calls.
+        latency = self.latency_ewma if self.latency_ewma is not None else 0.0
+        return latency * (1 + self.in_flight), self.in_flight
+
+
+class ModelRouter:
+    """
+    Picks a model for each LLM call and tracks the outcome.
+
+    All state changes happen under one lock, so concurrent requests never
+    see or cause a half-updated choice.
+    """
+
+    def __init__(
+        self,
+        models: Iterable[str],
+        limits: Optional[Dict[str, Tuple[int, int]]] = None,
+        hedges_per_minute: int = 0
+    ):
+        """
+        Args:
+            models: The model names, in order of preference when latencies tie.
+            limits: Optional (requests per minute, tokens per minute) per model.
+            hedges_per_minute: How many duplicate (hedged) calls may be sent per minute.
+        """
+        limits = limits or {}
+        self._states = {
+            name: _ModelState(name, *limits.get(name, (DEFAULT_MODEL_RPM, DEFAULT_MODEL_TPM)))
+            for name in models
+        }
+        self._hedge_budget = TokenBucket(hedges_per_minute) if hedges_per_minute > 0 else None
+        self.hedges = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, estimated_tokens: int, exclude: Iterable[str] = ()) -> Tuple[Optional[str], Optional[float]]:
+        """
+        Reserves a call on the fastest available model.
+
+        Args:
+            estimated_tokens: The expected prompt plus completion tokens.
+            exclude: Models not to use, e.g. ones that already failed this call.
+
+        Returns:
+            (model, None) when a model was reserved, otherwise (None, seconds
+            until one may be available), where the wait is None if every
+            model is excluded.
+        """
+        with self._lock:
+            return self._acquire_locked(estimated_tokens, set(exclude), time.monotonic())
+
+    def acquire_hedge(self, estimated_tokens: int, exclude: Iterable[str] = ()) -> Optional[str]:
+        """
+        Reserves a model for a duplicate call, if the hedge budget allows one.
+
+        Unlike `acquire`, this never asks the caller to wait: a hedge that
+        cannot be sent right away is skipped.
+
+        Returns:
+            The reserved model, or None.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._hedge_budget is None or self._hedge_budget.wait_time(1, now) > 0:
+                return None
+            model, _ = self._acquire_locked(estimated_tokens, set(exclude), now)
+            if model:
+                self._hedge_budget.consume(1)
+                self.hedges += 1
+            return model
+
+    def latency_percentile(self, model: str, percentile: float, first_token: bool = False, min_samples: int = 1) -> Optional[float]:
+        """
+        Returns a percentile of a model's recent latencies.
+
+        Args:
+            model: The model name.
+            percentile: The percentile, between 0 and 100.
+            first_token: Use time-to-first-token of streamed calls instead
+                of whole-call latencies.
+            min_samples: The number of samples needed for an estimate.
+
+        Returns:
+            The latency in seconds, or None if there are too few samples.
+        """
+        with self._lock:
+            state = self._states[model]
+            samples = sorted(state.first_token_samples if first_token else state.latency_samples)
+        if len(samples) < max(min_samples, 1):
+            return None
+        index = min(int(round(percentile / 100 * (len(samples) - 1))), len(samples) - 1)
+        return samples[index]
+
+    def _acquire_locked(self, estimated_tokens: int, excluded: set, now: float) -> Tuple[Optional[str], Optional[float]]:
+        best = None
+        shortest_wait = None
+        for state in self._states.values():
+            if state.name in excluded:
+                continue
+            breaker_wait = state.breaker.wait_time(now)
+            if breaker_wait is None:
+                # A half-open probe is running; check again shortly.
+                breaker_wait = PROBE_POLL_SECONDS
+            wait = max(
+                breaker_wait,
+                state.requests.wait_time(1, now),
+                state.tokens.wait_time(estimated_tokens, now),
+            )
+            if wait > 0:
+                shortest_wait = wait if shortest_wait is None else min(shortest_wait, wait)
+            elif best is None or state.routing_key() < best.routing_key():
+                best = state
+        if best is None:
+            return None, shortest_wait
+        best.breaker.on_acquire(now)
+        best.requests.consume(1)
+        best.tokens.consume(estimated_tokens)
+        best.in_flight += 1
+        best.calls += 1
+        return best.name, None
+
+    def preferred_model(self) -> str:
+        """Returns the model with the lowest expected latency, without reserving it."""
+        with self._lock:
+            return min(self._states.values(), key=lambda s: s.routing_key()).name
+
+    def record_success(
+        self,
+        model: str,
+        latency: float,
+        estimated_tokens: int,
+        used_tokens: Optional[int] = None,
+        first_token_latency: Optional[float] = None
+    ) -> None:
+        """Updates the latency statistics and corrects the token budget with the actual usage."""
+        with self._lock:
+            state = self._states[model]
+            state.in_flight -= 1
+            state.breaker.on_success()
+            if state.latency_ewma is None:
+                state.latency_ewma = latency
+            else:
+                state.latency_ewma = LATENCY_EWMA_ALPHA * latency + (1 - LATENCY_EWMA_ALPHA) * state.latency_ewma
+            state.latency_samples.append(latency)
+            if first_token_latency is not None:
+                state.first_token_samples.append(first_token_latency)
+            if used_tokens is not None:
+                state.tokens.consume(used_tokens - estimated_tokens)
+
+    def record_failure(self, model: str, rate_limited: bool = False, cool_down: Optional[float] = None) -> None:
+        """
+        Records a failed call.
+
+        A rate-limited model is taken out of rotation at once: its budgets
+        are drained and its breaker opens for `cool_down` seconds (e.g. the
+        API's Retry-After) or the default cool-down. Other failures open
+        the breaker after CIRCUIT_FAILURE_THRESHOLD in a row, or at once
+        when `cool_down` is given.
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._states[model]
+            state.in_flight -= 1
+            state.failures += 1
+            if rate_limited:
+                state.requests.drain(now)
+                state.tokens.drain(now)
+                state.breaker.on_failure(now, cool_down=cool_down if cool_down is not None else CIRCUIT_RESET_SECONDS)
+            else:
+                state.breaker.on_failure(now, cool_down=cool_down)
+            logger.warning(f"[Router] Model {model} failed (rate limited: {rate_limited}); breaker {state.breaker.state}.")
+
+    def release(self, model: str) -> None:
+        """Ends a reserved call that neither succeeded nor failed (e.g. it was cancelled)."""
+        with self._lock:
+            state = self._states[model]
+            state.in_flight -= 1
+            state.breaker.probe_in_flight = False
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Returns the routing state of every model."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                state.name: {
+                    "breaker": state.breaker.state,
+                    "latency_ewma": state.latency_ewma,
+                    "in_flight": state.in_flight,
+                    "requests_available": round(state.requests.available(now), 1),
+                    "tokens_available": round(state.tokens.available(now), 1),
+                    "calls": state.calls,
+                    "failures": state.failures,
+                }
+                for state in self._states.values()
+            }
@@ -0,0 +1,186 @@
+"""
+Async data access for notebooks, files, messages and stored files.
+
+All queries and storage transfers go through one async Supabase client
+whose HTTP connections come from a bounded keep-alive pool, so routes
+await database and storage I/O instead of blocking the event loop with the
+sync client. Authentication (`lib/dependencies.py`) and the data loading
+done in the thread pool keep using the sync client.
+"""
+import os
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from supabase import AsyncClient, AsyncClientOptions, acreate_client
+
+from .http_pool import ConnectionMetrics, create_pooled_async_client
+from .supabase_client import supabase_url, supabase_key
+
+logger = logging.getLogger(__name__)
+
+# Connection pool of the async Supabase client, shared by all requests.
+SUPABASE_HTTP_MAX_CONNECTIONS = int(os.getenv("SUPABASE_HTTP_MAX_CONNECTIONS", 50))
+SUPABASE_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("SUPABASE_HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+# Seconds an idle connection is kept open for reuse.
+SUPABASE_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_HTTP_KEEPALIVE_EXPIRY", 30))
+# Timeout for one database or storage request, in seconds.
+SUPABASE_HTTP_TIMEOUT = float(os.getenv("SUPABASE_HTTP_TIMEOUT", 120))
+# The reuse counters are logged every this many requests; 0 disables the log.
+SUPABASE_HTTP_STATS_LOG_INTERVAL = int(os.getenv("SUPABASE_HTTP_STATS_LOG_INTERVAL", 100))
+
+STORAGE_BUCKET = "mardata-files"
+
+
+class NotebookRepository:
+    """Queries on the `notebooks` table."""
+
+    def __init__(self, client: AsyncClient):
+        self._client = client
+
+    async def list_for_user(self, user_id: str) -> List[Dict[str, Any]]:
+        """Returns a user's notebooks, newest first."""
+        response = await self._client.table("notebooks").select("*").eq("user_id", user_id).order("created_at", desc=True).execute()
+        return response.data
+
+    async def get_for_user(self, notebook_id: str, user_id: str, columns: str = "*") -> Optional[Dict[str, Any]]:
+        """Returns a notebook if it belongs to the user, otherwise None."""
+        response = await self._client.table("notebooks").select(columns).eq("id", notebook_id).eq("user_id", user_id).maybe_single().execute()
+        return response.data if response else None
+
+    async def get(self, notebook_id: str, columns: str = "*") -> Optional[Dict[str, Any]]:
+        """Returns a notebook, or None if it does not exist."""
+        response = await self._client.table("notebooks").select(columns).eq("id", notebook_id).maybe_single().execute()
+        return response.data if response else None
+
+    async def create(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Inserts a notebook and returns the created row."""
+        response = await self._client.table("notebooks").insert(data).execute()
+        return response.data[0]
+
+    async def update(self, notebook_id: str, data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Updates a notebook and returns the updated rows (empty if it does not exist)."""
+        response = await self._client.table("notebooks").update(data).eq("id", notebook_id).execute()
+        return response.data
+
+    async def delete_for_user(self, notebook_id: str, user_id: str) -> List[Dict[str, Any]]:
+        """Deletes a notebook if it belongs to the user and returns the deleted rows."""
+        response = await self._client.table("notebooks").delete().match({"id": notebook_id, "user_id": user_id}).execute()
+        return response.data
+
+
+class FileRepository:
+    """Queries on the `files` table."""
+
+    def __init__(self, client: AsyncClient):
+        self._client = client
+
+    async def create(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Inserts a file record and returns the created row."""
+        response = await self._client.table("files").insert(data).execute()
+        return response.data[0]
+
+    async def find_by_content_hash(self, user_id: str, content_hash: str, columns: str = "*") -> List[Dict[str, Any]]:
+        """Returns a user's files with the given content hash, newest first."""
+        response = await self._client.table("files").select(columns).eq("user_id", user_id).eq("content_hash", content_hash).order("created_at", desc=True).execute()
+        return response.data
+
+
+class MessageRepository:
+    """Queries on the `messages` table."""
+
+    def __init__(self, client: AsyncClient):
+        self._client = client
+
+    async def add(self, notebook_id: str, role: str, content: str) -> Dict[str, Any]:
+        """Saves a chat message and returns the created row."""
+        response = await self._client.table("messages").insert({
+            "notebook_id": notebook_id,
+            "role": role,
+            "content": content,
+        }).execute()
+        return response.data[0]
+
+    async def add_many(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Saves several chat messages in one request."""
+        response = await self._client.table("messages").insert(messages).execute()
+        return response.data
+
+
+class StorageRepository:
+    """Files in the 'mardata-files' storage bucket."""
+
+    def __init__(self, client: AsyncClient, bucket: str = STORAGE_BUCKET):
+        self._client = client
+        self._bucket = bucket
+
+    async def upload_file(self, storage_path: str, local_path: str, content_type: Optional[str] = None, upsert: bool = False) -> None:
+        """
+        Uploads a local file. The open file is handed to the client, which
+        streams it in the request body instead of loading it into memory.
+        With `upsert`, a file already stored at the path is replaced.
+        """
+        file_options = {}
+        if content_type:
+            file_options["content-type"] = content_type
+        if upsert:
+            file_options["upsert"] = "true"
+        with open(local_path, "rb") as f:
+            await self._client.storage.from_(self._bucket).upload(path=storage_path, file=f, file_options=file_options or None)
+
+    async def download(self, storage_path: str) -> bytes:
+        """Downloads a stored file."""
+        return await self._client.storage.from_(self._bucket).download(storage_path)
+
+
+class Repositories:
+    """The repositories, sharing one pooled async client."""
+
+    def __init__(self, client: AsyncClient, metrics: ConnectionMetrics):
+        self.client = client
+        self.metrics = metrics
+        self.notebooks = NotebookRepository(client)
+        self.files = FileRepository(client)
+        self.messages = MessageRepository(client)
+        self.storage = StorageRepository(client)
+
+
+_repositories: Optional[Repositories] = None
+_repositories_lock = asyncio.Lock()
+
+
+async def get_repositories() -> Repositories:
+    """
+    Dependency returning the repositories, creating the async client on first use.
+
+    The client is created inside the running event loop, which its pooled
+    connections belong to.
+    """
+    global _repositories
+    if _repositories is None:
+        async with _repositories_lock:
+            if _repositories is None:
+                http_client, metrics = create_pooled_async_client(
+                    "supabase",
+                    SUPABASE_HTTP_MAX_CONNECTIONS,
+                    SUPABASE_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                    SUPABASE_HTTP_KEEPALIVE_EXPIRY,
+                    SUPABASE_HTTP_TIMEOUT,
+                    SUPABASE_HTTP_STATS_LOG_INTERVAL,
+                )
+                client = await acreate_client(
+                    supabase_url,
+                    supabase_key,
+                    options=AsyncClientOptions(httpx_client=http_client, auto_refresh_token=False, persist_session=False),
+                )
+                _repositories = Repositories(client, metrics)
+                logger.info(f"Created async Supabase client (max {SUPABASE_HTTP_MAX_CONNECTIONS} connections).")
+    return _repositories
+
+
+async def close_repositories() -> None:
+    """Closes the pooled connections of the async client, if it was created."""
+    global _repositories
+    if _repositories is not None:
+        await _repositories.client.options.httpx_client.aclose()
+        _repositories = None
@@ -0,0 +1,27 @@
+"""Helpers for Server-Sent Events responses."""
+import json
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Formats one Server-Sent Events message with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def sse_response(events: AsyncIterator[str], on_close: Optional[Callable[[], Any]] = None) -> StreamingResponse:
+    """
+    Wraps an iterator of formatted events in a streaming response.
+
+    `on_close` is called once the response is over, including when the
+    client disconnected before the stream started.
+    """
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        # Keep proxies from caching or buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(on_close) if on_close else None,
+    )
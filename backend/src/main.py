@@ -2,7 +2,11 @@
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from .routes import upload, chat, auth, notebooks
+from .routes import upload, chat, auth, notebooks, jobs
+from .services.sandbox_pool import sandbox_pool
+from .services.job_worker import job_workers
+from .services.chunk_processing import shutdown_parallel_executor
+from .lib.repositories import close_repositories
 
 app = FastAPI(
     title="MarData API",
@@ -38,6 +42,33 @@ app.include_router(upload.router, prefix="/api", tags=["Data Upload & Analysis"]
 app.include_router(chat.router, prefix="/api", tags=["Interactive Chat"])
 app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(notebooks.router, prefix="/api/notebooks", tags=["Notebooks"])
+app.include_router(jobs.router, prefix="/api/jobs", tags=["Background Jobs"])
+
+@app.on_event("startup")
+def start_sandbox_workers():
+    # Started with the app so the first question doesn't wait for pandas to load.
+    sandbox_pool.start()
+
+@app.on_event("startup")
+async def start_job_workers():
+    job_workers.start()
+
+@app.on_event("shutdown")
+def stop_sandbox_workers():
+    sandbox_pool.shutdown()
+
+@app.on_event("shutdown")
+def stop_analysis_workers():
+    shutdown_parallel_executor()
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    # Before the Supabase connections are closed, since running jobs may still use them.
+    await job_workers.shutdown()
+
+@app.on_event("shutdown")
+async def close_supabase_connections():
+    await close_repositories()
 
 @app.get("/", tags=["Health Check"])
 async def read_root():
@@ -6,6 +6,7 @@ from supabase import Client
 from gotrue.errors import AuthApiError
 
 from ..models.user import User
+from ..lib.concurrency import run_blocking
 from ..lib.dependencies import get_current_user
 from ..lib.supabase_client import get_supabase_client
 
@@ -43,7 +44,9 @@ async def login_for_access_token(
 
     try:
 
-        response = supabase.auth.sign_in_with_password({
+        # The auth client is sync; the call runs in the thread pool to keep the event loop free.
+
+        response = await run_blocking(supabase.auth.sign_in_with_password, {
 
             "email": form_data.username,
 
@@ -91,7 +94,7 @@ async def logout(
 
     try:
 
-        supabase.auth.sign_out()
+        await run_blocking(supabase.auth.sign_out)
 
         return {"message": "Successfully logged out"}
 
@@ -1,12 +1,15 @@
 
 from fastapi import APIRouter, HTTPException, Body, Depends
-from typing import List, Dict, Any
+from typing import AsyncIterator, List, Dict, Any
 from supabase import Client
 from pydantic import BaseModel
 import logging
 
 from ..services import ai_service
+from ..lib.admission import admit_request, estimate_memory
 from ..lib.dependencies import get_current_user
+from ..lib.repositories import Repositories, get_repositories
+from ..lib.sse import format_sse, sse_response
 from ..lib.supabase_client import get_supabase_client
 from ..models.user import User
 
@@ -21,56 +24,119 @@ class ChatRequestBody(BaseModel):
     chat_history: List[Dict[str, Any]]
     statistical_summary: Dict[str, Any]
 
+async def _start_chat_turn(notebook_id: str, payload: ChatRequestBody, current_user: User, repositories: Repositories):
+    """
+    Validates notebook ownership, admits the turn, saves the user's question
+    and returns the notebook, the storage path and version of its file, and
+    the admission, which the caller releases when the turn is done.
+    """
+    # 1. Fetch notebook to validate ownership and get file path
+    notebook = await repositories.notebooks.get(
+        notebook_id, columns="user_id, optimized_file_path, files(storage_path, content_hash, file_size_bytes)"
+    )
+    if not notebook or notebook.get('user_id') != str(current_user.id):
+        raise HTTPException(status_code=403, detail="Forbidden: You do not have access to this notebook.")
+    if not notebook.get('files'):
+        raise HTTPException(status_code=404, detail="No file associated with this notebook.")
+
+    # 2. Wait for admission: the turn may load the dataset and run code on it
+    admission = await admit_request(str(current_user.id), estimate_memory(notebook['files'][0].get('file_size_bytes')), "chat")
+
+    # 3. Save user's question
+    try:
+        user_message = await repositories.messages.add(notebook_id, "user", payload.question)
+    except Exception:
+        admission.release()
+        raise
+    logger.info(f"User message saved: {user_message}")
+
+    # 4. Get the file path
+    file_path = notebook['files'][0]['storage_path']
+    file_version = notebook['files'][0].get('content_hash')
+    logger.info(f"Retrieved file_path from DB: {file_path}")
+    return notebook, file_path, file_version, admission
+
 @router.post("/chat/{notebook_id}")
 async def chat_with_data(
     notebook_id: str,
     payload: ChatRequestBody,
     current_user: User = Depends(get_current_user),
+    repositories: Repositories = Depends(get_repositories),
+    # Used for data loading, which runs in the thread pool
     supabase: Client = Depends(get_supabase_client),
 ):
     """
     Handles follow-up questions for a given notebook.
     """
+    # 1-4. Validate ownership, wait for admission, save the question and get the file path
+    notebook, file_path, file_version, admission = await _start_chat_turn(notebook_id, payload, current_user, repositories)
     try:
-        # 1. Fetch notebook to validate ownership and get file path
-        notebook_response = supabase.table("notebooks").select("user_id, files(storage_path)").eq("id", notebook_id).single().execute()
-        if not notebook_response.data or notebook_response.data.get('user_id') != str(current_user.id):
-            raise HTTPException(status_code=403, detail="Forbidden: You do not have access to this notebook.")
-        
-        notebook = notebook_response.data
-        
-        # 2. Save user's question
-        user_message_response = supabase.table("messages").insert({
-            "notebook_id": notebook_id,
-            "role": "user",
-            "content": payload.question
-        }).execute()
-        logger.info(f"User message saved: {user_message_response.data}")
-
-        # 3. Get the file path
-        if not notebook.get('files'):
-            raise HTTPException(status_code=404, detail="No file associated with this notebook.")
-        file_path = notebook['files'][0]['storage_path']
-        logger.info(f"Retrieved file_path from DB: {file_path}")
-
-        # 4. Get AI insight
-        ai_response = ai_service.get_follow_up_insight(
+        # 5. Get AI insight
+        ai_response = await ai_service.get_follow_up_insight(
             original_analysis=payload.statistical_summary,
             chat_history=payload.chat_history,
             new_question=payload.question,
             file_path=file_path,
-            supabase_client=supabase
+            supabase_client=supabase,
+            notebook_id=notebook_id,
+            file_version=file_version,
+            optimized_file_path=notebook.get('optimized_file_path')
         )
 
-        # 5. Save AI's response to the database
-        ai_message_response = supabase.table("messages").insert({
-            "notebook_id": notebook_id,
-            "role": "assistant",
-            "content": ai_response
-        }).execute()
-        logger.info(f"AI message saved: {ai_message_response.data}")
+        # 6. Save AI's response to the database
+        ai_message = await repositories.messages.add(notebook_id, "assistant", ai_response)
+        logger.info(f"AI message saved: {ai_message}")
 
         return {"response": ai_response}
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
+    finally:
+        admission.release()
+
+@router.post("/chat/{notebook_id}/stream")
+async def stream_chat_with_data(
+    notebook_id: str,
+    payload: ChatRequestBody,
+    current_user: User = Depends(get_current_user),
+    repositories: Repositories = Depends(get_repositories),
+    # Used for data loading, which runs in the thread pool
+    supabase: Client = Depends(get_supabase_client),
+):
+    """
+    Streaming variant of the chat endpoint, using Server-Sent Events.
+
+    Emits "status" events as the pipeline advances, "token" events with
+    pieces of the answer as the model produces them, and a final "done"
+    event with the full answer once it has been saved to `messages`. If the
+    answer cannot be produced, an "error" event is sent instead and nothing
+    is saved.
+    """
+    notebook, file_path, file_version, admission = await _start_chat_turn(notebook_id, payload, current_user, repositories)
+
+    async def event_stream() -> AsyncIterator[str]:
+        # The turn holds its admission until the stream ends; the response releases it
+        # as well, in case the client disconnects before the stream starts.
+        try:
+            async for event in ai_service.stream_follow_up_insight(
+                original_analysis=payload.statistical_summary,
+                chat_history=payload.chat_history,
+                new_question=payload.question,
+                file_path=file_path,
+                supabase_client=supabase,
+                notebook_id=notebook_id,
+                file_version=file_version,
+                optimized_file_path=notebook.get('optimized_file_path')
+            ):
+                if event["event"] == "done":
+                    # Save AI's response before telling the client the turn is complete
+                    ai_message = await repositories.messages.add(notebook_id, "assistant", event["data"]["content"])
+                    logger.info(f"AI message saved: {ai_message}")
+                yield format_sse(event["event"], event["data"])
+        except Exception as e:
+            logger.error(f"Error while streaming chat response for notebook {notebook_id}: {e}", exc_info=True)
+            yield format_sse("error", {"detail": f"An unexpected error occurred: {e}"})
+        finally:
+            admission.release()
+
+    return sse_response(event_stream(), on_close=admission.release)
@@ -0,0 +1,28 @@
+"""API routes for background jobs."""
+from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Any, Dict, List
+
+from ..models.user import User
+from ..lib.concurrency import run_blocking
+from ..lib.dependencies import get_current_user
+from ..services.job_queue import job_queue
+
+router = APIRouter()
+
+@router.get("/{job_id}")
+async def get_job(job_id: str, current_user: User = Depends(get_current_user)) -> Dict[str, Any]:
+    """
+    Returns the status of a background job: queued, running, succeeded or failed,
+    with its attempts, last error and, while it waits for a retry, when it is retried.
+    """
+    job = await run_blocking(job_queue.get, job_id, str(current_user.id))
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found.")
+    return job
+
+@router.get("/")
+async def list_notebook_jobs(notebook_id: str, current_user: User = Depends(get_current_user)) -> List[Dict[str, Any]]:
+    """
+    Returns the background jobs of a notebook, oldest first.
+    """
+    return await run_blocking(job_queue.list_for_group, notebook_id, str(current_user.id))
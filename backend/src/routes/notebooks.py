@@ -1,14 +1,14 @@
 """API routes for notebooks."""
 from fastapi import APIRouter, Depends, HTTPException, status
-from supabase import Client
 from typing import List, Dict, Any
 from uuid import UUID
 from datetime import datetime
 from pydantic import BaseModel
 
 from ..models.user import User
-from ..lib.dependencies import get_current_user
-from ..lib.supabase_client import get_supabase_client
+from ..lib.dependencies import get_current_user, get_current_user_remote
+from ..lib.repositories import Repositories, get_repositories
+from ..services.dataframe_cache import dataframe_cache
 
 # Define a Pydantic model for the notebook response to ensure type safety
 class Notebook(BaseModel):
@@ -47,15 +47,13 @@ router = APIRouter()
 @router.get("/", response_model=List[Notebook])
 async def get_user_notebooks(
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_supabase_client)
+    repositories: Repositories = Depends(get_repositories)
 ):
     """
     Retrieves all notebooks associated with the currently authenticated user.
     """
     try:
-        response = supabase.table('notebooks').select('*').eq('user_id', str(current_user.id)).order('created_at', desc=True).execute()
-        notebooks_data = response.data
-        return notebooks_data
+        return await repositories.notebooks.list_for_user(str(current_user.id))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -63,19 +61,21 @@ async def get_user_notebooks(
 async def get_notebook_details(
     notebook_id: UUID,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_supabase_client)
+    repositories: Repositories = Depends(get_repositories)
 ):
     """
     Retrieves the details, messages, and files for a specific notebook.
     """
     try:
         # Fetch notebook and its related messages and files
-        response = supabase.table('notebooks').select('*, messages(*), files(*)').eq('id', str(notebook_id)).eq('user_id', str(current_user.id)).single().execute()
+        notebook = await repositories.notebooks.get_for_user(
+            str(notebook_id), str(current_user.id), columns='*, messages(*), files(*)'
+        )
 
-        if not response.data:
+        if not notebook:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Notebook not found or you do not have permission to view it.")
 
-        return response.data
+        return notebook
     except Exception as e:
         if isinstance(e, HTTPException):
             raise e
@@ -85,23 +85,22 @@ async def get_notebook_details(
 @router.delete("/{notebook_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_notebook(
     notebook_id: UUID,
-    current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_supabase_client)
+    # Deleting is irreversible, so the token is checked with Supabase Auth for revocation.
+    current_user: User = Depends(get_current_user_remote),
+    repositories: Repositories = Depends(get_repositories)
 ):
     """
     Deletes a specific notebook owned by the authenticated user.
     """
     try:
         # Match both notebook_id and user_id for security
-        response = supabase.table('notebooks').delete().match({
-            'id': str(notebook_id),
-            'user_id': str(current_user.id)
-        }).execute()
+        deleted = await repositories.notebooks.delete_for_user(str(notebook_id), str(current_user.id))
 
-        # The response.data will be empty if no row was found to delete
-        if not response.data:
+        # Nothing is returned if no row was found to delete
+        if not deleted:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Notebook not found or you do not have permission to delete it.")
-        
+
+        dataframe_cache.invalidate(str(notebook_id))
         return # Return 204 No Content on success
 
     except Exception as e:
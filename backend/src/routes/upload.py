@@ -1,15 +1,21 @@
 import uuid
 import tempfile
 import os
+import shutil
+import asyncio
 import logging
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, BackgroundTasks
-from supabase import Client
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
 
 from ..services.chunk_processing import process_spreadsheet_in_chunks
-from ..services.ai_service import get_ai_insights
-from ..services.optimization_service import convert_to_parquet_and_update_record
+from ..services.upload_service import save_upload_to_disk, find_processed_upload, UploadTooLargeError
+from ..services.progress_service import progress_registry, STAGE_STORED, STAGE_ANALYZED
+from ..services.upload_jobs import enqueue_upload_jobs, sync_upload_progress
+from ..lib.admission import admit_request, estimate_memory
+from ..lib.concurrency import run_blocking
 from ..lib.dependencies import get_current_user
-from ..lib.supabase_client import get_supabase_client
+from ..lib.sse import format_sse, sse_response
+from ..lib.repositories import Repositories, get_repositories
 from ..models.user import User
 
 router = APIRouter()
@@ -18,89 +24,154 @@ router = APIRouter()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-async def run_ai_analysis_and_save(
-    notebook_id: str,
-    business_problem: str,
-    analysis_json: str,
-    supabase: Client,
-    temp_path: str,
-    original_file_name: str,
-    user_id: str
-):
-    """Background task to run AI analysis, save results, and optimize for future use."""
-    # Step 1: Get initial AI insight
-    ai_insight = await get_ai_insights(analysis_json, business_problem, notebook_id)
-
-    # Step 2: Store the initial conversation messages
-    messages_to_insert = [
-        {"notebook_id": notebook_id, "role": "user", "content": business_problem},
-        {"notebook_id": notebook_id, "role": "assistant", "content": ai_insight}
-    ]
-    supabase.table("messages").insert(messages_to_insert).execute()
-
-    # Step 3: After analysis, convert the original file to Parquet for optimization
-    await convert_to_parquet_and_update_record(
-        original_file_path=temp_path,
-        original_file_name=original_file_name,
-        notebook_id=notebook_id,
-        user_id=user_id,
-        supabase=supabase
-    )
+# Seconds between progress snapshots sent on the progress stream.
+PROGRESS_STREAM_INTERVAL = float(os.getenv("PROGRESS_STREAM_INTERVAL", 0.5))
+
+async def _create_records(
+    repositories: Repositories,
+    job_id: str,
+    notebook_data: Dict[str, Any],
+    file_data: Dict[str, Any],
+    storage_upload: Optional[asyncio.Task] = None,
+) -> str:
+    """
+    Creates the notebook record and then the record of its file, which is
+    only written once `storage_upload` (if any) has finished, so it never
+    points at a missing object. Returns the notebook ID.
+    """
+    new_notebook = await repositories.notebooks.create(notebook_data)
+    notebook_id = new_notebook['id']
+    progress_registry.attach_notebook(job_id, notebook_id)
+    if storage_upload is not None:
+        await storage_upload
+    await repositories.files.create({**file_data, "notebook_id": notebook_id})
+    progress_registry.set_stage(job_id, STAGE_STORED)
+    return notebook_id
+
+
+async def _run_stages(*stages: Awaitable[Any]) -> List[Any]:
+    """
+    Waits for concurrently running upload stages and returns their results in order.
+
+    Every stage is waited for even when another one fails, so nothing is
+    still using the temporary files when the caller removes them; the first
+    failure is then raised.
+    """
+    results = await asyncio.gather(*stages, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
 
 
 @router.post("/upload/")
 async def upload_file_and_process(
-    background_tasks: BackgroundTasks,
     business_problem: str = Form(...),
     file: UploadFile = File(...),
+    upload_id: Optional[str] = Form(None),
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_supabase_client)
+    repositories: Repositories = Depends(get_repositories)
 ):
     """
     Handles file upload, creates a notebook, triggers analysis, and returns
     the notebook ID and analysis summary in a single call.
+
+    Progress can be followed at /upload/progress/{upload_id} while the
+    request runs, when the client sends an `upload_id` (a 409 is returned if
+    another user's upload has that ID), and at
+    /upload/progress/{notebook_id} for the background steps. The background
+    steps run as queued jobs, whose IDs are returned in `job_ids` and whose
+    status is available at /jobs/{job_id}.
+
+    Uploads go through admission control, with a memory estimate based on
+    the file size; when the server is busy, a 429 with Retry-After is returned.
     """
+    admission = await admit_request(str(current_user.id), estimate_memory(file.size), "upload")
+    job_id = upload_id or f"upload-{uuid.uuid4()}"
+    if not progress_registry.start(job_id, str(current_user.id), total_bytes=file.size):
+        admission.release()
+        raise HTTPException(status_code=409, detail="This upload ID is already in use.")
     temp_dir = tempfile.mkdtemp()
     temp_path = os.path.join(temp_dir, file.filename)
 
     try:
-        # Step 1: Save the uploaded file to a temporary path
-        with open(temp_path, "wb") as buffer:
-            buffer.write(await file.read())
+        # Step 1: Stream the uploaded file to a temporary path, rejecting oversized files
+        saved_upload = await save_upload_to_disk(
+            file, temp_path, progress_callback=lambda n: progress_registry.record_bytes(job_id, n)
+        )
+        logger.info(f"Saved upload {file.filename}: {saved_upload.size_bytes} bytes, sha256 {saved_upload.sha256}")
+
+        # Step 2: Look for an earlier upload of the same content by this user.
+        # If found, its stored file, analysis and Parquet copy are reused as-is.
+        previous_upload = await find_processed_upload(repositories, str(current_user.id), saved_upload.sha256)
 
-        # Step 2: Create the notebook record
         notebook_data = {
             "user_id": str(current_user.id),
             "title": business_problem[:100],
         }
-        notebook_response = supabase.table("notebooks").insert(notebook_data).execute()
-        new_notebook = notebook_response.data[0]
-        notebook_id = new_notebook['id']
-
-        # Step 3: Create a unique path and upload the file to Supabase Storage
-        storage_path = f"{current_user.id}/uploads/{uuid.uuid4()}/{file.filename}"
-        with open(temp_path, 'rb') as f:
-            supabase.storage.from_("mardata-files").upload(
-                path=storage_path,
-                file=f,
-                file_options={"content-type": file.content_type}
-            )
-
-        # Step 4: Create the file record in the database
         file_data = {
-            "notebook_id": notebook_id,
             "user_id": str(current_user.id),
-            "storage_path": storage_path,
             "file_name": file.filename,
             "file_type": file.content_type,
-            "file_size_bytes": os.path.getsize(temp_path),
+            "file_size_bytes": saved_upload.size_bytes,
+            "content_hash": saved_upload.sha256,
         }
-        supabase.table("files").insert(file_data).execute()
 
-        # Step 5: Analyze data and get the analysis summary
-        analysis_summary = process_spreadsheet_in_chunks(temp_path, file.filename)
-        
-        # Step 6: Update the notebook with the analysis cache and data schema
+        if previous_upload:
+            logger.info(f"Reusing processed upload {previous_upload['storage_path']} for sha256 {saved_upload.sha256}")
+            notebook_data.update({
+                "analysis_cache": previous_upload["analysis_cache"],
+                "data_schema": previous_upload["data_schema"],
+                "optimized_file_path": previous_upload["optimized_file_path"],
+            })
+            file_data["storage_path"] = previous_upload["storage_path"]
+            # Step 3: Create the notebook and file records; nothing needs to be uploaded or analyzed.
+            notebook_id = await _create_records(repositories, job_id, notebook_data, file_data)
+
+            # Only the AI insight for the new business problem is generated.
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            progress_registry.set_stage(job_id, STAGE_ANALYZED)
+            job_ids = await run_blocking(
+                enqueue_upload_jobs,
+                notebook_id=notebook_id,
+                user_id=str(current_user.id),
+                business_problem=business_problem,
+                analysis_json=previous_upload["analysis_cache"],
+                original_file_path=None,
+                original_file_name=file.filename
+            )
+            return {
+                "notebook_id": notebook_id,
+                "filename": file.filename,
+                "analysis_summary": previous_upload["analysis_cache"],
+                "job_ids": job_ids,
+                "message": "File already processed; reusing previous analysis.",
+            }
+
+        # Steps 3-6 only need the file on disk, so they run concurrently:
+        #   - the upload to Supabase Storage (network-bound),
+        #   - the notebook and file records, the latter once the upload is done,
+        #   - the analysis in the thread pool (CPU-bound), which writes the
+        #     Parquet copy in the same scan.
+        file_data["storage_path"] = f"{current_user.id}/uploads/{uuid.uuid4()}/{file.filename}"
+        parquet_path = os.path.join(temp_dir, "optimized_data.parquet")
+        storage_upload = asyncio.create_task(
+            repositories.storage.upload_file(file_data["storage_path"], temp_path, file.content_type)
+        )
+        progress_registry.start_analysis(job_id)
+        analysis = asyncio.create_task(run_blocking(
+            process_spreadsheet_in_chunks,
+            temp_path,
+            file.filename,
+            parquet_path=parquet_path,
+            progress_callback=lambda chunks, total, rows: progress_registry.record_chunks(job_id, chunks, total, rows),
+        ))
+        records = asyncio.create_task(
+            _create_records(repositories, job_id, notebook_data, file_data, storage_upload=storage_upload)
+        )
+        _, notebook_id, analysis_summary = await _run_stages(storage_upload, records, analysis)
+
+        # Step 7: Update the notebook with the analysis cache and data schema
         data_schema = {}
         if isinstance(analysis_summary, dict) and 'all_columns' in analysis_summary:
             for col in analysis_summary['all_columns']:
@@ -115,31 +186,88 @@ async def upload_file_and_process(
             "analysis_cache": analysis_summary,
             "data_schema": data_schema,
         }
-        supabase.table("notebooks").update(update_data).eq("id", notebook_id).execute()
+        await repositories.notebooks.update(notebook_id, update_data)
+        progress_registry.set_stage(job_id, STAGE_ANALYZED)
 
-        # Step 7: Add the AI analysis and Parquet conversion to background tasks
-        background_tasks.add_task(
-            run_ai_analysis_and_save,
+        # Step 8: Queue the AI analysis and Parquet conversion for the job workers
+        job_ids = await run_blocking(
+            enqueue_upload_jobs,
             notebook_id=notebook_id,
+            user_id=str(current_user.id),
             business_problem=business_problem,
             analysis_json=analysis_summary,
-            supabase=supabase,
-            temp_path=temp_path,
+            original_file_path=temp_path,
             original_file_name=file.filename,
-            user_id=str(current_user.id)
+            parquet_path=parquet_path if os.path.exists(parquet_path) else None
         )
 
-        # Step 8: Return the immediate response
+        # Step 9: Return the immediate response
         return {
             "notebook_id": notebook_id,
             "filename": file.filename,
             "analysis_summary": analysis_summary,
+            "job_ids": job_ids,
             "message": "File processing started.",
         }
+    except UploadTooLargeError as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        progress_registry.fail(job_id, str(e))
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         logger.error(f"Error during file upload and processing: {e}")
-        # Clean up the temporary file
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-            os.rmdir(temp_dir)
+        progress_registry.fail(job_id, str(e))
+        # Clean up the temporary files
+        shutil.rmtree(temp_dir, ignore_errors=True)
         raise HTTPException(status_code=500, detail="An unexpected error occurred during file processing.")
+    finally:
+        admission.release()
+
+
+async def _current_progress(job_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+    """Returns the progress of an upload, including the state of its queued background jobs."""
+    progress = progress_registry.get(job_id, user_id)
+    if progress and progress["notebook_id"] and not progress["finished"]:
+        await run_blocking(sync_upload_progress, progress["notebook_id"])
+        progress = progress_registry.get(job_id, user_id)
+    return progress
+
+
+@router.get("/upload/progress/{job_id}")
+async def get_upload_progress(job_id: str, current_user: User = Depends(get_current_user)):
+    """
+    Returns the progress of an upload, by upload ID or notebook ID.
+    """
+    progress = await _current_progress(job_id, str(current_user.id))
+    if progress is None:
+        raise HTTPException(status_code=404, detail="No progress information for this upload.")
+    return progress
+
+
+@router.get("/upload/progress/{job_id}/stream")
+async def stream_upload_progress(job_id: str, current_user: User = Depends(get_current_user)):
+    """
+    Streams the progress of an upload as Server-Sent Events.
+
+    A "progress" event carrying the same payload as the polling endpoint is
+    sent whenever the job changes. The stream ends after the job completes
+    or fails.
+    """
+    user_id = str(current_user.id)
+    if progress_registry.get(job_id, user_id) is None:
+        raise HTTPException(status_code=404, detail="No progress information for this upload.")
+
+    async def event_stream() -> AsyncIterator[str]:
+        last_version = None
+        while True:
+            progress = await _current_progress(job_id, user_id)
+            if progress is None:
+                yield format_sse("error", {"detail": "Progress information for this upload has expired."})
+                return
+            if progress["version"] != last_version:
+                last_version = progress["version"]
+                yield format_sse("progress", progress)
+            if progress["finished"]:
+                return
+            await asyncio.sleep(PROGRESS_STREAM_INTERVAL)
+
+    return sse_response(event_stream())
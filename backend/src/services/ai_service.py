@@ -1,9 +1,17 @@
 import json
 import pandas as pd
+import pyarrow as pa
 from io import StringIO
 from supabase import Client
-from . import single_agent_service, code_executor
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+from . import single_agent_service, code_executor, sql_engine
+from .dataframe_cache import dataframe_cache
+from .execution_cache import execution_cache
+from .sandbox_pool import sandbox_pool
+from .shared_datasets import SharedDataset, shared_datasets
+from .parquet_store import fetch_parquet_artifact, parquet_columns, read_parquet_columns
 from ..lib.llm_models import llm_llama_70b
+from ..lib.concurrency import run_blocking
 import re # Import re
 import logging
 
@@ -63,6 +71,49 @@ def build_code_or_text_prompt(chat_history: list, new_question: str, original_an
     {new_question}
     """
 
+def build_sql_or_text_prompt(chat_history: list, new_question: str, original_analysis: str, schema: List[Tuple[str, str]]) -> str:
+    history_lines = []
+    for msg in chat_history:
+        role = "User" if msg.get("role") == "user" else "Assistant"
+        history_lines.append(f"{role}: {msg.get('content', '')}")
+    history_str = "\n".join(history_lines)
+    columns_str = "\n".join(f"    - {name} ({column_type})" for name, column_type in schema)
+
+    return f"""
+    # SYSTEM PROMPT
+    You are a data analysis assistant. Your goal is to answer the user's question based on the provided context.
+
+    **CONTEXT:**
+    1.  **Initial Analysis Summary:** A high-level summary of the dataset is available in the `original_analysis` variable.
+    2.  **Conversation History:** The ongoing conversation is in `history_str`.
+
+    **YOUR TASK:**
+    Based on the user's `new_question`, decide on one of the following two actions:
+
+    1.  **Direct Answer:** If the answer is already available in the conversation history or the initial analysis, provide a direct, concise answer to the user in natural language (Brazilian Portuguese).
+
+    2.  **SQL Query:** If you need to perform a new calculation on the original data (which is available in a table called `{sql_engine.TABLE_NAME}`), you MUST respond with ONLY a JSON object containing the SQL query to be executed. The JSON object must have a single key "sql".
+
+    **RULES FOR SQL QUERIES:**
+    - The query runs on DuckDB. Write exactly one SELECT statement (a WITH clause is allowed).
+    - Query only the `{sql_engine.TABLE_NAME}` table. Quote column names with double quotes.
+    - Aggregate in SQL (GROUP BY, COUNT, AVG, ...) and return only the rows needed to answer; at most {sql_engine.SQL_RESULT_MAX_ROWS} rows are shown.
+    - DO NOT provide any explanation, just the JSON object.
+
+    **Columns of `{sql_engine.TABLE_NAME}`:**
+{columns_str}
+
+    ---
+    **Initial Analysis Summary:**
+    {original_analysis}
+
+    **Conversation History:**
+    {history_str}
+
+    **User's New Question:**
+    {new_question}
+    """
+
 def build_synthesis_prompt(execution_result: str, new_question: str, chat_history: list) -> str:
     history_lines = []
     for msg in chat_history:
@@ -83,15 +134,17 @@ def build_synthesis_prompt(execution_result: str, new_question: str, chat_histor
     Formulate a natural language response that directly answers the user's last question, using the provided data and the context of the conversation. Be direct, helpful, and connect your answer to the previous messages if relevant.
     """
 
-def get_follow_up_insight(original_analysis: dict, chat_history: list, new_question: str, file_path: str, supabase_client: Client) -> str:
-    """
-    Generates a response to a follow-up question, potentially by executing new code.
+def extract_code(llm_response_str: str, key: str = "code") -> Optional[str]:
     """
-    # 1. First attempt: Ask the LLM to either answer directly or generate code.
-    prompt1 = build_code_or_text_prompt(chat_history, new_question, json.dumps(original_analysis, indent=2))
-    llm_response_str = llm_llama_70b.invoke(prompt1).content
-    logger.info(f"LLM raw response: {llm_response_str}") # Log raw response
+    Extracts the code from a `{"code": ...}` JSON block in an LLM response.
 
+    Args:
+        llm_response_str: The LLM response.
+        key: The JSON key holding the code ("code", or "sql" in SQL mode).
+
+    Returns:
+        The code, or None if the response is a natural language answer.
+    """
     # Try to extract a JSON block from the LLM's response
     json_start = llm_response_str.find('{')
     json_end = llm_response_str.rfind('}')
@@ -102,29 +155,189 @@ def get_follow_up_insight(original_analysis: dict, chat_history: list, new_quest
         logger.info(f"Extracted JSON string: {json_str}") # Log extracted JSON
         try:
             response_data = json.loads(json_str)
-            code_to_execute = response_data.get("code")
+            code_to_execute = response_data.get(key)
             logger.info(f"Extracted code: {code_to_execute}") # Log extracted code
         except json.JSONDecodeError as e:
             logger.warning(f"Failed to decode JSON from extracted string: {e}")
             pass # Not a valid JSON, treat as natural language
+    return code_to_execute
+
+def _cached_data(cache_key: tuple, shared: bool) -> Optional[Union[pd.DataFrame, SharedDataset]]:
+    """Returns a cached frame as a shared dataset (if `shared`) or as a copy, or None."""
+    if shared:
+        try:
+            return dataframe_cache.share(cache_key)
+        except pa.ArrowException as e:
+            logger.warning(f"Could not share DataFrame for {cache_key}; sending a copy: {e}")
+    return dataframe_cache.get(cache_key)
+
+def _loaded_data(cache_key: tuple, df: pd.DataFrame, shared: bool) -> Union[pd.DataFrame, SharedDataset]:
+    """Caches a freshly loaded frame and returns it as a shared dataset (if `shared`) or as a copy."""
+    dataframe_cache.put(cache_key, df)
+    if shared:
+        try:
+            # Frames too large for the cache are shared for this call only.
+            return dataframe_cache.share(cache_key, count=False) or shared_datasets.publish(df)
+        except pa.ArrowException as e:
+            logger.warning(f"Could not share DataFrame for {cache_key}; sending a copy: {e}")
+    return df.copy()
+
+def release_notebook_data(data: Union[pd.DataFrame, SharedDataset]) -> None:
+    """Releases data returned by `load_notebook_dataframe` with `shared=True`."""
+    if isinstance(data, SharedDataset):
+        shared_datasets.release(data)
+
+def load_notebook_dataframe(
+    notebook_id: str,
+    file_path: str,
+    supabase_client: Client,
+    file_version: Optional[str] = None,
+    optimized_file_path: Optional[str] = None,
+    code: Optional[str] = None,
+    shared: bool = False
+) -> Union[pd.DataFrame, SharedDataset]:
+    """
+    Loads a notebook's data, using the process-local DataFrame cache.
+
+    The optimized Parquet file is preferred when the notebook has one. If
+    `code` is given, only the columns it references are read from it (see
+    `code_executor.find_referenced_columns`).
+
+    Args:
+        notebook_id: The ID of the notebook the file belongs to.
+        file_path: The storage path of the original file.
+        supabase_client: An initialized Supabase client instance.
+        file_version: Identifies the file contents (e.g. its content hash);
+            defaults to the storage path.
+        optimized_file_path: The storage path of the notebook's Parquet file, if any.
+        code: The code the DataFrame is loaded for.
+        shared: Return the data as a memory-mapped Arrow file for the
+            sandbox workers instead of a DataFrame, when it can be converted.
+
+    Returns:
+        The notebook's data as a DataFrame, or as a SharedDataset that must
+        be released with `release_notebook_data`.
+    """
+    version = file_version or file_path
+    full_key = (notebook_id, version, None)
+
+    if optimized_file_path:
+        local_path = fetch_parquet_artifact(optimized_file_path, supabase_client)
+        available_columns = parquet_columns(local_path)
+        referenced = code_executor.find_referenced_columns(code, available_columns) if code else None
+        columns = [col for col in available_columns if col in referenced] if referenced else None
+        # A cached full frame serves any projection.
+        cache_keys = [(notebook_id, version, tuple(columns)), full_key] if columns else [full_key]
+        for cache_key in cache_keys:
+            data = _cached_data(cache_key, shared)
+            if data is not None:
+                logger.info(f"DataFrame cache hit for {cache_key}: {dataframe_cache.stats()}")
+                return data
+        logger.info(f"Reading {columns or 'all'} columns of {len(available_columns)} from {optimized_file_path}")
+        df = read_parquet_columns(local_path, columns)
+        return _loaded_data(cache_keys[0], df, shared)
+
+    data = _cached_data(full_key, shared)
+    logger.info(f"DataFrame cache {'hit' if data is not None else 'miss'} for {full_key}: {dataframe_cache.stats()}")
+    if data is not None:
+        return data
+
+    # Download the file from Supabase
+    logger.info(f"Attempting to download file from Supabase Storage at: {file_path}")
+    file_content_response = supabase_client.storage.from_("mardata-files").download(file_path)
+    file_content = file_content_response.decode('utf-8')
+
+    # TODO: This assumes CSV. Add logic to handle other file types based on file_path extension.
+    df = pd.read_csv(StringIO(file_content))
+    return _loaded_data(full_key, df, shared)
+
+async def _build_first_prompt(
+    original_analysis: dict,
+    chat_history: list,
+    new_question: str,
+    supabase_client: Client,
+    optimized_file_path: Optional[str]
+) -> Tuple[str, Optional[str]]:
+    """
+    Builds the prompt asking for a direct answer or for code.
+
+    Returns:
+        The prompt and, when the question is answered in SQL mode, the local
+        path of the Parquet file the query will run on (otherwise None).
+    """
+    analysis_str = json.dumps(original_analysis, indent=2)
+    if sql_engine.sql_mode_enabled() and optimized_file_path:
+        parquet_path = await run_blocking(fetch_parquet_artifact, optimized_file_path, supabase_client)
+        schema = await run_blocking(sql_engine.describe_parquet, parquet_path)
+        return build_sql_or_text_prompt(chat_history, new_question, analysis_str, schema), parquet_path
+    return build_code_or_text_prompt(chat_history, new_question, analysis_str), None
+
+async def get_follow_up_insight(
+    original_analysis: dict,
+    chat_history: list,
+    new_question: str,
+    file_path: str,
+    supabase_client: Client,
+    notebook_id: str,
+    file_version: Optional[str] = None,
+    optimized_file_path: Optional[str] = None
+) -> str:
+    """
+    Generates a response to a follow-up question, potentially by executing new code.
+    Data loaded for code execution is kept in a process-local cache keyed by
+    notebook and file version, so later questions skip download and parsing.
+    When the notebook has an optimized Parquet file, only the columns the
+    generated code uses are loaded from it. The output of executed code is
+    cached by file version and normalized code, so a repeated analysis is
+    answered without loading the data or running the code again.
+
+    With CHAT_EXECUTION_MODE=sql and an optimized Parquet file, the LLM
+    writes a SQL query instead, which DuckDB runs directly over the file
+    (see `sql_engine`) without loading the data into a DataFrame.
+
+    LLM calls are awaited and blocking work (downloads, parsing) runs in the
+    shared thread pool. Generated code runs in a sandbox worker process with
+    a timeout and a memory cap, so the event loop is never blocked while a
+    question is answered.
+    """
+    # 1. First attempt: Ask the LLM to either answer directly or generate code.
+    prompt1, parquet_path = await _build_first_prompt(
+        original_analysis, chat_history, new_question, supabase_client, optimized_file_path
+    )
+    llm_response_str = (await llm_llama_70b.ainvoke(prompt1)).content
+    logger.info(f"LLM raw response: {llm_response_str}") # Log raw response
+
+    code_to_execute = extract_code(llm_response_str, "sql" if parquet_path else "code")
 
     if code_to_execute:
         # If we got code, execute it
         try:
-            # Download the file from Supabase
-            logger.info(f"Attempting to download file from Supabase Storage at: {file_path}")
-            file_content_response = supabase_client.storage.from_("mardata-files").download(file_path)
-            file_content = file_content_response.decode('utf-8')
-            
-            # TODO: This assumes CSV. Add logic to handle other file types based on file_path extension.
-            df = pd.read_csv(StringIO(file_content))
+            cache_key = execution_cache.key(file_version or file_path, code_to_execute, "sql" if parquet_path else "python")
+            execution_result = execution_cache.get(cache_key)
+            if execution_result is not None:
+                logger.info(f"Execution cache hit for notebook {notebook_id}: {execution_cache.stats()}")
+            elif parquet_path:
+                # Run the query directly over the Parquet file
+                execution_result = await run_blocking(sql_engine.execute_sql_query, parquet_path, code_to_execute)
+                execution_cache.put(cache_key, execution_result)
+            else:
+                # Load the data, from the cache when possible
+                data = await run_blocking(
+                    load_notebook_dataframe,
+                    notebook_id, file_path, supabase_client, file_version, optimized_file_path, code_to_execute,
+                    sandbox_pool.enabled
+                )
 
-            # Execute the sandboxed code
-            execution_result = code_executor.execute_sandboxed_code(df, code_to_execute)
+                # Execute the sandboxed code
+                try:
+                    execution_result = await sandbox_pool.execute_async(data, code_to_execute)
+                finally:
+                    release_notebook_data(data)
+                execution_cache.put(cache_key, execution_result)
 
             # 2. Second attempt: Synthesize the result into a natural language answer
             prompt2 = build_synthesis_prompt(execution_result, new_question, chat_history)
-            final_answer = llm_llama_70b.invoke(prompt2).content
+            final_answer = (await llm_llama_70b.ainvoke(prompt2)).content
             return final_answer
 
         except Exception as e:
@@ -134,4 +347,105 @@ def get_follow_up_insight(original_analysis: dict, chat_history: list, new_quest
     else:
         # No executable code found, or JSON parsing failed, or no JSON block at all.
         # Treat the entire response as a natural language answer.
-        return llm_response_str
\ No newline at end of file
+        return llm_response_str
+
+# First characters of a first-pass response that may turn out to be a code
+# block; such responses are buffered instead of streamed to the client.
+_CODE_RESPONSE_PREFIXES = ("{", "`")
+
+async def stream_follow_up_insight(
+    original_analysis: dict,
+    chat_history: list,
+    new_question: str,
+    file_path: str,
+    supabase_client: Client,
+    notebook_id: str,
+    file_version: Optional[str] = None,
+    optimized_file_path: Optional[str] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streaming variant of `get_follow_up_insight`.
+
+    Yields events as dictionaries with an "event" name and a "data" payload:
+
+    - "status": a pipeline step has started ("thinking", "generating_code",
+      "loading_data", "executing", "synthesizing").
+    - "token": a piece of the answer text.
+    - "done": the full answer, once it is complete.
+
+    A direct answer is streamed as the model produces it. A first-pass
+    response that starts like a JSON/code block is buffered until it can be
+    parsed; if it holds code, the code runs and the synthesis answer is
+    streamed instead. If it does not, the buffered text is sent as a token.
+    """
+    yield {"event": "status", "data": {"stage": "thinking"}}
+
+    prompt1, parquet_path = await _build_first_prompt(
+        original_analysis, chat_history, new_question, supabase_client, optimized_file_path
+    )
+    response_parts = []
+    buffering = None  # Unknown until the first non-whitespace character arrives
+    async for chunk in llm_llama_70b.astream(prompt1):
+        if not chunk.content:
+            continue
+        response_parts.append(chunk.content)
+        if buffering is None:
+            head = "".join(response_parts).lstrip()
+            if not head:
+                continue
+            buffering = head.startswith(_CODE_RESPONSE_PREFIXES)
+            if buffering:
+                yield {"event": "status", "data": {"stage": "generating_code"}}
+            else:
+                yield {"event": "token", "data": {"text": "".join(response_parts)}}
+        elif not buffering:
+            yield {"event": "token", "data": {"text": chunk.content}}
+
+    llm_response_str = "".join(response_parts)
+    logger.info(f"LLM raw response: {llm_response_str}") # Log raw response
+    code_to_execute = extract_code(llm_response_str, "sql" if parquet_path else "code") if buffering else None
+
+    if not code_to_execute:
+        if buffering:
+            yield {"event": "token", "data": {"text": llm_response_str}}
+        yield {"event": "done", "data": {"content": llm_response_str}}
+        return
+
+    try:
+        cache_key = execution_cache.key(file_version or file_path, code_to_execute, "sql" if parquet_path else "python")
+        execution_result = execution_cache.get(cache_key)
+        if execution_result is not None:
+            logger.info(f"Execution cache hit for notebook {notebook_id}: {execution_cache.stats()}")
+        elif parquet_path:
+            yield {"event": "status", "data": {"stage": "executing"}}
+            execution_result = await run_blocking(sql_engine.execute_sql_query, parquet_path, code_to_execute)
+            execution_cache.put(cache_key, execution_result)
+        else:
+            yield {"event": "status", "data": {"stage": "loading_data"}}
+            data = await run_blocking(
+                load_notebook_dataframe,
+                notebook_id, file_path, supabase_client, file_version, optimized_file_path, code_to_execute,
+                sandbox_pool.enabled
+            )
+
+            yield {"event": "status", "data": {"stage": "executing"}}
+            try:
+                execution_result = await sandbox_pool.execute_async(data, code_to_execute)
+            finally:
+                release_notebook_data(data)
+            execution_cache.put(cache_key, execution_result)
+    except Exception as e:
+        logger.error(f"Unexpected error during file download or code execution: {e}")
+        error_message = f"Sorry, I couldn't process that request. Reason: File Download/Execution Error: {e}"
+        yield {"event": "token", "data": {"text": error_message}}
+        yield {"event": "done", "data": {"content": error_message}}
+        return
+
+    yield {"event": "status", "data": {"stage": "synthesizing"}}
+    prompt2 = build_synthesis_prompt(execution_result, new_question, chat_history)
+    answer_parts = []
+    async for chunk in llm_llama_70b.astream(prompt2):
+        if chunk.content:
+            answer_parts.append(chunk.content)
+            yield {"event": "token", "data": {"text": chunk.content}}
+    yield {"event": "done", "data": {"content": "".join(answer_parts)}}
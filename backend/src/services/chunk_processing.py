@@ -1,55 +1,615 @@
 """
 Service for processing large spreadsheet files in chunks to conserve memory.
 """
+import os
+import io
+import math
+import logging
+import threading
+import multiprocessing
 import pandas as pd
 import numpy as np
-from typing import Dict, Any, List
+from typing import Callable, Dict, Any, List, Optional, Tuple
 from collections import Counter
-import io
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from .csv_reader import (
+    ARROW_BLOCK_SIZE, PYARROW_BACKEND, arrow_supports_options, infer_csv_options, normalize_arrow_table, open_arrow_csv,
+    resolve_backend,
+)
+from .streaming_stats import RunningMoments, QuantileSketch, PairwiseCoMoments, HeavyHitters, HyperLogLog
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 50000
+
+# Parallel mode: number of worker processes, shared by all analyses running
+# at the same time, and the file size below which the process start-up cost
+# outweighs the gain and the file is read serially.
+PARALLEL_WORKERS = int(os.getenv("CHUNK_PROCESSING_WORKERS", min(os.cpu_count() or 1, 4)))
+PARALLEL_MIN_BYTES = int(os.getenv("CHUNK_PROCESSING_PARALLEL_MIN_BYTES", 64 * 1024 * 1024))
+
+# A categorical column is "identifier-like" (order IDs, e-mails, free text)
+# when most of its values are distinct. Such columns are not summarized
+# value by value, since their top values carry no information.
+IDENTIFIER_MIN_DISTINCT = 1000
+IDENTIFIER_DISTINCT_RATIO = 0.5
+
+# Called as progress_callback(chunks_processed, estimated_total_chunks, rows_processed).
+ProgressCallback = Callable[[int, int, int], None]
+
+def _estimate_total_chunks(chunks_processed: int, bytes_processed: int, total_bytes: int) -> int:
+    """Extrapolates the number of chunks in a file from the bytes read so far."""
+    if bytes_processed <= 0:
+        return chunks_processed
+    return max(chunks_processed, math.ceil(chunks_processed * total_bytes / bytes_processed))
+
 
 def _convert_numpy_types(obj):
-    """Recursively converts numpy number types to native Python types for JSON serialization."""
+    """
+    Recursively converts numpy number types to native Python types for JSON serialization.
+    NaN and infinite floats, such as the standard deviation of a single value or the
+    correlation of a constant column, become None, since JSON cannot represent them.
+    """
     if isinstance(obj, dict):
         return {k: _convert_numpy_types(v) for k, v in obj.items()}
-    if isinstance(obj, list):
+    if isinstance(obj, (list, tuple)):
         return [_convert_numpy_types(i) for i in obj]
     if isinstance(obj, np.integer):
         return int(obj)
-    if isinstance(obj, np.floating):
-        return float(obj)
+    if isinstance(obj, (float, np.floating)):
+        return float(obj) if math.isfinite(obj) else None
     if isinstance(obj, np.ndarray):
-        return obj.tolist()
+        return _convert_numpy_types(obj.tolist())
     return obj
 
-def _infer_csv_options(file_path: str) -> dict:
+class _ChunkedAnalysis:
     """
-    Infers decimal and thousands separators for a CSV file from a sample.
+    Partial statistics for a spreadsheet, built one chunk at a time.
+
+    All state is made of mergeable accumulators, so the memory used does
+    not grow with the number of rows and two partial analyses can be
+    combined with `merge`.
+    """
+
+    def __init__(self, all_columns: List[str], numerical_cols: List[str], categorical_cols: List[str], dtypes: Dict[str, str]):
+        self.all_columns = all_columns
+        self.numerical_cols = numerical_cols
+        self.categorical_cols = categorical_cols
+        self.dtypes = dtypes
+        self.total_records = 0
+        self.non_null_counts = Counter()
+        self.missing_values_counter = Counter()
+        self.heavy_hitters = {col: HeavyHitters() for col in categorical_cols}
+        self.distinct_counters = {col: HyperLogLog() for col in categorical_cols}
+        self.moments = {col: RunningMoments() for col in numerical_cols}
+        self.sketches = {col: QuantileSketch() for col in numerical_cols}
+        self.comoments = PairwiseCoMoments(len(numerical_cols))
+
+    @classmethod
+    def from_chunk(cls, chunk: pd.DataFrame) -> "_ChunkedAnalysis":
+        """Creates an empty partial analysis using the columns and dtypes of `chunk`."""
+        return cls(
+            all_columns=chunk.columns.tolist(),
+            numerical_cols=chunk.select_dtypes(include=['number']).columns.tolist(),
+            categorical_cols=chunk.select_dtypes(include=['object', 'category']).columns.tolist(),
+            dtypes={col: str(dtype) for col, dtype in chunk.dtypes.items()},
+        )
+
+    @classmethod
+    def from_arrow_schema(cls, schema: pa.Schema) -> "_ChunkedAnalysis":
+        """Creates an empty partial analysis from a normalized Arrow schema."""
+        numerical_cols = [f.name for f in schema if pa.types.is_integer(f.type) or pa.types.is_floating(f.type)]
+        categorical_cols = [f.name for f in schema if pa.types.is_string(f.type) or pa.types.is_large_string(f.type)]
+        return cls(
+            all_columns=schema.names,
+            numerical_cols=numerical_cols,
+            categorical_cols=categorical_cols,
+            dtypes={col: str(dtype) for col, dtype in schema.empty_table().to_pandas().dtypes.items()},
+        )
+
+    def update(self, chunk: pd.DataFrame) -> None:
+        """Adds a cleaned chunk to the partial statistics."""
+        self.total_records += len(chunk)
+        self.missing_values_counter.update(chunk.isnull().sum().to_dict())
+        self.non_null_counts.update(chunk.count().to_dict())
+
+        # Aggregate value counts for categorical columns into fixed-size summaries
+        for col in self.categorical_cols:
+            self._update_categorical(col, chunk[col].value_counts())
+
+        # Aggregate descriptive stats for numerical columns. Later chunks may
+        # infer a different dtype, so values are coerced and bad cells skipped.
+        if self.numerical_cols:
+            self._update_numerical(
+                chunk[self.numerical_cols].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+            )
+
+    def update_arrow(self, table: pa.Table) -> None:
+        """
+        Adds a cleaned Arrow table to the partial statistics.
+
+        Statistics are computed with `pyarrow.compute`; only the distinct
+        values of categorical columns are converted to Python objects.
+        """
+        self.total_records += table.num_rows
+        for col in self.all_columns:
+            null_count = table.column(col).null_count
+            self.missing_values_counter[col] += null_count
+            self.non_null_counts[col] += table.num_rows - null_count
+
+        for col in self.categorical_cols:
+            counts = pc.value_counts(table.column(col).drop_null())
+            if len(counts) == 0:
+                continue
+            self._update_categorical(
+                col,
+                pd.Series(counts.field('counts').to_numpy(), index=counts.field('values').to_pylist()),
+            )
+
+        if self.numerical_cols:
+            self._update_numerical(np.column_stack([
+                pc.cast(table.column(col), pa.float64()).to_numpy() for col in self.numerical_cols
+            ]))
+
+    def _update_categorical(self, col: str, counts: pd.Series) -> None:
+        self.heavy_hitters[col].update(counts)
+        self.distinct_counters[col].update(counts.index.to_series())
+
+    def _update_numerical(self, values: np.ndarray) -> None:
+        for i, col in enumerate(self.numerical_cols):
+            self.moments[col].update(values[:, i])
+            self.sketches[col].update(values[:, i])
+        self.comoments.update(values)
+
+    def merge(self, other: "_ChunkedAnalysis") -> None:
+        """Merges another partial analysis over the same columns into this one."""
+        self.total_records += other.total_records
+        self.missing_values_counter.update(other.missing_values_counter)
+        self.non_null_counts.update(other.non_null_counts)
+        for col in self.categorical_cols:
+            self.heavy_hitters[col].merge(other.heavy_hitters[col])
+            self.distinct_counters[col].merge(other.distinct_counters[col])
+        for col in self.numerical_cols:
+            self.moments[col].merge(other.moments[col])
+            self.sketches[col].merge(other.sketches[col])
+        self.comoments.merge(other.comoments)
+
+    def _dataframe_info(self) -> str:
+        """Builds a text summary in the same layout as `DataFrame.info()`."""
+        name_width = max([len('Column')] + [len(str(col)) for col in self.all_columns])
+        count_width = max([len('Non-Null Count')] + [len(f"{n} non-null") for n in self.non_null_counts.values()])
+        lines = [
+            "<class 'pandas.core.frame.DataFrame'>",
+            f"RangeIndex: {self.total_records} entries, 0 to {max(self.total_records - 1, 0)}",
+            f"Data columns (total {len(self.all_columns)} columns):",
+            f" #   {'Column':<{name_width}}  {'Non-Null Count':<{count_width}}  Dtype",
+            f"---  {'------':<{name_width}}  {'-' * len('Non-Null Count'):<{count_width}}  -----",
+        ]
+        for i, col in enumerate(self.all_columns):
+            non_null = f"{self.non_null_counts.get(col, 0)} non-null"
+            lines.append(f" {i:<3} {str(col):<{name_width}}  {non_null:<{count_width}}  {self.dtypes.get(col, 'unknown')}")
+        dtype_counts = Counter(self.dtypes.values())
+        lines.append("dtypes: " + ", ".join(f"{dtype}({n})" for dtype, n in sorted(dtype_counts.items())))
+        return "\n".join(lines) + "\n"
+
+    def finalize(self) -> Dict[str, Any]:
+        """Consolidates the partial statistics into the analysis summary."""
+        final_analysis = {}
+        final_analysis['total_records'] = self.total_records
+        final_analysis['all_columns'] = self.all_columns
+        final_analysis['numerical_cols'] = self.numerical_cols
+        final_analysis['categorical_cols'] = self.categorical_cols
+        final_analysis['dataframe_info'] = self._dataframe_info()
+
+        # Consolidate descriptive stats, using the same keys as DataFrame.describe()
+        final_descriptive_stats = {}
+        for col in self.numerical_cols:
+            moments = self.moments[col]
+            q25, q50, q75 = self.sketches[col].quantiles([0.25, 0.5, 0.75])
+            final_descriptive_stats[col] = {
+                'count': moments.count,
+                'mean': moments.mean,
+                'std': moments.std,
+                'min': moments.min if moments.count > 0 else 0,
+                '25%': q25,
+                '50%': q50,
+                '75%': q75,
+                'max': moments.max if moments.count > 0 else 0,
+            }
+        final_analysis['descriptive_stats'] = final_descriptive_stats
+
+        if len(self.numerical_cols) > 1:
+            corr = pd.DataFrame(self.comoments.correlation(), index=self.numerical_cols, columns=self.numerical_cols)
+            final_analysis['correlation_matrix'] = corr.to_dict()
+        else:
+            final_analysis['correlation_matrix'] = "Not enough numerical columns to compute correlation."
+
+        # Consolidate value counts, skipping identifier-like columns
+        final_value_counts = {}
+        value_count_errors = {}
+        distinct_counts = {}
+        identifier_like_cols = []
+        for col in self.categorical_cols:
+            distinct = self.distinct_counters[col].estimate()
+            distinct_counts[col] = distinct
+            non_null = self.non_null_counts.get(col, 0)
+            if distinct >= IDENTIFIER_MIN_DISTINCT and distinct >= IDENTIFIER_DISTINCT_RATIO * non_null:
+                identifier_like_cols.append(col)
+                continue
+            final_value_counts[col] = self.heavy_hitters[col].top(20)
+            value_count_errors[col] = self.heavy_hitters[col].error
+        final_analysis['value_counts'] = final_value_counts
+        # Counts above are lower bounds; each may be short by at most this many occurrences.
+        final_analysis['value_counts_max_error'] = value_count_errors
+        final_analysis['distinct_counts'] = distinct_counts
+        final_analysis['identifier_like_cols'] = identifier_like_cols
+
+        # Consolidate missing values
+        final_analysis['missing_values'] = {k: v for k, v in self.missing_values_counter.items() if v > 0}
+
+        # Convert all numpy types to native Python types for JSON serialization
+        return _convert_numpy_types(final_analysis)
+
+
+class _ByteRangeReader(io.RawIOBase):
+    """A read-only file object limited to the [start, end) byte range of a file."""
+
+    def __init__(self, raw, start: int, end: int):
+        self._raw = raw
+        self._raw.seek(start)
+        self._remaining = end - start
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._remaining <= 0:
+            return 0
+        size = min(len(buffer), self._remaining)
+        data = self._raw.read(size)
+        buffer[:len(data)] = data
+        self._remaining -= len(data)
+        return len(data)
+
+
+def _split_byte_ranges(file_path: str, n_ranges: int) -> List[Tuple[int, int]]:
+    """
+    Splits the data rows of a CSV file (after the header) into byte ranges.
+
+    Every boundary is moved forward to the start of the next line, so each
+    range holds whole rows. Quoted fields spanning several lines are not
+    supported; they surface as parser errors in the worker.
 
     Args:
         file_path: The path to the CSV file.
+        n_ranges: The desired number of ranges.
 
     Returns:
-        A dictionary with 'decimal' and 'thousands' keys for pandas.read_csv.
+        A list of (start, end) byte offsets.
     """
+    file_size = os.path.getsize(file_path)
     with open(file_path, 'rb') as f:
-        sample_bytes = f.read(2048)
-    
-    sample_str = sample_bytes.decode(errors='ignore')
-    if sample_str.count(',') > sample_str.count('.'):
-        return {'decimal': ',', 'thousands': '.'}
-    
-    return {'decimal': '.', 'thousands': ','}
+        f.readline()  # Skip the header
+        boundaries = [f.tell()]
+        data_size = file_size - boundaries[0]
+        for i in range(1, n_ranges):
+            f.seek(boundaries[0] + data_size * i // n_ranges)
+            f.readline()
+            position = f.tell()
+            if position >= file_size:
+                break
+            if position > boundaries[-1]:
+                boundaries.append(position)
+    boundaries.append(file_size)
+    return [(start, end) for start, end in zip(boundaries[:-1], boundaries[1:]) if end > start]
 
-def process_spreadsheet_in_chunks(file_path: str, file_name: str) -> Dict[str, Any]:
+
+class _ParquetSink:
+    """
+    Writes the raw chunks read during analysis to a Parquet file, so the
+    upload is converted in the same scan instead of being read again.
+
+    Every chunk must fit the schema of the first one. When a chunk does not
+    (e.g. a column inferred as integer later holds decimals), the sink gives
+    up, deletes the partial file and `close` returns False.
+    """
+
+    def __init__(self, path: str, schema: Optional[pa.Schema] = None):
+        self.path = path
+        self.schema = schema
+        self.failed = False
+        self._writer = None
+
+    def write_frame(self, chunk: pd.DataFrame) -> None:
+        """Writes a raw pandas chunk, converting it to the sink's schema."""
+        if self.failed:
+            return
+        try:
+            table = pa.Table.from_pandas(chunk, schema=self.schema, preserve_index=False)
+        except (pa.ArrowException, ValueError, TypeError) as e:
+            self._fail(e)
+            return
+        self.write_table(table)
+
+    def write_table(self, table: pa.Table) -> None:
+        """Writes a raw Arrow table or record batch."""
+        if self.failed:
+            return
+        try:
+            if self._writer is None:
+                self.schema = self.schema or table.schema
+                self._writer = pq.ParquetWriter(self.path, self.schema)
+            if isinstance(table, pa.RecordBatch):
+                self._writer.write_batch(table)
+            else:
+                self._writer.write_table(table)
+        except (pa.ArrowException, ValueError) as e:
+            self._fail(e)
+
+    def _fail(self, error: Exception) -> None:
+        logger.warning(f"Chunk does not fit the Parquet schema, skipping single-pass conversion: {error}")
+        self.failed = True
+        self.close()
+
+    def close(self) -> bool:
+        """Closes the file. Returns True if it holds every chunk."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self.failed and os.path.exists(self.path):
+            os.remove(self.path)
+        return not self.failed and os.path.exists(self.path)
+
+
+def _analyze_byte_range(
+    file_path: str,
+    start: int,
+    end: int,
+    options: dict,
+    all_columns: List[str],
+    numerical_cols: List[str],
+    categorical_cols: List[str],
+    dtypes: Dict[str, str],
+    parquet_path: Optional[str] = None,
+    parquet_schema: Optional[pa.Schema] = None,
+) -> Tuple["_ChunkedAnalysis", bool]:
+    """
+    Worker entry point: analyzes the rows in one byte range of a CSV file.
+
+    Returns:
+        The partial analysis, and whether the range was written to `parquet_path`.
+    """
+    analysis = _ChunkedAnalysis(all_columns, numerical_cols, categorical_cols, dtypes)
+    sink = _ParquetSink(parquet_path, parquet_schema) if parquet_path else None
+    with open(file_path, 'rb') as raw:
+        reader = io.BufferedReader(_ByteRangeReader(raw, start, end))
+        chunk_iterator = pd.read_csv(
+            reader,
+            header=None,
+            names=all_columns,
+            # Keep categorical columns as text even if a range looks numeric.
+            dtype={col: 'object' for col in categorical_cols},
+            chunksize=CHUNK_SIZE,
+            sep=options['sep'],
+            decimal=options['decimal'],
+            thousands=options['thousands']
+        )
+        for chunk in chunk_iterator:
+            if sink:
+                sink.write_frame(chunk)
+            chunk.fillna(0, inplace=True)
+            chunk.drop_duplicates(inplace=True)
+            analysis.update(chunk)
+    return analysis, sink.close() if sink else False
+
+
+def _concatenate_parquet_parts(part_paths: List[str], parquet_path: str) -> None:
+    """Concatenates Parquet files with the same schema, one row group at a time."""
+    writer = None
+    try:
+        for part_path in part_paths:
+            part = pq.ParquetFile(part_path)
+            if writer is None:
+                writer = pq.ParquetWriter(parquet_path, part.schema_arrow)
+            for i in range(part.num_row_groups):
+                writer.write_table(part.read_row_group(i))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+_parallel_executor: Optional[ProcessPoolExecutor] = None
+_parallel_executor_lock = threading.Lock()
+
+
+def _get_parallel_executor() -> ProcessPoolExecutor:
+    """
+    Returns the process pool shared by all parallel analyses, creating it on
+    first use. Its workers come from the forkserver rather than being forked
+    from the API process, whose threads may hold locks at the time of the fork.
+    """
+    global _parallel_executor
+    with _parallel_executor_lock:
+        if _parallel_executor is None:
+            _parallel_executor = ProcessPoolExecutor(
+                max_workers=PARALLEL_WORKERS, mp_context=multiprocessing.get_context("forkserver")
+            )
+        return _parallel_executor
+
+
+def _discard_parallel_executor(executor: ProcessPoolExecutor) -> None:
+    """Drops a broken pool, so the next analysis starts a new one."""
+    global _parallel_executor
+    with _parallel_executor_lock:
+        if _parallel_executor is executor:
+            _parallel_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_parallel_executor() -> None:
+    """Stops the worker processes of the parallel analyses, if they were started."""
+    global _parallel_executor
+    with _parallel_executor_lock:
+        executor, _parallel_executor = _parallel_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _process_csv_in_parallel(
+    file_path: str,
+    options: dict,
+    max_workers: int,
+    parquet_path: Optional[str] = None,
+    progress_callback: Optional[ProgressCallback] = None,
+) -> Dict[str, Any]:
+    """
+    Analyzes a CSV file by splitting it into line-aligned byte ranges, one
+    per worker process, and reducing the partial analyses into one summary.
+    When `parquet_path` is given, every worker also writes its range to a
+    Parquet part and the parts are concatenated in order.
+    """
+    # The column layout comes from a sample, so every worker uses the same one.
+    sample = pd.read_csv(file_path, nrows=CHUNK_SIZE, sep=options['sep'], decimal=options['decimal'], thousands=options['thousands'])
+    analysis = _ChunkedAnalysis.from_chunk(sample)
+    parquet_schema = pa.Schema.from_pandas(sample.astype({col: 'object' for col in analysis.categorical_cols}), preserve_index=False)
+    del sample
+
+    ranges = _split_byte_ranges(file_path, max_workers)
+    part_paths = [f"{parquet_path}.part{i}" for i in range(len(ranges))] if parquet_path else [None] * len(ranges)
+    logger.info(f"Analyzing {file_path} in {len(ranges)} byte ranges with up to {max_workers} processes.")
+    parts_written = []
+    executor = _get_parallel_executor()
+    futures = []
+    try:
+        futures = [
+            executor.submit(
+                _analyze_byte_range,
+                file_path, start, end, options,
+                analysis.all_columns, analysis.numerical_cols, analysis.categorical_cols, analysis.dtypes,
+                part_path, parquet_schema,
+            )
+            for (start, end), part_path in zip(ranges, part_paths)
+        ]
+        for i, future in enumerate(futures, start=1):
+            partial, written = future.result()
+            analysis.merge(partial)
+            parts_written.append(written)
+            if progress_callback:
+                progress_callback(i, len(futures), analysis.total_records)
+        if parquet_path and parts_written and all(parts_written):
+            _concatenate_parquet_parts(part_paths, parquet_path)
+    except BrokenProcessPool:
+        _discard_parallel_executor(executor)
+        raise
+    finally:
+        # Ranges not started yet are dropped; running ones finish before their parts are removed.
+        for future in futures:
+            future.cancel()
+        for future in futures:
+            if not future.cancelled():
+                future.exception()
+        for part_path in part_paths:
+            if part_path and os.path.exists(part_path):
+                os.remove(part_path)
+    return analysis.finalize()
+
+
+def _clean_arrow_table(table: pa.Table) -> pa.Table:
+    """Applies the same cleaning as the pandas path: fill missing values, drop duplicate rows."""
+    table = normalize_arrow_table(table)
+    for i, field in enumerate(table.schema):
+        if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+            table = table.set_column(i, field.name, pc.fill_null(table.column(i), '0'))
+        elif pa.types.is_integer(field.type) or pa.types.is_floating(field.type):
+            table = table.set_column(i, field.name, pc.fill_null(table.column(i), 0))
+    try:
+        table = table.group_by(table.schema.names).aggregate([])
+    except (pa.ArrowNotImplementedError, pa.ArrowInvalid):
+        pass  # Some column types cannot be grouped on; keep the duplicates.
+    return table
+
+
+def _process_csv_with_arrow(
+    file_path: str,
+    options: dict,
+    parquet_path: Optional[str] = None,
+    progress_callback: Optional[ProgressCallback] = None,
+) -> Dict[str, Any]:
+    """
+    Analyzes a CSV file with the streaming Arrow reader, one record batch
+    at a time. Parsing is multithreaded inside Arrow. Each raw batch is
+    also written to `parquet_path` when given.
+    """
+    reader = open_arrow_csv(file_path, options)
+    sink = _ParquetSink(parquet_path, reader.schema) if parquet_path else None
+    analysis = None
+    file_size = os.path.getsize(file_path)
+    try:
+        for n_batches, batch in enumerate(reader, start=1):
+            if sink:
+                sink.write_table(batch)
+            table = _clean_arrow_table(pa.Table.from_batches([batch]))
+            if analysis is None:
+                analysis = _ChunkedAnalysis.from_arrow_schema(table.schema)
+            analysis.update_arrow(table)
+            if progress_callback:
+                # Every batch but the last is parsed from one block of ARROW_BLOCK_SIZE bytes.
+                bytes_read = min(n_batches * ARROW_BLOCK_SIZE, file_size)
+                progress_callback(n_batches, _estimate_total_chunks(n_batches, bytes_read, file_size), analysis.total_records)
+    except pa.ArrowInvalid:
+        if sink:
+            sink.failed = True
+        raise
+    finally:
+        if sink:
+            sink.close()
+
+    if analysis is None:
+        analysis = _ChunkedAnalysis.from_arrow_schema(normalize_arrow_table(reader.schema.empty_table()).schema)
+    return analysis.finalize()
+
+
+def process_spreadsheet_in_chunks(
+    file_path: str,
+    file_name: str,
+    parallel: Optional[bool] = None,
+    reader_backend: Optional[str] = None,
+    parquet_path: Optional[str] = None,
+    progress_callback: Optional[ProgressCallback] = None,
+) -> Dict[str, Any]:
     """
     Reads and analyzes a spreadsheet in chunks to keep memory usage low.
 
     This function is designed primarily for large CSV files. For other formats,
     it may fall back to in-memory processing if chunking is not supported.
+    CSV statistics are computed in a single pass with mergeable accumulators,
+    so the summary has the same shape as `generate_descriptive_analysis`
+    (quantiles are approximate for files larger than the sketch capacity).
 
     Args:
         file_path: The local path to the spreadsheet file.
         file_name: The original name of the file to determine its type.
+        parallel: Whether to analyze a CSV file with a pool of worker processes.
+            By default, files of at least PARALLEL_MIN_BYTES are processed in
+            parallel when more than one worker is configured. If the parallel
+            run fails (e.g. quoted fields spanning lines), the file is
+            analyzed serially instead. Not used with the "pyarrow" backend,
+            which parses blocks on several threads by itself.
+        reader_backend: "pandas" or "pyarrow"; defaults to CSV_READER_BACKEND.
+            If Arrow cannot convert a later block to the types inferred from
+            the first one, the file is analyzed again with pandas.
+        parquet_path: If given, the raw data is also written to this Parquet
+            file during the same scan. The file only exists afterwards if the
+            conversion succeeded, so callers should check for it.
+        progress_callback: Called after each chunk with the number of chunks
+            processed, the estimated total number of chunks (extrapolated
+            from the bytes read so far) and the number of rows analyzed. In
+            parallel mode, a chunk is one worker's byte range.
 
     Returns:
         A dictionary containing the consolidated statistical summary.
@@ -58,104 +618,75 @@ def process_spreadsheet_in_chunks(file_path: str, file_name: str) -> Dict[str, A
         # Fallback for non-CSV files like Excel, processing them in-memory for now.
         # This maintains previous functionality for other file types.
         df = pd.read_excel(file_path) if file_name.endswith(('.xls', '.xlsx')) else pd.read_csv(file_path)
+        if parquet_path:
+            try:
+                df.to_parquet(parquet_path, engine='pyarrow')
+            except (pa.ArrowException, ValueError, TypeError) as e:
+                logger.warning(f"Could not write {file_name} to Parquet during analysis: {e}")
+                if os.path.exists(parquet_path):
+                    os.remove(parquet_path)
         df.fillna(0, inplace=True)
         df.drop_duplicates(inplace=True)
         # This part will be memory intensive for large non-csv files.
         # The user story is focused on CSV, so this is an acceptable trade-off.
         from .data_analysis import generate_descriptive_analysis
+        if progress_callback:
+            progress_callback(1, 1, len(df))
         return generate_descriptive_analysis(df)
 
+    options = infer_csv_options(file_path)
+
+    if resolve_backend(reader_backend) == PYARROW_BACKEND:
+        if not arrow_supports_options(options):
+            logger.info(f"Arrow cannot parse {file_path} with {options}; reading it with pandas.")
+        else:
+            try:
+                return _process_csv_with_arrow(file_path, options, parquet_path, progress_callback)
+            except pa.ArrowInvalid as e:
+                logger.warning(f"Arrow could not read {file_path}, falling back to pandas: {e}")
+
+    if parallel is None:
+        parallel = PARALLEL_WORKERS > 1 and os.path.getsize(file_path) >= PARALLEL_MIN_BYTES
+    if parallel:
+        try:
+            return _process_csv_in_parallel(file_path, options, PARALLEL_WORKERS, parquet_path, progress_callback)
+        except Exception as e:
+            logger.warning(f"Parallel analysis of {file_path} failed, falling back to serial processing: {e}")
+            if parquet_path and os.path.exists(parquet_path):
+                os.remove(parquet_path)
+
     # --- Chunked Processing for CSV files ---
-    options = _infer_csv_options(file_path)
+    # The file is opened here so its read position can be used to estimate progress.
+    csv_file = open(file_path, 'rb')
+    file_size = os.path.getsize(file_path)
     chunk_iterator = pd.read_csv(
-        file_path,
-        chunksize=50000,
+        csv_file,
+        chunksize=CHUNK_SIZE,
+        sep=options['sep'],
         decimal=options['decimal'],
         thousands=options['thousands']
     )
 
-    total_records = 0
-    all_columns = []
-    categorical_cols = []
-    numerical_cols = []
-    value_counters = {}
-    missing_values_counter = Counter()
-    
-    # Data for descriptive stats
-    descriptive_stats_agg = {}
-
-    is_first_chunk = True
-    for chunk in chunk_iterator:
-        chunk.fillna(0, inplace=True)
-        chunk.drop_duplicates(inplace=True)
-
-        if is_first_chunk:
-            all_columns = chunk.columns.tolist()
-            numerical_cols = chunk.select_dtypes(include=['number']).columns.tolist()
-            categorical_cols = chunk.select_dtypes(include=['object', 'category']).columns.tolist()
-            
-            for col in categorical_cols:
-                value_counters[col] = Counter()
-            for col in numerical_cols:
-                # [count, sum, min, max]
-                descriptive_stats_agg[col] = [0, 0, float('inf'), float('-inf')]
-
-            is_first_chunk = False
-
-        total_records += len(chunk)
-        missing_values_counter.update(chunk.isnull().sum().to_dict())
-
-        # Aggregate value counts for categorical columns
-        for col in categorical_cols:
-            value_counters[col].update(chunk[col].value_counts().to_dict())
-
-        # Aggregate descriptive stats for numerical columns
-        for col in numerical_cols:
-            stats = descriptive_stats_agg[col]
-            stats[0] += chunk[col].count()
-            stats[1] += chunk[col].sum()
-            stats[2] = min(stats[2], chunk[col].min())
-            stats[3] = max(stats[3], chunk[col].max())
-
-    # --- Consolidate Results ---
-    final_analysis = {}
-    final_analysis['total_records'] = total_records
-    final_analysis['all_columns'] = all_columns
-    final_analysis['numerical_cols'] = numerical_cols
-    final_analysis['categorical_cols'] = categorical_cols
-    
-    # Consolidate value counts
-    final_value_counts = {}
-    for col, counter in value_counters.items():
-        final_value_counts[col] = dict(counter.most_common(20))
-    final_analysis['value_counts'] = final_value_counts
-
-    # Consolidate missing values
-    final_analysis['missing_values'] = {k: v for k, v in missing_values_counter.items() if v > 0}
-
-    # Consolidate and calculate descriptive stats
-    final_descriptive_stats = {}
-    for col, (count, total_sum, min_val, max_val) in descriptive_stats_agg.items():
-        mean = total_sum / count if count > 0 else 0
-        final_descriptive_stats[col] = {
-            'count': count,
-            'mean': mean,
-            'std': 'N/A (Chunked Processing)', # Std dev is complex to calculate in chunks
-            'min': min_val if min_val != float('inf') else 0,
-            '25%': 'N/A (Chunked Processing)',
-            '50%': 'N/A (Chunked Processing)',
-            '75%': 'N/A (Chunked Processing)',
-            'max': max_val if max_val != float('-inf') else 0,
-        }
-    final_analysis['descriptive_stats'] = final_descriptive_stats
-    
-    # Add placeholders for stats that are too complex for chunking
-    final_analysis['dataframe_info'] = f"""<class 'pandas.core.frame.DataFrame'>
-RangeIndex: {total_records} entries
-Data columns (total {len(all_columns)} columns):
-(Column info is not available in chunked processing mode)
-"""
-    final_analysis['correlation_matrix'] = "Not available in chunked processing mode."
+    analysis = None
+    sink = _ParquetSink(parquet_path) if parquet_path else None
+    try:
+        for n_chunks, chunk in enumerate(chunk_iterator, start=1):
+            # The Parquet copy keeps the raw values; cleaning only applies to the statistics.
+            if sink:
+                sink.write_frame(chunk)
+            chunk.fillna(0, inplace=True)
+            chunk.drop_duplicates(inplace=True)
+
+            if analysis is None:
+                analysis = _ChunkedAnalysis.from_chunk(chunk)
+            analysis.update(chunk)
+            if progress_callback:
+                progress_callback(n_chunks, _estimate_total_chunks(n_chunks, csv_file.tell(), file_size), analysis.total_records)
+    finally:
+        csv_file.close()
+        if sink:
+            sink.close()
 
-    # Convert all numpy types to native Python types for JSON serialization
-    return _convert_numpy_types(final_analysis)
+    if analysis is None:
+        analysis = _ChunkedAnalysis([], [], [], {})
+    return analysis.finalize()
@@ -1,22 +1,125 @@
+import ast
 import pandas as pd
 from io import StringIO
+from typing import Iterable, Optional, Set
 import logging
 
 logger = logging.getLogger(__name__)
 
-def execute_sandboxed_code(df: pd.DataFrame, code_to_execute: str) -> str:
+# Start of the output returned when the executed code raises.
+EXECUTION_ERROR_PREFIX = "Error executing code: "
+
+def _constant_columns(node: ast.AST) -> Optional[Set[str]]:
+    """Returns the column names in `'a'` or `['a', 'b']`, or None for any other expression."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return {node.value}
+    if isinstance(node, (ast.List, ast.Tuple)) and node.elts and all(
+        isinstance(e, ast.Constant) and isinstance(e.value, str) for e in node.elts
+    ):
+        return {e.value for e in node.elts}
+    return None
+
+
+def find_referenced_columns(code: str, available_columns: Iterable[str], df_name: str = "df") -> Optional[Set[str]]:
     """
-    Executes the LLM-generated code in a restricted environment.
+    Finds the DataFrame columns a snippet of generated code reads.
 
-    **WARNING: THIS IS A MAJOR SECURITY RISK.** In a real-world scenario, this `exec`
-    should be replaced with a proper sandboxing library (e.g., RestrictedPython)
-    or run inside an isolated Docker container.
+    Only uses of `df` that clearly select columns are understood:
+    `df['a']`, `df[['a', 'b']]`, `df.a`, `df[mask]['a']`,
+    `df.loc[mask, 'a']` and `df.groupby('a')['b']`. Any other use
+    (`df.describe()`, `len(df)`, `print(df)`, reassigning `df`, ...) may
+    depend on every column, and None is returned. This includes `df.a`
+    when `a` is also a DataFrame attribute, since `df.count()` is a method
+    call even with a column named "count".
+
+    Args:
+        code: The Python code to inspect.
+        available_columns: The columns of the dataset.
+        df_name: The name of the DataFrame variable in the code.
+
+    Returns:
+        The referenced columns that exist in the dataset, or None if the
+        whole DataFrame is needed, no existing column is referenced or the
+        code cannot be parsed.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+
+    available = set(available_columns)
+    parents = {child: parent for parent in ast.walk(tree) for child in ast.iter_child_nodes(parent)}
+    columns: Set[str] = set()
+
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Name) and node.id == df_name):
+            continue
+        if not isinstance(node.ctx, ast.Load):
+            return None
+        parent = parents.get(node)
+        grandparent = parents.get(parent)
+
+        # df['a'] / df[['a', 'b']]
+        if isinstance(parent, ast.Subscript) and parent.value is node:
+            selected = _constant_columns(parent.slice)
+            if selected is None and isinstance(grandparent, ast.Subscript) and grandparent.value is parent:
+                # df[mask]['a']: the mask's own column uses are checked separately.
+                selected = _constant_columns(grandparent.slice)
+            if selected is None:
+                return None
+            columns |= selected
+        # df.a, unless `a` is also a DataFrame attribute such as `count` or `sum`
+        elif (
+            isinstance(parent, ast.Attribute) and parent.value is node
+            and parent.attr in available and not hasattr(pd.DataFrame, parent.attr)
+        ):
+            columns.add(parent.attr)
+        # df.loc[mask, 'a']
+        elif (
+            isinstance(parent, ast.Attribute) and parent.attr == "loc"
+            and isinstance(grandparent, ast.Subscript) and grandparent.value is parent
+            and isinstance(grandparent.slice, ast.Tuple) and len(grandparent.slice.elts) == 2
+            and _constant_columns(grandparent.slice.elts[1]) is not None
+        ):
+            columns |= _constant_columns(grandparent.slice.elts[1])
+        # df.groupby('a')['b']
+        elif (
+            isinstance(parent, ast.Attribute) and parent.attr == "groupby"
+            and isinstance(grandparent, ast.Call) and grandparent.func is parent
+            and len(grandparent.args) == 1 and _constant_columns(grandparent.args[0]) is not None
+            and isinstance(parents.get(grandparent), ast.Subscript)
+            and parents[grandparent].value is grandparent
+            and _constant_columns(parents[grandparent].slice) is not None
+        ):
+            columns |= _constant_columns(grandparent.args[0]) | _constant_columns(parents[grandparent].slice)
+        else:
+            return None
+
+    # Without any existing column the row count would be lost, so load everything.
+    return (columns & available) or None
+
+
+def run_generated_code(df: pd.DataFrame, code_to_execute: str) -> str:
+    """
+    Runs LLM-generated code with `df` and `pd` in scope and a restricted set
+    of built-ins, and returns what it printed.
+
+    Raises:
+        Exception: Whatever the code raises.
     """
     local_vars = {"df": df, "pd": pd}
 
+    # print() writes to a buffer owned by this call instead of the global
+    # sys.stdout, so concurrent executions in different threads don't mix output.
+    captured_output = StringIO()
+
+    def captured_print(*args, **kwargs):
+        kwargs.setdefault("file", captured_output)
+        print(*args, **kwargs)
+
     # A safe subset of built-in functions
     safe_builtins = {
-        "print": print,
+        "print": captured_print,
         "len": len,
         "sum": sum,
         "dict": dict,
@@ -53,18 +156,24 @@ def execute_sandboxed_code(df: pd.DataFrame, code_to_execute: str) -> str:
         "locals": locals,
     }
 
-    try:
-        # Redirect stdout to capture the print() output from the executed code
-        
-        old_stdout = __import__("sys").stdout
-        __import__("sys").stdout = captured_output = StringIO()
+    exec(code_to_execute, {"__builtins__": safe_builtins}, local_vars)
+    return captured_output.getvalue()
 
-        exec(code_to_execute, {"__builtins__": safe_builtins}, local_vars)
 
-        __import__("sys").stdout = old_stdout
-        result = captured_output.getvalue()
+def execute_sandboxed_code(df: pd.DataFrame, code_to_execute: str) -> str:
+    """
+    Executes the LLM-generated code in a restricted environment.
+
+    **WARNING: THIS IS A MAJOR SECURITY RISK.** In a real-world scenario, this `exec`
+    should be replaced with a proper sandboxing library (e.g., RestrictedPython)
+    or run inside an isolated Docker container. The API runs generated code in
+    `sandbox_pool` worker processes; this in-process variant is used when the
+    pool is disabled.
+    """
+    try:
+        result = run_generated_code(df, code_to_execute)
         logger.info(f"Executed code output: {result}")
         return result
     except Exception as e:
         logger.error(f"Error executing code: {e}")
-        return f"Error executing code: {e}"
+        return f"{EXECUTION_ERROR_PREFIX}{e}"
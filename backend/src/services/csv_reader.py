@@ -0,0 +1,127 @@
+"""
+Selectable CSV reader backends for the upload pipeline.
+
+The "pandas" backend reads CSV files with `pd.read_csv`. The "pyarrow"
+backend uses the multithreaded streaming reader from `pyarrow.csv`, which
+yields Arrow record batches and never builds pandas object columns for
+strings. Both read a file with the options from `infer_csv_options`; when
+Arrow cannot apply them, callers fall back to pandas.
+"""
+import os
+import re
+from typing import Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+
+PANDAS_BACKEND = "pandas"
+PYARROW_BACKEND = "pyarrow"
+
+# Default backend for the analysis and Parquet conversion steps.
+CSV_READER_BACKEND = os.getenv("CSV_READER_BACKEND", PANDAS_BACKEND)
+
+# Size of the blocks the Arrow reader parses in parallel (one record batch each).
+ARROW_BLOCK_SIZE = int(os.getenv("CSV_ARROW_BLOCK_SIZE", 16 * 1024 * 1024))
+
+# Delimiters recognized by `infer_csv_options`, in order of preference on ties.
+_DELIMITER_CANDIDATES = (',', ';', '\t', '|')
+
+# Options of `pd.read_csv` when none are given.
+DEFAULT_CSV_OPTIONS = {'sep': ',', 'decimal': '.', 'thousands': None}
+
+
+def resolve_backend(backend: Optional[str]) -> str:
+    """
+    Returns the backend to use, falling back to CSV_READER_BACKEND.
+
+    Raises:
+        ValueError: If the backend name is not known.
+    """
+    backend = backend or CSV_READER_BACKEND
+    if backend not in (PANDAS_BACKEND, PYARROW_BACKEND):
+        raise ValueError(f"Unknown CSV reader backend: {backend}")
+    return backend
+
+
+def infer_csv_options(file_path: str) -> dict:
+    """
+    Infers the delimiter and the decimal and thousands separators of a CSV file from a sample.
+
+    The delimiter is the most frequent candidate in the header line. A comma
+    is only taken as the decimal separator when it is not the delimiter and
+    the sample has more comma-separated than dot-separated digits, as in
+    "1.234,56" with ";" as the delimiter. Otherwise the pandas defaults are
+    used, so "12.34" in a comma-delimited file stays 12.34.
+
+    Args:
+        file_path: The path to the CSV file.
+
+    Returns:
+        A dictionary with 'sep', 'decimal' and 'thousands' keys for pandas.read_csv.
+    """
+    with open(file_path, 'rb') as f:
+        sample_bytes = f.read(2048)
+
+    sample_str = sample_bytes.decode(errors='ignore')
+    header = sample_str.splitlines()[0] if sample_str else ''
+    sep = max(_DELIMITER_CANDIDATES, key=header.count)
+    if sep != ',' and len(re.findall(r'\d,\d', sample_str)) > len(re.findall(r'\d\.\d', sample_str)):
+        return {'sep': sep, 'decimal': ',', 'thousands': '.'}
+
+    return {'sep': sep, 'decimal': '.', 'thousands': None}
+
+
+def arrow_supports_options(options: dict) -> bool:
+    """
+    Whether the Arrow reader can parse a file with these `infer_csv_options`.
+
+    Arrow has no notion of a thousands separator, so it would read numbers
+    written like "1.234,56" as text where pandas reads them as numbers.
+    """
+    return options.get('thousands') is None
+
+
+def open_arrow_csv(file_path: str, options: Optional[dict] = None) -> pa_csv.CSVStreamingReader:
+    """
+    Opens a CSV file with the streaming, multithreaded Arrow reader.
+
+    Column types are inferred from the first block.
+
+    Args:
+        file_path: The path to the CSV file.
+        options: The options from `infer_csv_options`; the pandas defaults if
+            omitted. Check them with `arrow_supports_options` first.
+
+    Returns:
+        A reader yielding `pyarrow.RecordBatch` objects.
+
+    Raises:
+        ValueError: If the options need a thousands separator.
+    """
+    options = options or DEFAULT_CSV_OPTIONS
+    if not arrow_supports_options(options):
+        raise ValueError("The Arrow CSV reader does not support a thousands separator.")
+    return pa_csv.open_csv(
+        file_path,
+        read_options=pa_csv.ReadOptions(block_size=ARROW_BLOCK_SIZE, use_threads=True),
+        parse_options=pa_csv.ParseOptions(delimiter=options['sep']),
+        # Empty cells are missing values, as in pandas.
+        convert_options=pa_csv.ConvertOptions(decimal_point=options['decimal'], strings_can_be_null=True),
+    )
+
+
+def normalize_arrow_table(table: pa.Table) -> pa.Table:
+    """
+    Aligns Arrow column types with what `pd.read_csv` would produce.
+
+    Columns with no values become float64 and dates or timestamps become
+    strings, so numeric and categorical columns are classified the same way
+    by both backends.
+    """
+    for i, field in enumerate(table.schema):
+        if pa.types.is_null(field.type):
+            table = table.set_column(i, field.name, pc.cast(table.column(i), pa.float64()))
+        elif pa.types.is_temporal(field.type):
+            table = table.set_column(i, field.name, pc.cast(table.column(i), pa.string()))
+    return table
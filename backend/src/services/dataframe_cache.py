@@ -0,0 +1,167 @@
+"""
+Process-local cache of loaded DataFrames for follow-up chat questions.
+"""
+import os
+import threading
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import pandas as pd
+
+from .shared_datasets import SharedDataset, shared_datasets
+
+logger = logging.getLogger(__name__)
+
+# Total memory budget for cached DataFrames, in bytes (1 GB by default).
+DATAFRAME_CACHE_MAX_BYTES = int(os.getenv("DATAFRAME_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+
+
+class _Entry:
+    __slots__ = ("df", "size", "shared")
+
+    def __init__(self, df: pd.DataFrame, size: int):
+        self.df = df
+        self.size = size
+        self.shared: Optional[SharedDataset] = None
+
+
+class DataFrameCache:
+    """
+    An LRU cache of DataFrames with a total memory budget.
+
+    Entries are keyed by (notebook_id, file_version, ...) and sized with
+    `memory_usage(deep=True)`. When the budget is exceeded, the least
+    recently used entries are evicted. Frames larger than the whole budget
+    are not cached. An entry may also hold a shared Arrow copy of its frame
+    for the sandbox workers (see `share`), which counts towards the budget
+    and is released when the entry leaves the cache.
+    """
+
+    def __init__(self, max_bytes: int = DATAFRAME_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Tuple[Hashable, ...], _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[Hashable, ...]) -> Optional[pd.DataFrame]:
+        """
+        Returns a copy of the cached DataFrame for `key`, or None.
+
+        A copy is returned so that generated code modifying `df` in place
+        cannot change the cached frame seen by later questions.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            df = entry.df
+        return df.copy()
+
+    def share(self, key: Tuple[Hashable, ...], count: bool = True) -> Optional[SharedDataset]:
+        """
+        Returns the shared Arrow copy of a cached frame, writing it on first use.
+
+        The caller receives its own reference and must release it with
+        `shared_datasets.release` when done.
+
+        Args:
+            key: The cache key.
+            count: Whether the lookup counts as a hit or miss, as in `get`.
+                Sharing a frame just `put` by the caller is not a lookup.
+
+        Returns:
+            The shared dataset, or None if `key` is not cached.
+
+        Raises:
+            pyarrow.ArrowException: If the frame cannot be converted to Arrow.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if entry.shared is not None:
+                if count:
+                    self.hits += 1
+                return shared_datasets.retain(entry.shared)
+            df = entry.df
+
+        # The hit is counted once the copy exists; if publishing fails, the
+        # caller falls back to `get`, which counts the lookup instead.
+        shared = shared_datasets.publish(df)
+        with self._lock:
+            if count:
+                self.hits += 1
+            entry = self._entries.get(key)
+            if entry is None or entry.df is not df:
+                # Evicted or replaced meanwhile: the caller holds the only reference.
+                return shared
+            if entry.shared is not None:
+                # Another caller shared it first.
+                shared_datasets.release(shared)
+                return shared_datasets.retain(entry.shared)
+            entry.shared = shared
+            entry.size += shared.nbytes
+            self.current_bytes += shared.nbytes
+            self._entries.move_to_end(key)
+            while len(self._entries) > 1 and self.current_bytes > self.max_bytes:
+                self._evict_oldest()
+            return shared_datasets.retain(shared)
+
+    def put(self, key: Tuple[Hashable, ...], df: pd.DataFrame) -> None:
+        """Caches `df` under `key`, evicting least recently used entries as needed."""
+        size = int(df.memory_usage(deep=True).sum())
+        if size > self.max_bytes:
+            logger.info(f"DataFrame for {key} ({size} bytes) exceeds the cache budget; not cached.")
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while self._entries and self.current_bytes + size > self.max_bytes:
+                self._evict_oldest()
+            self._entries[key] = _Entry(df, size)
+            self.current_bytes += size
+
+    def invalidate(self, notebook_id: str) -> None:
+        """Drops every cached entry belonging to a notebook."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == notebook_id]:
+                self._remove(key)
+
+    def _remove(self, key: Tuple[Hashable, ...]) -> _Entry:
+        entry = self._entries.pop(key)
+        self.current_bytes -= entry.size
+        if entry.shared is not None:
+            # Running jobs keep their own references; the file goes with the last one.
+            shared_datasets.release(entry.shared)
+        return entry
+
+    def _evict_oldest(self) -> None:
+        key = next(iter(self._entries))
+        size = self._remove(key).size
+        self.evictions += 1
+        logger.info(f"Evicted DataFrame for {key} ({size} bytes) from the cache.")
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the cache counters and current memory usage."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "current_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+dataframe_cache = DataFrameCache()
@@ -0,0 +1,132 @@
+"""
+Process-local cache of the output of executed analysis code.
+"""
+import os
+import re
+import ast
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .code_executor import EXECUTION_ERROR_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of cached outputs, and how long they stay valid, in seconds.
+EXECUTION_CACHE_MAX_ENTRIES = int(os.getenv("EXECUTION_CACHE_MAX_ENTRIES", 2048))
+EXECUTION_CACHE_TTL_SECONDS = int(os.getenv("EXECUTION_CACHE_TTL_SECONDS", 24 * 3600))
+
+# Calls whose results change from one run to the next; code using them is not cached.
+_NONDETERMINISTIC_NAMES = {"sample", "shuffle", "random", "rand", "randn", "randint", "now", "today"}
+_NONDETERMINISTIC_SQL = re.compile(
+    r"\b(random|uuid|gen_random_uuid|setseed|now|current_timestamp|current_date|current_time|today|sample|tablesample)\b",
+    re.IGNORECASE
+)
+
+
+def normalize_sql(query: str) -> Optional[str]:
+    """
+    Returns a canonical form of a SQL query: whitespace collapsed and
+    trailing semicolons dropped.
+
+    Returns:
+        The normalized query, or None if it uses something
+        non-deterministic (e.g. `random()` or `USING SAMPLE`).
+    """
+    if _NONDETERMINISTIC_SQL.search(query):
+        return None
+    return " ".join(query.split()).rstrip(";").strip()
+
+
+def normalize_code(code: str, language: str = "python") -> Optional[str]:
+    """
+    Returns a canonical form of `code`: for Python, the dump of its AST,
+    which ignores comments, blank lines and formatting; for SQL, see
+    `normalize_sql`.
+
+    Args:
+        code: The generated code.
+        language: "python" or "sql".
+
+    Returns:
+        The normalized code, or None if the code cannot be parsed or calls
+        something non-deterministic (e.g. `df.sample()`), in which case its
+        output must not be reused.
+    """
+    if language == "sql":
+        normalized = normalize_sql(code)
+        return f"sql:{normalized}" if normalized is not None else None
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    for node in ast.walk(tree):
+        name = node.attr if isinstance(node, ast.Attribute) else node.id if isinstance(node, ast.Name) else None
+        if name in _NONDETERMINISTIC_NAMES:
+            return None
+    return ast.dump(tree)
+
+
+class ExecutionResultCache:
+    """
+    An LRU cache of captured stdout, keyed by (dataset version, normalized code).
+
+    The dataset version is the content hash of the notebook's file, so an
+    output is reused for any notebook with the same data and is never
+    served once the file changes. Failed executions are not cached.
+    """
+
+    def __init__(self, max_entries: int = EXECUTION_CACHE_MAX_ENTRIES, ttl_seconds: int = EXECUTION_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(dataset_version: str, code: str, language: str = "python") -> Optional[Tuple[str, str]]:
+        """Returns the cache key for running `code` on a dataset, or None if it must not be cached."""
+        normalized = normalize_code(code, language)
+        return (dataset_version, normalized) if normalized is not None else None
+
+    def get(self, key: Optional[Tuple[str, str]]) -> Optional[str]:
+        """Returns the cached output for `key`, or None."""
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.time() - self.ttl_seconds:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Optional[Tuple[str, str]], output: str) -> None:
+        """Caches an output, unless the execution failed."""
+        if key is None or output.startswith(EXECUTION_ERROR_PREFIX):
+            return
+        with self._lock:
+            self._entries[key] = (output, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, dataset_version: str) -> None:
+        """Drops every cached output for a dataset version."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == dataset_version]:
+                del self._entries[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the cache counters."""
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+execution_cache = ExecutionResultCache()
@@ -0,0 +1,355 @@
+"""
+Durable queue for background jobs, stored in a local SQLite database.
+
+Jobs are enqueued by the API and run by the worker processes in
+`job_worker.py`, so they survive restarts and heavy work does not share the
+API process's CPU. Each job has a type, a JSON payload and a priority.
+Workers claim the highest-priority due job whose type is below its
+concurrency limit and hold it under a lease, which they renew while the job
+runs. A failed job is retried with exponential backoff until its attempts
+run out. A job whose worker died is picked up again once its lease expires.
+"""
+import os
+import json
+import time
+import uuid
+import random
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "jobs.sqlite3")
+# Attempts per job before it is marked as failed.
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+# Delay before the first retry, doubled for each further attempt up to the maximum, in seconds.
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", 5))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", 300))
+# How long a claimed job stays reserved for its worker without a renewal, in seconds.
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", 120))
+# Finished jobs are deleted after this many seconds.
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", 7 * 24 * 3600))
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    user_id TEXT,
+    group_key TEXT,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_after REAL NOT NULL,
+    lease_expires_at REAL,
+    worker TEXT,
+    result TEXT,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, priority DESC, run_after, created_at);
+CREATE INDEX IF NOT EXISTS jobs_group_key ON jobs (group_key);
+"""
+
+JobHandler = Callable[[Dict[str, Any], "JobContext"], Awaitable[Optional[Dict[str, Any]]]]
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying the job cannot help; the job fails at once."""
+
+
+class JobType:
+    """A kind of job: the coroutine that runs it and how many may run at once across all workers."""
+
+    def __init__(self, name: str, handler: JobHandler, max_concurrency: int, max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.name = name
+        self.handler = handler
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+
+
+class JobContext:
+    """What a handler knows about the job it is running."""
+
+    def __init__(self, job_id: str, job_type: str, attempt: int, max_attempts: int):
+        self.job_id = job_id
+        self.job_type = job_type
+        self.attempt = attempt
+        self.max_attempts = max_attempts
+
+    @property
+    def is_last_attempt(self) -> bool:
+        """Whether the job fails for good if this attempt fails."""
+        return self.attempt >= self.max_attempts
+
+
+class JobQueue:
+    """
+    The jobs table and the registry of job types.
+
+    Claims run in an IMMEDIATE transaction, so concurrency limits hold across
+    every process using the same database file. Each process opens its own
+    connection on first use.
+    """
+
+    def __init__(self, path: str = JOB_QUEUE_PATH, lease_seconds: float = JOB_LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.types: Dict[str, JobType] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def register(self, job_type: JobType) -> None:
+        """Makes a job type known to this process, so its jobs can be enqueued and claimed."""
+        self.types[job_type.name] = job_type
+
+    @contextmanager
+    def _transaction(self, immediate: bool = False) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            if self._conn is None or self._conn_pid != os.getpid():
+                # A connection must not be used across fork, so each process opens its own.
+                self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10, isolation_level=None)
+                self._conn.row_factory = sqlite3.Row
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.executescript(_SCHEMA)
+                self._conn_pid = os.getpid()
+            self._conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def enqueue(
+        self,
+        job_type: str,
+        payload: Dict[str, Any],
+        user_id: Optional[str] = None,
+        group_key: Optional[str] = None,
+        priority: int = 0,
+    ) -> str:
+        """
+        Adds a job to the queue.
+
+        Args:
+            job_type: The name of a registered job type.
+            payload: JSON-serializable arguments for the handler.
+            user_id: The user the job belongs to, who may query its status.
+            group_key: Key for looking up related jobs, e.g. a notebook ID.
+            priority: Jobs with a higher priority are claimed first.
+
+        Returns:
+            The job ID.
+
+        Raises:
+            ValueError: If the job type is not registered.
+        """
+        if job_type not in self.types:
+            raise ValueError(f"Unknown job type: {job_type}")
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, type, payload, user_id, group_key, priority, status, max_attempts, run_after, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, job_type, json.dumps(payload), user_id, group_key, priority, STATUS_QUEUED,
+                 self.types[job_type].max_attempts, now, now)
+            )
+        logger.info(f"[Jobs] Enqueued {job_type} job {job_id} (priority {priority}).")
+        return job_id
+
+    def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """
+        Reserves the next job this process can run.
+
+        The job is the highest-priority one that is due (queued and past its
+        retry delay, or running under an expired lease) and whose type is
+        below its concurrency limit. Jobs whose lease expired on their last
+        attempt are marked as failed.
+
+        Args:
+            worker: Identifies the claiming worker in the job row.
+
+        Returns:
+            The job row with its payload decoded, or None if there is nothing to run.
+        """
+        now = time.time()
+        with self._transaction(immediate=True) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, lease_expires_at = NULL,"
+                " last_error = 'The worker running the job stopped.'"
+                " WHERE status = ? AND lease_expires_at < ? AND attempts >= max_attempts",
+                (STATUS_FAILED, now, STATUS_RUNNING, now)
+            )
+            running = dict(conn.execute(
+                "SELECT type, COUNT(*) FROM jobs WHERE status = ? AND lease_expires_at >= ? GROUP BY type",
+                (STATUS_RUNNING, now)
+            ).fetchall())
+            available = [name for name, t in self.types.items() if running.get(name, 0) < t.max_concurrency]
+            if not available:
+                return None
+            placeholders = ",".join("?" * len(available))
+            row = conn.execute(
+                f"SELECT * FROM jobs WHERE type IN ({placeholders})"
+                " AND ((status = ? AND run_after <= ?) OR (status = ? AND lease_expires_at < ?))"
+                " ORDER BY priority DESC, run_after, created_at LIMIT 1",
+                (*available, STATUS_QUEUED, now, STATUS_RUNNING, now)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, worker = ?, lease_expires_at = ?,"
+                " started_at = COALESCE(started_at, ?) WHERE id = ?",
+                (STATUS_RUNNING, worker, now + self.lease_seconds, now, row["id"])
+            )
+        job = dict(row)
+        job["attempts"] += 1
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def renew(self, job_id: str, worker: str) -> bool:
+        """Extends the lease of a running job; returns False if the worker no longer holds it."""
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND worker = ? AND status = ?",
+                (time.time() + self.lease_seconds, job_id, worker, STATUS_RUNNING)
+            ).rowcount
+        return updated > 0
+
+    def complete(self, job_id: str, worker: str, result: Optional[Dict[str, Any]] = None) -> None:
+        """Marks a job as succeeded."""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, finished_at = ?, lease_expires_at = NULL, last_error = NULL"
+                " WHERE id = ? AND worker = ? AND status = ?",
+                (STATUS_SUCCEEDED, json.dumps(result), time.time(), job_id, worker, STATUS_RUNNING)
+            )
+
+    def fail(self, job_id: str, worker: str, error: str, retry: bool = True) -> Optional[float]:
+        """
+        Records a failed attempt, scheduling a retry while attempts remain.
+
+        Args:
+            job_id: The job.
+            worker: The worker that ran the attempt.
+            error: Description of the failure, kept in the job row.
+            retry: False to fail the job regardless of its remaining attempts.
+
+        Returns:
+            The delay before the retry in seconds, or None if the job failed for good.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT attempts, max_attempts FROM jobs WHERE id = ? AND worker = ? AND status = ?",
+                (job_id, worker, STATUS_RUNNING)
+            ).fetchone()
+            if row is None:
+                return None
+            if retry and row["attempts"] < row["max_attempts"]:
+                # Full jitter, so jobs that failed together do not retry together.
+                delay = random.uniform(0.5, 1.0) * min(
+                    JOB_RETRY_BASE_SECONDS * 2 ** (row["attempts"] - 1), JOB_RETRY_MAX_SECONDS
+                )
+                conn.execute(
+                    "UPDATE jobs SET status = ?, run_after = ?, lease_expires_at = NULL, last_error = ? WHERE id = ?",
+                    (STATUS_QUEUED, now + delay, error, job_id)
+                )
+                return delay
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, lease_expires_at = NULL, last_error = ? WHERE id = ?",
+                (STATUS_FAILED, now, error, job_id)
+            )
+            return None
+
+    def release_jobs_of_dead_workers(self, is_alive: Callable[[str], bool]) -> int:
+        """
+        Makes running jobs whose worker is gone claimable at once instead of after their lease.
+
+        Args:
+            is_alive: Tells whether the worker with the given ID is still running.
+
+        Returns:
+            The number of released jobs.
+        """
+        with self._transaction(immediate=True) as conn:
+            workers = [r["worker"] for r in conn.execute(
+                "SELECT DISTINCT worker FROM jobs WHERE status = ?", (STATUS_RUNNING,)
+            ).fetchall()]
+            released = 0
+            for worker in workers:
+                if worker and not is_alive(worker):
+                    released += conn.execute(
+                        "UPDATE jobs SET lease_expires_at = 0 WHERE status = ? AND worker = ?", (STATUS_RUNNING, worker)
+                    ).rowcount
+        return released
+
+    def prune(self, retention_seconds: float = JOB_RETENTION_SECONDS) -> int:
+        """Deletes finished jobs older than the retention period; returns how many were deleted."""
+        with self._transaction() as conn:
+            return conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (STATUS_SUCCEEDED, STATUS_FAILED, time.time() - retention_seconds)
+            ).rowcount
+
+    @staticmethod
+    def _public(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "id": row["id"],
+            "type": row["type"],
+            "status": row["status"],
+            "priority": row["priority"],
+            "attempts": row["attempts"],
+            "max_attempts": row["max_attempts"],
+            "group_key": row["group_key"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["last_error"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+            "retry_at": row["run_after"] if row["status"] == STATUS_QUEUED and row["attempts"] else None,
+        }
+
+    def get(self, job_id: str, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Returns the status of a job, or None if it does not exist or belongs to another user."""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or (user_id is not None and row["user_id"] != user_id):
+            return None
+        return self._public(row)
+
+    def list_for_group(self, group_key: str, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Returns the status of the jobs with a group key, oldest first."""
+        query = "SELECT * FROM jobs WHERE group_key = ?"
+        params: List[Any] = [group_key]
+        if user_id is not None:
+            query += " AND user_id = ?"
+            params.append(user_id)
+        with self._transaction() as conn:
+            rows = conn.execute(query + " ORDER BY created_at", params).fetchall()
+        return [self._public(row) for row in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the number of jobs per type and status."""
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT type, status, COUNT(*) AS n FROM jobs GROUP BY type, status").fetchall()
+        stats: Dict[str, Dict[str, int]] = {}
+        for row in rows:
+            stats.setdefault(row["type"], {})[row["status"]] = row["n"]
+        return stats
+
+
+job_queue = JobQueue()
@@ -0,0 +1,212 @@
+"""
+Worker processes that run the jobs of the durable queue (`job_queue.py`).
+
+The API starts JOB_WORKERS processes from the forkserver, as it does for
+the sandbox workers, and replaces any that exit. Each process runs an event
+loop with JOB_WORKER_SLOTS slots, and each slot claims and runs one job at
+a time while renewing its lease. The job types' concurrency limits apply
+across all processes. With JOB_WORKERS=0 the slots run in the API process
+instead, which is convenient in development.
+"""
+import os
+import time
+import signal
+import asyncio
+import logging
+import threading
+import multiprocessing
+from typing import Any, Dict, List, Optional
+
+from ..lib.concurrency import run_blocking
+from .job_queue import JobContext, JobQueue, PermanentJobError, job_queue, JOB_LEASE_SECONDS
+# Registers the job types, so worker processes can run them.
+from . import upload_jobs  # noqa: F401
+
+logger = logging.getLogger(__name__)
+
+# Number of worker processes; 0 runs jobs in the API process.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+# Jobs a worker process runs at the same time.
+JOB_WORKER_SLOTS = int(os.getenv("JOB_WORKER_SLOTS", 4))
+# Seconds an idle slot waits before looking for a job again.
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 0.5))
+# Seconds running jobs get to finish when the workers are stopped.
+JOB_SHUTDOWN_GRACE_SECONDS = float(os.getenv("JOB_SHUTDOWN_GRACE_SECONDS", 20))
+# Seconds between checks for exited worker processes and old jobs to delete.
+JOB_SUPERVISE_SECONDS = 5.0
+JOB_PRUNE_SECONDS = 3600.0
+
+
+def _process_alive(worker: str) -> bool:
+    try:
+        os.kill(int(worker), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+async def _keep_lease(queue: JobQueue, job_id: str, worker: str) -> None:
+    while True:
+        await asyncio.sleep(queue.lease_seconds / 3)
+        if not await run_blocking(queue.renew, job_id, worker):
+            logger.warning(f"[Jobs] Lost the lease of job {job_id}; another worker may run it again.")
+            return
+
+
+async def _run_job(queue: JobQueue, job: Dict[str, Any], worker: str) -> None:
+    """Runs one claimed job and records its outcome."""
+    job_type = queue.types[job["type"]]
+    context = JobContext(job["id"], job["type"], job["attempts"], job["max_attempts"])
+    lease = asyncio.create_task(_keep_lease(queue, job["id"], worker))
+    try:
+        result = await job_type.handler(job["payload"], context)
+    except Exception as e:
+        permanent = isinstance(e, PermanentJobError)
+        delay = await run_blocking(queue.fail, job["id"], worker, f"{type(e).__name__}: {e}", not permanent)
+        if delay is None:
+            logger.error(f"[Jobs] {job['type']} job {job['id']} failed on attempt {context.attempt}: {e}", exc_info=True)
+        else:
+            logger.warning(f"[Jobs] {job['type']} job {job['id']} failed on attempt {context.attempt}; retrying in {delay:.1f}s: {e}")
+    else:
+        await run_blocking(queue.complete, job["id"], worker, result)
+        logger.info(f"[Jobs] {job['type']} job {job['id']} succeeded on attempt {context.attempt}.")
+    finally:
+        lease.cancel()
+
+
+def _stopping(stop) -> bool:
+    parent = multiprocessing.parent_process()
+    # Workers left behind by an API process that was killed stop as well.
+    return stop.is_set() or (parent is not None and not parent.is_alive())
+
+
+async def _slot(queue: JobQueue, worker: str, stop) -> None:
+    while not _stopping(stop):
+        try:
+            job = await run_blocking(queue.claim, worker)
+        except Exception as e:
+            logger.error(f"[Jobs] Could not claim a job: {e}")
+            job = None
+        if job is None:
+            await asyncio.sleep(JOB_POLL_SECONDS)
+            continue
+        await _run_job(queue, job, worker)
+
+
+async def run_worker(stop, slots: int = JOB_WORKER_SLOTS, queue: JobQueue = job_queue) -> None:
+    """
+    Claims and runs jobs until `stop` is set, then waits for the running jobs.
+
+    Args:
+        stop: A threading or multiprocessing Event.
+        slots: Jobs run at the same time.
+        queue: The queue to take jobs from.
+    """
+    worker = str(os.getpid())
+    logger.info(f"[Jobs] Worker {worker} started with {slots} slots.")
+    await asyncio.gather(*(_slot(queue, worker, stop) for _ in range(slots)))
+    logger.info(f"[Jobs] Worker {worker} stopped.")
+
+
+def _worker_main(stop, slots: int) -> None:
+    """Entry point of a worker process."""
+    # Ctrl+C reaches the whole process group; the API stops the workers itself.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(run_worker(stop, slots))
+
+
+class JobWorkerPool:
+    """
+    Starts the job workers and keeps them running.
+
+    A supervisor thread replaces worker processes that exit and periodically
+    deletes old finished jobs.
+    """
+
+    def __init__(self, size: int = JOB_WORKERS, slots: int = JOB_WORKER_SLOTS, queue: JobQueue = job_queue):
+        self.size = size
+        self.slots = slots
+        self.queue = queue
+        self.restarts = 0
+        self._processes: List[multiprocessing.Process] = []
+        self._context = None
+        self._stop = None
+        self._supervisor: Optional[threading.Thread] = None
+        self._in_process: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """
+        Starts the workers. Must be called from the event loop when
+        JOB_WORKERS is 0, since the slots then run as tasks on it.
+        """
+        released = self.queue.release_jobs_of_dead_workers(_process_alive)
+        if released:
+            logger.info(f"[Jobs] Released {released} jobs left running by stopped workers.")
+        if self.size <= 0:
+            self._stop = threading.Event()
+            self._in_process = asyncio.get_running_loop().create_task(run_worker(self._stop, self.slots, self.queue))
+        else:
+            self._context = multiprocessing.get_context("forkserver")
+            self._stop = self._context.Event()
+            self._processes = [self._spawn() for _ in range(self.size)]
+            logger.info(f"[Jobs] Started {self.size} job workers.")
+        self._supervisor = threading.Thread(target=self._supervise, name="job-supervisor", daemon=True)
+        self._supervisor.start()
+
+    def _spawn(self) -> multiprocessing.Process:
+        process = self._context.Process(target=_worker_main, args=(self._stop, self.slots), name="mardata-jobs")
+        process.start()
+        return process
+
+    def _supervise(self) -> None:
+        waited = 0.0
+        while not self._stop.wait(JOB_SUPERVISE_SECONDS):
+            for i, process in enumerate(self._processes):
+                if not process.is_alive() and not self._stop.is_set():
+                    logger.warning(f"[Jobs] Worker {process.pid} exited with code {process.exitcode}; starting a new one.")
+                    self.queue.release_jobs_of_dead_workers(_process_alive)
+                    self._processes[i] = self._spawn()
+                    self.restarts += 1
+            waited += JOB_SUPERVISE_SECONDS
+            if waited >= JOB_PRUNE_SECONDS:
+                waited = 0.0
+                try:
+                    self.queue.prune()
+                except Exception as e:
+                    logger.error(f"[Jobs] Could not delete old jobs: {e}")
+
+    async def shutdown(self) -> None:
+        """Stops claiming jobs and waits for the running ones, up to JOB_SHUTDOWN_GRACE_SECONDS."""
+        if self._stop is None:
+            return
+        self._stop.set()
+        if self._in_process is not None:
+            try:
+                await asyncio.wait_for(self._in_process, JOB_SHUTDOWN_GRACE_SECONDS)
+            except asyncio.TimeoutError:
+                logger.warning("[Jobs] Running jobs did not finish in time; they will be retried after a restart.")
+        await run_blocking(self._stop_processes)
+
+    def _stop_processes(self) -> None:
+        deadline = time.monotonic() + JOB_SHUTDOWN_GRACE_SECONDS
+        for process in self._processes:
+            process.join(timeout=max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning(f"[Jobs] Worker {process.pid} did not stop in time; its jobs will be retried after a restart.")
+                process.terminate()
+                process.join(timeout=5)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the pool's state and the number of jobs per type and status."""
+        return {
+            "workers": self.size,
+            "alive": sum(p.is_alive() for p in self._processes) if self._processes else None,
+            "restarts": self.restarts,
+            "lease_seconds": JOB_LEASE_SECONDS,
+            "jobs": self.queue.stats(),
+        }
+
+
+job_workers = JobWorkerPool()
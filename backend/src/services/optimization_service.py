@@ -3,83 +3,126 @@ Service for post-analysis optimizations, such as converting files to Parquet.
 """
 import os
 import pandas as pd
-from supabase import Client
+import pyarrow as pa
+import pyarrow.parquet as pq
+from typing import Optional
 import logging
 
+from .csv_reader import PYARROW_BACKEND, arrow_supports_options, infer_csv_options, open_arrow_csv, resolve_backend
+from ..lib.concurrency import run_blocking
+from ..lib.repositories import Repositories
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+def _write_parquet(original_file_path: str, original_file_name: str, parquet_path: str, reader_backend: Optional[str]) -> bool:
+    """
+    Converts the original file to a Parquet file at `parquet_path`.
+
+    Returns:
+        False if the file type cannot be converted.
+    """
+    if original_file_name.endswith('.csv'):
+        # Parsed as in the analysis, so the Parquet copy has the same types and values.
+        options = infer_csv_options(original_file_path)
+        if resolve_backend(reader_backend) == PYARROW_BACKEND and arrow_supports_options(options):
+            try:
+                reader = open_arrow_csv(original_file_path, options)
+                with pq.ParquetWriter(parquet_path, reader.schema) as writer:
+                    for batch in reader:
+                        writer.write_batch(batch)
+                return True
+            except pa.ArrowInvalid as e:
+                logging.warning(f"[Parquet] Arrow could not read {original_file_name}, falling back to pandas: {e}")
+        # We read the whole file for conversion, which is acceptable as a background task.
+        df = pd.read_csv(original_file_path, sep=options['sep'], decimal=options['decimal'], thousands=options['thousands'])
+    elif original_file_name.endswith(('.xls', '.xlsx')):
+        df = pd.read_excel(original_file_path)
+    else:
+        logging.warning(f"[Parquet] Unsupported file type for conversion: {original_file_name}")
+        return False
+    df.to_parquet(parquet_path, engine='pyarrow')
+    return True
+
 async def convert_to_parquet_and_update_record(
     original_file_path: str,
     original_file_name: str,
     notebook_id: str,
     user_id: str,
-    supabase: Client
-):
+    repositories: Repositories,
+    reader_backend: Optional[str] = None,
+    parquet_path: Optional[str] = None
+) -> Optional[str]:
     """
     Converts the original uploaded file to Parquet format for faster future access,
     uploads it to storage, and updates the notebook record in the database.
 
+    Local files are left in place, so a failed attempt can be retried; see
+    `remove_upload_files`.
+
     Args:
         original_file_path: The local path to the originally uploaded file.
         original_file_name: The original name of the uploaded file.
         notebook_id: The ID of the notebook to update.
         user_id: The ID of the user who owns the notebook.
-        supabase: An initialized Supabase client instance.
+        repositories: The data access repositories.
+        reader_backend: "pandas" or "pyarrow"; defaults to CSV_READER_BACKEND.
+            With "pyarrow", CSV files are streamed into the Parquet file one
+            record batch at a time instead of being loaded whole.
+        parquet_path: A Parquet file already written during the analysis scan
+            (see `process_spreadsheet_in_chunks`). When given, it is uploaded
+            as-is and the original file is not read again.
+
+    Returns:
+        The storage path of the Parquet file, or None if the file type cannot be converted.
+
+    Raises:
+        Exception: If the conversion, the upload or the record update fails.
     """
-    parquet_path = None
     temp_dir = os.path.dirname(original_file_path)
-    try:
+    parquet_filename = "optimized_data.parquet"
+    converted = parquet_path is not None and os.path.exists(parquet_path)
+    if converted:
+        logging.info(f"[Parquet] Using Parquet file written during analysis for notebook {notebook_id}.")
+    else:
         logging.info(f"[Parquet] Starting conversion for notebook {notebook_id}.")
-        # 1. Read the original file
+        # 1. Read the original file and 2. write it to a new local Parquet file
         # Since this runs after the initial analysis, we assume the file is valid.
-        # We read the whole file for conversion, which is acceptable as a background task.
-        if original_file_name.endswith('.csv'):
-            df = pd.read_csv(original_file_path)
-        elif original_file_name.endswith(('.xls', '.xlsx')):
-            df = pd.read_excel(original_file_path)
-        else:
-            logging.warning(f"[Parquet] Unsupported file type for conversion: {original_file_name}")
-            return
-
-        # 2. Create a new Parquet file locally
-        parquet_filename = "optimized_data.parquet"
         parquet_path = os.path.join(temp_dir, parquet_filename)
-        df.to_parquet(parquet_path, engine='pyarrow')
-        logging.info(f"[Parquet] Successfully converted file to {parquet_path}.")
+        if not await run_blocking(_write_parquet, original_file_path, original_file_name, parquet_path, reader_backend):
+            return None
+    logging.info(f"[Parquet] Parquet file ready at {parquet_path}.")
 
-        # 3. Upload the new Parquet file to Supabase Storage
-        storage_path = f"uploads/{user_id}/{notebook_id}/{parquet_filename}"
-        with open(parquet_path, 'rb') as f:
-            # The bucket name is 'mardata-files', you may need to create it in Supabase UI
-            supabase.storage.from_("mardata-files").upload(path=storage_path, file=f)
-        logging.info(f"[Parquet] Successfully uploaded Parquet file to {storage_path}.")
+    # 3. Upload the new Parquet file to Supabase Storage, replacing the file of an earlier attempt
+    storage_path = f"uploads/{user_id}/{notebook_id}/{parquet_filename}"
+    # The bucket name is 'mardata-files', you may need to create it in Supabase UI
+    await repositories.storage.upload_file(storage_path, parquet_path, upsert=True)
+    logging.info(f"[Parquet] Successfully uploaded Parquet file to {storage_path}.")
 
-        # 4. Update the database record
-        response = supabase.table('notebooks').update({
-            'optimized_file_path': storage_path
-        }).eq('id', notebook_id).execute()
+    # 4. Update the database record
+    updated = await repositories.notebooks.update(notebook_id, {'optimized_file_path': storage_path})
 
-        if not response.data:
-            logging.error(f"[Parquet] Failed to update notebook record for {notebook_id}. No data returned.")
-            raise Exception("Failed to update notebook record.")
+    if not updated:
+        logging.error(f"[Parquet] Failed to update notebook record for {notebook_id}. No data returned.")
+        raise Exception("Failed to update notebook record.")
 
-        logging.info(f"[Parquet] Successfully updated notebook {notebook_id} with optimized file path.")
+    logging.info(f"[Parquet] Successfully updated notebook {notebook_id} with optimized file path.")
+    return storage_path
 
-    except Exception as e:
-        logging.error(f"[Parquet] An error occurred during Parquet conversion for notebook {notebook_id}: {e}", exc_info=True)
-        # Don't re-raise, as we don't want to crash the main background task if optimization fails.
-    finally:
-        # 5. Cleanup all local temporary files
-        if parquet_path and os.path.exists(parquet_path):
-            os.remove(parquet_path)
-            logging.info(f"[Parquet] Cleaned up local Parquet file: {parquet_path}")
-        if original_file_path and os.path.exists(original_file_path):
-            os.remove(original_file_path)
-            logging.info(f"[Parquet] Cleaned up original temp file: {original_file_path}")
-        if os.path.exists(temp_dir):
-            try:
-                os.rmdir(temp_dir)
-                logging.info(f"[Parquet] Cleaned up temp directory: {temp_dir}")
-            except OSError as e:
-                logging.error(f"[Parquet] Error removing temp directory {temp_dir}: {e}")
+
+def remove_upload_files(original_file_path: str, parquet_path: Optional[str] = None) -> None:
+    """Removes the local copy of an upload, its Parquet file and their temporary directory."""
+    temp_dir = os.path.dirname(original_file_path)
+    parquet_path = parquet_path or os.path.join(temp_dir, "optimized_data.parquet")
+    if os.path.exists(parquet_path):
+        os.remove(parquet_path)
+        logging.info(f"[Parquet] Cleaned up local Parquet file: {parquet_path}")
+    if os.path.exists(original_file_path):
+        os.remove(original_file_path)
+        logging.info(f"[Parquet] Cleaned up original temp file: {original_file_path}")
+    if os.path.exists(temp_dir):
+        try:
+            os.rmdir(temp_dir)
+            logging.info(f"[Parquet] Cleaned up temp directory: {temp_dir}")
+        except OSError as e:
+            logging.error(f"[Parquet] Error removing temp directory {temp_dir}: {e}")
@@ -0,0 +1,86 @@
+"""
+Local copies of the optimized Parquet files kept in Supabase Storage.
+"""
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import List, Optional
+
+import pandas as pd
+import pyarrow.parquet as pq
+from supabase import Client
+
+logger = logging.getLogger(__name__)
+
+# Directory holding downloaded Parquet files, and its size budget (5 GB by default).
+PARQUET_CACHE_DIR = os.getenv("PARQUET_CACHE_DIR", os.path.join(tempfile.gettempdir(), "mardata-parquet"))
+PARQUET_CACHE_MAX_BYTES = int(os.getenv("PARQUET_CACHE_MAX_BYTES", 5 * 1024 * 1024 * 1024))
+
+_download_lock = threading.Lock()
+
+
+def _prune_cache_dir() -> None:
+    """Deletes the least recently used files until the directory fits its budget."""
+    entries = []
+    for name in os.listdir(PARQUET_CACHE_DIR):
+        path = os.path.join(PARQUET_CACHE_DIR, name)
+        if name.endswith(".parquet") and os.path.isfile(path):
+            stat = os.stat(path)
+            entries.append((stat.st_atime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= PARQUET_CACHE_MAX_BYTES:
+            break
+        os.remove(path)
+        total -= size
+        logger.info(f"[Parquet cache] Removed {path} to stay within the cache budget.")
+
+
+def fetch_parquet_artifact(storage_path: str, supabase_client: Client) -> str:
+    """
+    Returns a local path to an optimized Parquet file, downloading it once.
+
+    Args:
+        storage_path: The path of the Parquet file in the 'mardata-files' bucket.
+        supabase_client: An initialized Supabase client instance.
+
+    Returns:
+        The local path of the Parquet file.
+    """
+    os.makedirs(PARQUET_CACHE_DIR, exist_ok=True)
+    local_name = hashlib.sha256(storage_path.encode()).hexdigest() + ".parquet"
+    local_path = os.path.join(PARQUET_CACHE_DIR, local_name)
+    with _download_lock:
+        if os.path.exists(local_path):
+            os.utime(local_path)
+            return local_path
+        logger.info(f"[Parquet cache] Downloading {storage_path}.")
+        content = supabase_client.storage.from_("mardata-files").download(storage_path)
+        # Write to a temporary name first so readers never see a partial file.
+        partial_path = local_path + ".partial"
+        with open(partial_path, "wb") as f:
+            f.write(content)
+        os.replace(partial_path, local_path)
+        _prune_cache_dir()
+    return local_path
+
+
+def read_parquet_columns(local_path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Reads a Parquet file, loading only `columns` when given.
+
+    Args:
+        local_path: The local path of the Parquet file.
+        columns: The columns to load; all columns when None.
+
+    Returns:
+        The loaded DataFrame.
+    """
+    return pq.read_table(local_path, columns=columns, memory_map=True).to_pandas()
+
+
+def parquet_columns(local_path: str) -> List[str]:
+    """Returns the column names of a Parquet file without reading its data."""
+    return pq.read_schema(local_path).names
@@ -0,0 +1,220 @@
+"""
+In-memory registry of upload/analysis jobs, used to report live progress.
+
+A job is created when an upload starts, under the client-supplied upload
+ID when there is one and no other user's job has it, and is also
+registered under its notebook ID once the notebook exists. The upload
+route and its background task record bytes received, chunks processed and
+stage transitions; the progress endpoints read snapshots. Jobs live in the
+API process only and are dropped PROGRESS_JOB_TTL_SECONDS after they
+finish. A job whose background steps nobody polls never sees them finish,
+so any job is also dropped PROGRESS_JOB_MAX_AGE_SECONDS after it started,
+whatever its stage.
+"""
+import os
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# How long a finished job stays queryable, in seconds.
+PROGRESS_JOB_TTL_SECONDS = int(os.getenv("PROGRESS_JOB_TTL_SECONDS", 3600))
+# How long any job, finished or not, stays in the registry, in seconds.
+PROGRESS_JOB_MAX_AGE_SECONDS = int(os.getenv("PROGRESS_JOB_MAX_AGE_SECONDS", 24 * 3600))
+
+# Pipeline stages, in order.
+STAGE_RECEIVING = "receiving"
+STAGE_STORED = "stored"
+STAGE_ANALYZED = "analyzed"
+STAGE_AI_INSIGHT_READY = "ai_insight_ready"
+STAGE_PARQUET_READY = "parquet_ready"
+STAGE_COMPLETED = "completed"
+STAGE_FAILED = "failed"
+
+
+class _Job:
+    def __init__(self, job_id: str, user_id: str, total_bytes: Optional[int]):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.notebook_id: Optional[str] = None
+        self.total_bytes = total_bytes
+        self.bytes_received = 0
+        self.chunks_processed = 0
+        self.estimated_total_chunks: Optional[int] = None
+        self.rows_processed = 0
+        self.analysis_started_at: Optional[float] = None
+        self.stage = STAGE_RECEIVING
+        self.stages: List[Dict[str, Any]] = [{"stage": STAGE_RECEIVING, "at": time.time()}]
+        self.error: Optional[str] = None
+        self.finished_at: Optional[float] = None
+        # Incremented on every change, so streaming clients can skip unchanged snapshots.
+        self.version = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        rows_per_second = None
+        if self.analysis_started_at is not None and self.rows_processed:
+            analysis_end = next((s["at"] for s in self.stages if s["stage"] == STAGE_ANALYZED), now)
+            elapsed = analysis_end - self.analysis_started_at
+            rows_per_second = round(self.rows_processed / elapsed, 1) if elapsed > 0 else None
+        stages = [
+            {**entry, "duration_seconds": round((nxt["at"] if nxt else (self.finished_at or now)) - entry["at"], 3)}
+            for entry, nxt in zip(self.stages, self.stages[1:] + [None])
+        ]
+        return {
+            "job_id": self.job_id,
+            "notebook_id": self.notebook_id,
+            "stage": self.stage,
+            "stages": stages,
+            "bytes_received": self.bytes_received,
+            "total_bytes": self.total_bytes,
+            "chunks_processed": self.chunks_processed,
+            "estimated_total_chunks": self.estimated_total_chunks,
+            "rows_processed": self.rows_processed,
+            "rows_per_second": rows_per_second,
+            "error": self.error,
+            "finished": self.finished_at is not None,
+            "version": self.version,
+        }
+
+
+class ProgressRegistry:
+    """
+    Thread-safe registry of pipeline jobs.
+
+    Updates may come from the event loop or from the threads
+    doing the analysis, so every access goes through one lock. Updates for
+    unknown job IDs are ignored, which lets callers report progress without
+    checking whether a job is tracked.
+    """
+
+    def __init__(self, ttl_seconds: int = PROGRESS_JOB_TTL_SECONDS, max_age_seconds: int = PROGRESS_JOB_MAX_AGE_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.max_age_seconds = max_age_seconds
+        self._jobs: Dict[str, _Job] = {}
+        self._lock = threading.Lock()
+
+    def start(self, job_id: str, user_id: str, total_bytes: Optional[int] = None) -> bool:
+        """
+        Creates a job, replacing any earlier job of the same user with the same ID.
+
+        Returns:
+            False, without creating the job, if the ID belongs to another user's job.
+        """
+        with self._lock:
+            self._prune()
+            existing = self._jobs.get(job_id)
+            if existing is not None and existing.user_id != user_id:
+                logger.warning(f"[Progress] User {user_id} tried to start job {job_id}, which belongs to another user.")
+                return False
+            self._jobs[job_id] = _Job(job_id, user_id, total_bytes)
+            return True
+
+    def attach_notebook(self, job_id: str, notebook_id: str) -> None:
+        """Makes a job reachable under its notebook ID as well."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                job.notebook_id = notebook_id
+                job.version += 1
+                self._jobs[notebook_id] = job
+
+    def record_bytes(self, job_id: str, bytes_received: int) -> None:
+        """Records the number of bytes received so far."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                job.bytes_received = bytes_received
+                job.version += 1
+
+    def start_analysis(self, job_id: str) -> None:
+        """Starts the rows-per-second clock, for analysis that runs alongside other stages."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                job.analysis_started_at = time.time()
+
+    def record_chunks(self, job_id: str, chunks_processed: int, estimated_total_chunks: int, rows_processed: int) -> None:
+        """Records analysis progress; unless `start_analysis` was called, the first call starts the rows-per-second clock."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                if job.analysis_started_at is None:
+                    job.analysis_started_at = job.stages[-1]["at"]
+                job.chunks_processed = chunks_processed
+                job.estimated_total_chunks = max(estimated_total_chunks, chunks_processed)
+                job.rows_processed = rows_processed
+                job.version += 1
+
+    def set_stage(self, job_id: str, stage: str) -> None:
+        """Moves a job to a new stage and logs how long the previous one took."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                self._set_stage(job, stage, time.time())
+
+    def record_stage(self, job_id: str, stage: str, at: float) -> None:
+        """
+        Moves a job to a stage reached at `at`, e.g. by a job in the job queue,
+        unless the job has already been in that stage or has finished.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job and job.finished_at is None and all(s["stage"] != stage for s in job.stages):
+                self._set_stage(job, stage, max(at, job.stages[-1]["at"]))
+
+    @staticmethod
+    def _set_stage(job: _Job, stage: str, now: float) -> None:
+        previous = job.stages[-1]
+        logger.info(
+            f"[Progress] Job {job.job_id}: {previous['stage']} -> {stage} after "
+            f"{now - previous['at']:.2f}s ({job.bytes_received} bytes, {job.rows_processed} rows)"
+        )
+        job.stage = stage
+        job.stages.append({"stage": stage, "at": now})
+        if stage == STAGE_ANALYZED and job.estimated_total_chunks is not None:
+            job.estimated_total_chunks = job.chunks_processed
+        if stage in (STAGE_COMPLETED, STAGE_FAILED):
+            job.finished_at = now
+        job.version += 1
+
+    def fail(self, job_id: str, error: str) -> None:
+        """Marks a job as failed, unless it has already finished."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job and job.finished_at is None:
+                job.error = error
+                self._set_stage(job, STAGE_FAILED, time.time())
+
+    def get(self, job_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns a snapshot of a job.
+
+        Args:
+            job_id: The upload ID or notebook ID of the job.
+            user_id: The ID of the requesting user.
+
+        Returns:
+            The job's progress, or None if there is no such job for this user.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.user_id != user_id:
+                return None
+            return job.snapshot()
+
+    def _prune(self) -> None:
+        now = time.time()
+        finished_cutoff = now - self.ttl_seconds
+        started_cutoff = now - self.max_age_seconds
+        expired = [
+            key for key, job in self._jobs.items()
+            if (job.finished_at is not None and job.finished_at < finished_cutoff) or job.stages[0]["at"] < started_cutoff
+        ]
+        for key in expired:
+            del self._jobs[key]
+
+
+progress_registry = ProgressRegistry()
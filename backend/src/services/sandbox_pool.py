@@ -0,0 +1,296 @@
+"""
+Pool of worker processes that run LLM-generated analysis code.
+
+Generated code never runs in the API process: each job is sent to an idle
+worker forked from a forkserver that has pandas preloaded, so starting or
+replacing a worker is cheap. A job is bounded by a wall-clock timeout and
+the worker's address space by RLIMIT_AS. A worker that times out, runs
+out of memory or dies is killed and replaced, and every worker is
+recycled after a number of jobs so leaked state cannot build up.
+"""
+import os
+import time
+import queue
+import asyncio
+import logging
+import threading
+import multiprocessing
+from typing import Any, Dict, Optional, Union
+
+import pandas as pd
+
+from ..lib.concurrency import run_blocking
+from . import code_executor
+from .code_executor import EXECUTION_ERROR_PREFIX
+from .shared_datasets import SharedDataset, open_shared_dataset
+
+logger = logging.getLogger(__name__)
+
+# Number of worker processes; 0 runs generated code in the API process instead.
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", 2))
+# Wall-clock limit for one execution, in seconds.
+SANDBOX_TIMEOUT_SECONDS = float(os.getenv("SANDBOX_TIMEOUT_SECONDS", 30))
+# Memory a worker may allocate beyond its size after start-up, in MB.
+SANDBOX_MEMORY_LIMIT_MB = int(os.getenv("SANDBOX_MEMORY_LIMIT_MB", 2048))
+# Jobs after which a worker is replaced by a fresh one.
+SANDBOX_MAX_JOBS_PER_WORKER = int(os.getenv("SANDBOX_MAX_JOBS_PER_WORKER", 100))
+# How long an execution may wait for a free worker, in seconds.
+SANDBOX_QUEUE_TIMEOUT_SECONDS = float(os.getenv("SANDBOX_QUEUE_TIMEOUT_SECONDS", 60))
+
+
+def _address_space_bytes() -> Optional[int]:
+    """Returns the current virtual memory size of this process, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def _limit_memory(memory_limit_mb: int) -> None:
+    """Caps the worker's address space at its current size plus `memory_limit_mb`."""
+    try:
+        import resource
+    except ImportError:
+        logger.warning("[Sandbox] The resource module is unavailable; worker memory is not limited.")
+        return
+    baseline = _address_space_bytes()
+    if baseline is None:
+        return
+    limit = baseline + memory_limit_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _worker_main(conn, memory_limit_mb: int) -> None:
+    """
+    Runs in a worker process: executes jobs received on `conn` until it is closed.
+
+    Each job is a (DataFrame or shared dataset path, code) pair; the reply
+    is (output, recycle), where `recycle` asks the pool to replace this
+    worker.
+    """
+    _limit_memory(memory_limit_mb)
+    # Shared datasets are backed by read-only memory; most writes copy the affected data.
+    pd.set_option("mode.copy_on_write", True)
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if job is None:
+            return
+        data, code = job
+        try:
+            df = open_shared_dataset(data) if isinstance(data, str) else data
+            try:
+                reply = (code_executor.run_generated_code(df, code), False)
+            except ValueError as e:
+                if not isinstance(data, str) or "read-only" not in str(e):
+                    raise
+                # The code writes into the mapped memory in place; run it again on a private copy.
+                df = df.copy()
+                reply = (code_executor.run_generated_code(df, code), False)
+        except MemoryError:
+            reply = (f"{EXECUTION_ERROR_PREFIX}the code ran out of memory.", True)
+        except Exception as e:
+            reply = (f"{EXECUTION_ERROR_PREFIX}{e}", False)
+        df = data = job = None
+        conn.send(reply)
+
+
+class _Worker:
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.jobs = 0
+
+    def stop(self, kill: bool = False) -> None:
+        try:
+            if kill:
+                self.process.kill()
+            else:
+                self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class SandboxPool:
+    """
+    A fixed-size pool of executor processes.
+
+    `execute_async` waits for a free worker on the event loop and only then
+    hands the job to the thread pool, so executions waiting for a worker do
+    not hold threads of `run_blocking`. `execute` blocks until a worker is
+    free and the job has finished. Workers are started by `start`, or on
+    first use.
+    """
+
+    def __init__(
+        self,
+        size: int = SANDBOX_WORKERS,
+        timeout_seconds: float = SANDBOX_TIMEOUT_SECONDS,
+        memory_limit_mb: int = SANDBOX_MEMORY_LIMIT_MB,
+        max_jobs_per_worker: int = SANDBOX_MAX_JOBS_PER_WORKER,
+        queue_timeout_seconds: float = SANDBOX_QUEUE_TIMEOUT_SECONDS
+    ):
+        self.size = size
+        self.timeout_seconds = timeout_seconds
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.memory_limit_mb = memory_limit_mb
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.jobs = 0
+        self.timeouts = 0
+        self.crashes = 0
+        self.recycled = 0
+        self.queue_timeouts = 0
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        # One permit per worker, so at most `size` executions hold a thread at a time.
+        self._slots = asyncio.Semaphore(max(size, 1))
+        self._context = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """Whether generated code runs in worker processes."""
+        return self.size > 0
+
+    def start(self) -> None:
+        """Starts the forkserver and the workers, if they are not running yet."""
+        if self.size <= 0:
+            return
+        with self._start_lock:
+            if self._context is not None:
+                return
+            self._context = multiprocessing.get_context("forkserver")
+            # Imported once by the forkserver, then shared by every forked worker.
+            self._context.set_forkserver_preload(["pandas", __name__])
+            for _ in range(self.size):
+                self._idle.put(self._spawn())
+            logger.info(f"[Sandbox] Started {self.size} executor workers.")
+
+    def _spawn(self) -> _Worker:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main, args=(child_conn, self.memory_limit_mb), name="mardata-sandbox", daemon=True
+        )
+        process.start()
+        child_conn.close()
+        return _Worker(process, parent_conn)
+
+    def _replace(self, worker: _Worker, kill: bool) -> None:
+        worker.stop(kill=kill)
+        with self._stats_lock:
+            self.recycled += 1
+        self._idle.put(self._spawn())
+
+    def execute(self, data: Union[pd.DataFrame, SharedDataset], code: str) -> str:
+        """
+        Runs generated code against a dataset in a worker process.
+
+        A shared dataset is mapped by the worker, which avoids copying the
+        data through the pipe; a DataFrame is pickled to it.
+
+        Args:
+            data: The dataset, available to the code as `df`. A shared
+                dataset must stay referenced until this returns.
+            code: The Python code to run.
+
+        Returns:
+            The code's printed output, or a message starting with
+            EXECUTION_ERROR_PREFIX if it failed, timed out or exhausted its
+            memory.
+        """
+        if not self.enabled:
+            df = open_shared_dataset(data.path) if isinstance(data, SharedDataset) else data
+            return code_executor.execute_sandboxed_code(df, code)
+        self.start()
+
+        try:
+            worker = self._idle.get(timeout=self.queue_timeout_seconds)
+        except queue.Empty:
+            return self._busy()
+        started = time.monotonic()
+        with self._stats_lock:
+            self.jobs += 1
+        try:
+            worker.conn.send((data.path if isinstance(data, SharedDataset) else data, code))
+            if not worker.conn.poll(self.timeout_seconds):
+                with self._stats_lock:
+                    self.timeouts += 1
+                logger.warning(f"[Sandbox] Execution timed out after {self.timeout_seconds}s; replacing worker.")
+                self._replace(worker, kill=True)
+                return f"{EXECUTION_ERROR_PREFIX}the code did not finish within {self.timeout_seconds:g} seconds."
+            output, recycle = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            with self._stats_lock:
+                self.crashes += 1
+            logger.error(f"[Sandbox] Worker {worker.process.pid} died (exit code {worker.process.exitcode}): {e}")
+            self._replace(worker, kill=True)
+            return f"{EXECUTION_ERROR_PREFIX}the execution process stopped unexpectedly."
+        except BaseException:
+            # The job may still be running; the worker cannot be reused.
+            self._replace(worker, kill=True)
+            raise
+
+        worker.jobs += 1
+        logger.info(f"[Sandbox] Executed code in {time.monotonic() - started:.2f}s (worker {worker.process.pid}).")
+        if recycle or worker.jobs >= self.max_jobs_per_worker:
+            self._replace(worker, kill=False)
+        else:
+            self._idle.put(worker)
+        return output
+
+    async def execute_async(self, data: Union[pd.DataFrame, SharedDataset], code: str) -> str:
+        """
+        Runs generated code like `execute`, from the event loop.
+
+        Waits up to `queue_timeout_seconds` for one of the pool's permits
+        before using a thread of `run_blocking`.
+        """
+        if not self.enabled:
+            return await run_blocking(self.execute, data, code)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout_seconds)
+        except asyncio.TimeoutError:
+            return self._busy()
+        try:
+            return await run_blocking(self.execute, data, code)
+        finally:
+            self._slots.release()
+
+    def _busy(self) -> str:
+        with self._stats_lock:
+            self.queue_timeouts += 1
+        logger.warning(f"[Sandbox] No worker became free within {self.queue_timeout_seconds:g}s.")
+        return f"{EXECUTION_ERROR_PREFIX}the server is busy; no executor became free within {self.queue_timeout_seconds:g} seconds."
+
+    def shutdown(self) -> None:
+        """Stops the idle workers."""
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            worker.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the pool counters."""
+        with self._stats_lock:
+            return {
+                "workers": self.size,
+                "idle_workers": self._idle.qsize(),
+                "jobs": self.jobs,
+                "timeouts": self.timeouts,
+                "crashes": self.crashes,
+                "recycled": self.recycled,
+                "queue_timeouts": self.queue_timeouts,
+            }
+
+
+sandbox_pool = SandboxPool()
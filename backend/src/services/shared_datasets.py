@@ -0,0 +1,159 @@
+"""
+Datasets shared with the sandbox workers as memory-mapped Arrow IPC files.
+
+A cached DataFrame is written once to an Arrow IPC file in a cache
+directory (in shared memory when /dev/shm exists). Workers map the file and
+wrap its buffers as a DataFrame without copying them, instead of receiving
+a pickled copy of the data with every question. Files are reference
+counted: the DataFrame cache holds one reference while the frame is cached
+and every running job holds another; the file is deleted when the last
+reference is released.
+"""
+import os
+import uuid
+import logging
+import tempfile
+import threading
+from typing import Any, Dict, Optional
+
+import pandas as pd
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+# Directory for the shared files; shared memory is used when available.
+SHARED_DATASET_DIR = os.getenv(
+    "SHARED_DATASET_DIR",
+    "/dev/shm/mardata-datasets" if os.path.isdir("/dev/shm") else os.path.join(tempfile.gettempdir(), "mardata-datasets")
+)
+
+
+class SharedDataset:
+    """A reference-counted Arrow IPC file holding one DataFrame."""
+
+    def __init__(self, path: str, nbytes: int):
+        self.path = path
+        self.nbytes = nbytes
+        self.refs = 1
+
+
+def _arrow_types(arrow_type: pa.DataType) -> Optional[Any]:
+    # Strings stay in their Arrow buffers instead of becoming Python objects.
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pd.StringDtype("pyarrow")
+    return None
+
+
+def open_shared_dataset(path: str) -> pd.DataFrame:
+    """
+    Maps a shared dataset file and wraps it as a DataFrame.
+
+    Numeric columns without missing values and string columns reference
+    the mapped memory directly; other columns are converted as usual.
+    Zero-copy columns are read-only: callers should enable pandas'
+    copy-on-write mode, and copy the frame if an in-place write still
+    fails.
+
+    Args:
+        path: The path of a file written by `SharedDatasetStore.publish`.
+
+    Returns:
+        The DataFrame.
+    """
+    table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    return table.to_pandas(split_blocks=True, types_mapper=_arrow_types)
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedDatasetStore:
+    """Writes, reference counts and deletes shared dataset files."""
+
+    def __init__(self, directory: str = SHARED_DATASET_DIR):
+        self.directory = directory
+        self.published = 0
+        self.released = 0
+        self.current_bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._remove_stale_files()
+
+    def _remove_stale_files(self) -> None:
+        # Files are named after the process that wrote them; those of
+        # processes that are gone were never released.
+        for name in os.listdir(self.directory):
+            pid = name.split("-", 1)[0]
+            if pid.isdigit() and not _process_alive(int(pid)):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def publish(self, df: pd.DataFrame) -> SharedDataset:
+        """
+        Writes a DataFrame to a new shared file.
+
+        Returns:
+            The dataset, holding one reference owned by the caller.
+
+        Raises:
+            pyarrow.ArrowException: If the frame cannot be converted to
+                Arrow (e.g. a column mixes incompatible types).
+        """
+        table = pa.Table.from_pandas(df, preserve_index=True)
+        path = os.path.join(self.directory, f"{os.getpid()}-{uuid.uuid4().hex}.arrow")
+        partial_path = f"{path}.partial"
+        try:
+            with pa.OSFile(partial_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            os.replace(partial_path, path)
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+        dataset = SharedDataset(path, os.path.getsize(path))
+        with self._lock:
+            self.published += 1
+            self.current_bytes += dataset.nbytes
+        logger.info(f"Published shared dataset {path} ({dataset.nbytes} bytes).")
+        return dataset
+
+    def retain(self, dataset: SharedDataset) -> SharedDataset:
+        """Adds a reference to a dataset and returns it."""
+        with self._lock:
+            dataset.refs += 1
+        return dataset
+
+    def release(self, dataset: SharedDataset) -> None:
+        """Drops a reference; the file is deleted with the last one."""
+        with self._lock:
+            dataset.refs -= 1
+            if dataset.refs > 0:
+                return
+            self.released += 1
+            self.current_bytes -= dataset.nbytes
+        try:
+            os.remove(dataset.path)
+        except OSError as e:
+            logger.warning(f"Could not delete shared dataset {dataset.path}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the number of published and released files and the bytes in use."""
+        with self._lock:
+            return {
+                "directory": self.directory,
+                "published": self.published,
+                "released": self.released,
+                "current_bytes": self.current_bytes,
+            }
+
+
+shared_datasets = SharedDatasetStore()
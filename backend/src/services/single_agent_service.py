@@ -58,8 +58,8 @@ async def run_single_agent_analysis(business_problem: str, statistical_summary:
     **RELATÓRIO EXECUTIVO DE ANÁLISE E ESTRATÉGIA (Formato Markdown, em texto corrido):**
     """
 
-    # --- 3. Invoke LLM ---
-    response = llm_llama_70b.invoke(prompt)
+    # --- 3. Invoke LLM (asynchronously, so the event loop keeps serving other requests) ---
+    response = await llm_llama_70b.ainvoke(prompt)
     final_report = response.content
 
     return final_report
@@ -0,0 +1,150 @@
+"""
+SQL execution mode for chat questions, backed by an embedded DuckDB.
+
+Instead of pandas code, the LLM writes one SELECT query against a table
+named `data`, which DuckDB reads straight from the notebook's local Parquet
+file. Only the columns and row groups the query needs are read, aggregations
+run on several threads and the dataset is never loaded into a DataFrame.
+Each query gets its own in-memory connection that can read that one file
+and nothing else.
+"""
+import os
+import logging
+import threading
+from typing import List, Tuple
+
+import duckdb
+import pandas as pd
+
+from .code_executor import EXECUTION_ERROR_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# How chat questions are answered with data: "pandas" (generated Python code)
+# or "sql" (generated SQL over the optimized Parquet file, when there is one).
+CHAT_EXECUTION_MODE = os.getenv("CHAT_EXECUTION_MODE", "pandas")
+# DuckDB resources per query: threads and memory limit (e.g. "1GB").
+DUCKDB_THREADS = int(os.getenv("DUCKDB_THREADS", os.cpu_count() or 4))
+DUCKDB_MEMORY_LIMIT = os.getenv("DUCKDB_MEMORY_LIMIT", "1GB")
+# Wall-clock limit for one query, in seconds.
+SQL_TIMEOUT_SECONDS = float(os.getenv("SQL_TIMEOUT_SECONDS", 30))
+# Maximum number of result rows passed on to the answer.
+SQL_RESULT_MAX_ROWS = int(os.getenv("SQL_RESULT_MAX_ROWS", 200))
+
+# Name of the table queries run against.
+TABLE_NAME = "data"
+
+
+class SQLQueryError(Exception):
+    """Raised when a generated query is not a single read-only SELECT."""
+
+
+def sql_mode_enabled() -> bool:
+    """Whether chat questions are answered with SQL where possible."""
+    return CHAT_EXECUTION_MODE == "sql"
+
+
+def validate_query(query: str) -> str:
+    """
+    Checks that a query is a single SELECT (or WITH ... SELECT) statement.
+
+    Args:
+        query: The SQL text.
+
+    Returns:
+        The query, without surrounding whitespace and trailing semicolons.
+
+    Raises:
+        SQLQueryError: If the query cannot be parsed, holds several
+            statements or is not a SELECT.
+    """
+    try:
+        statements = duckdb.extract_statements(query)
+    except duckdb.Error as e:
+        raise SQLQueryError(f"Invalid SQL: {e}") from e
+    if len(statements) != 1:
+        raise SQLQueryError("Exactly one SQL statement is allowed.")
+    if statements[0].type != duckdb.StatementType.SELECT:
+        raise SQLQueryError("Only SELECT queries are allowed.")
+    return query.strip().rstrip(";").strip()
+
+
+def _connect(parquet_path: str) -> duckdb.DuckDBPyConnection:
+    """Opens an in-memory connection with `data` mapped to the Parquet file and all other file access disabled."""
+    connection = duckdb.connect(config={"threads": DUCKDB_THREADS, "memory_limit": DUCKDB_MEMORY_LIMIT})
+    quoted_path = parquet_path.replace("'", "''")
+    connection.execute(f"SET allowed_paths = ['{quoted_path}']")
+    connection.execute("SET enable_external_access = false")
+    # The query cannot turn file access back on.
+    connection.execute("SET lock_configuration = true")
+    connection.execute(f"CREATE VIEW {TABLE_NAME} AS SELECT * FROM read_parquet('{quoted_path}')")
+    return connection
+
+
+def describe_parquet(parquet_path: str) -> List[Tuple[str, str]]:
+    """
+    Returns the columns of the `data` table for a Parquet file.
+
+    Returns:
+        (column name, DuckDB type) pairs.
+    """
+    connection = _connect(parquet_path)
+    try:
+        return [(row[0], row[1]) for row in connection.execute(f"DESCRIBE {TABLE_NAME}").fetchall()]
+    finally:
+        connection.close()
+
+
+def run_query(parquet_path: str, query: str) -> str:
+    """
+    Runs a generated query over a Parquet file and formats its result.
+
+    Args:
+        parquet_path: The local path of the notebook's Parquet file.
+        query: The SQL query; it must pass `validate_query`.
+
+    Returns:
+        The result as text, like a printed DataFrame, truncated to
+        SQL_RESULT_MAX_ROWS rows.
+
+    Raises:
+        SQLQueryError: If the query is not allowed.
+        duckdb.Error: If the query fails or exceeds SQL_TIMEOUT_SECONDS.
+    """
+    query = validate_query(query)
+    connection = _connect(parquet_path)
+    timer = threading.Timer(SQL_TIMEOUT_SECONDS, connection.interrupt)
+    timer.start()
+    try:
+        cursor = connection.execute(query)
+        rows = cursor.fetchmany(SQL_RESULT_MAX_ROWS + 1)
+        columns = [column[0] for column in cursor.description]
+    finally:
+        timer.cancel()
+        connection.close()
+
+    truncated = len(rows) > SQL_RESULT_MAX_ROWS
+    result = pd.DataFrame(rows[:SQL_RESULT_MAX_ROWS], columns=columns).to_string(index=False)
+    if truncated:
+        result += f"\n(only the first {SQL_RESULT_MAX_ROWS} rows are shown)"
+    return result
+
+
+def execute_sql_query(parquet_path: str, query: str) -> str:
+    """
+    Runs a generated query, returning failures as text like `execute_sandboxed_code`.
+
+    Returns:
+        The formatted result, or a message starting with EXECUTION_ERROR_PREFIX.
+    """
+    try:
+        result = run_query(parquet_path, query)
+        logger.info(f"Executed SQL output: {result}")
+        return result
+    except duckdb.InterruptException:
+        logger.warning(f"SQL query timed out after {SQL_TIMEOUT_SECONDS}s.")
+        return f"{EXECUTION_ERROR_PREFIX}the query did not finish within {SQL_TIMEOUT_SECONDS:g} seconds."
+    except (SQLQueryError, duckdb.Error) as e:
+        logger.error(f"Error executing SQL: {e}")
+        return f"{EXECUTION_ERROR_PREFIX}{e}"
+
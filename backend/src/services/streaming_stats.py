@@ -0,0 +1,342 @@
+"""
+Mergeable streaming accumulators used by the chunked analysis pipeline.
+
+Every accumulator here can be updated one chunk at a time and merged with
+another accumulator of the same kind, so partial results computed over
+different parts of a file can be combined without revisiting the data.
+Memory usage does not depend on the number of rows processed.
+"""
+import math
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+class RunningMoments:
+    """
+    Tracks count, mean, variance, min and max of a numeric stream.
+
+    Chunks are summarized with numpy and combined using the parallel
+    variant of Welford's algorithm (Chan et al.), which avoids the
+    catastrophic cancellation of the naive sum-of-squares formula.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, values: np.ndarray) -> None:
+        """
+        Adds a batch of values to the accumulator. NaNs are ignored.
+
+        Args:
+            values: A 1-D numeric array.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return
+        batch_mean = float(values.mean())
+        batch_m2 = float(((values - batch_mean) ** 2).sum())
+        self._combine(values.size, batch_mean, batch_m2, float(values.min()), float(values.max()))
+
+    def merge(self, other: "RunningMoments") -> None:
+        """Merges another accumulator into this one."""
+        if other.count == 0:
+            return
+        self._combine(other.count, other.mean, other.m2, other.min, other.max)
+
+    def _combine(self, count: int, mean: float, m2: float, min_val: float, max_val: float) -> None:
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = min(self.min, min_val)
+        self.max = max(self.max, max_val)
+
+    @property
+    def variance(self) -> float:
+        """Sample variance (ddof=1), matching pandas. NaN for fewer than 2 values."""
+        if self.count < 2:
+            return float('nan')
+        return self.m2 / (self.count - 1)
+
+    @property
+    def std(self) -> float:
+        """Sample standard deviation (ddof=1), matching pandas."""
+        return math.sqrt(self.variance) if self.count >= 2 else float('nan')
+
+
+class QuantileSketch:
+    """
+    A KLL quantile sketch with bounded memory.
+
+    Items are kept in a hierarchy of compactors: an item stored at level h
+    stands for 2**h original values. When the sketch grows beyond its
+    capacity, the lowest full level is sorted and every other item is
+    promoted to the next level. The rank error is roughly 1.65 / k, and
+    memory stays at O(k) items regardless of how many values are added.
+
+    While no compaction has happened the sketch holds every value, so
+    quantiles are exact (and identical to pandas) for small inputs.
+    """
+
+    _SHRINK_FACTOR = 2 / 3
+
+    def __init__(self, k: int = 1024, seed: Optional[int] = 0):
+        self.k = k
+        self.count = 0
+        self._levels: List[np.ndarray] = [np.empty(0, dtype=np.float64)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self._levels) - level - 1
+        return max(2, int(math.ceil(self.k * self._SHRINK_FACTOR ** depth)))
+
+    def update(self, values: np.ndarray) -> None:
+        """
+        Adds a batch of values to the sketch. NaNs are ignored.
+
+        Args:
+            values: A 1-D numeric array.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return
+        self.count += values.size
+        self._levels[0] = np.concatenate([self._levels[0], values])
+        self._compress()
+
+    def merge(self, other: "QuantileSketch") -> None:
+        """Merges another sketch into this one."""
+        if other.count == 0:
+            return
+        while len(self._levels) < len(other._levels):
+            self._levels.append(np.empty(0, dtype=np.float64))
+        for level, items in enumerate(other._levels):
+            self._levels[level] = np.concatenate([self._levels[level], items])
+        self.count += other.count
+        self._compress()
+
+    def _compress(self) -> None:
+        level = 0
+        while level < len(self._levels):
+            items = self._levels[level]
+            if items.size > self._capacity(level):
+                if level + 1 == len(self._levels):
+                    self._levels.append(np.empty(0, dtype=np.float64))
+                items = np.sort(items)
+                # An odd leftover item stays at the current level so no weight is lost.
+                if items.size % 2:
+                    kept, items = items[-1:], items[:-1]
+                else:
+                    kept = np.empty(0, dtype=np.float64)
+                offset = int(self._rng.integers(0, 2))
+                self._levels[level + 1] = np.concatenate([self._levels[level + 1], items[offset::2]])
+                self._levels[level] = kept
+            level += 1
+
+    def quantiles(self, qs: Sequence[float]) -> List[float]:
+        """
+        Estimates the given quantiles.
+
+        Args:
+            qs: Quantiles in the [0, 1] range.
+
+        Returns:
+            One estimate per requested quantile (NaN if the sketch is empty).
+        """
+        if self.count == 0:
+            return [float('nan') for _ in qs]
+        if all(items.size == 0 for items in self._levels[1:]):
+            # Nothing was compacted yet: compute exact, linearly interpolated quantiles.
+            return [float(v) for v in np.quantile(self._levels[0], qs)]
+
+        items = np.concatenate(self._levels)
+        weights = np.concatenate(
+            [np.full(level_items.size, 2 ** level, dtype=np.float64) for level, level_items in enumerate(self._levels)]
+        )
+        order = np.argsort(items, kind='mergesort')
+        items, weights = items[order], weights[order]
+        # Midpoint ranks, normalized to [0, 1], interpolated like pandas' "linear" method.
+        cumulative = np.cumsum(weights) - weights / 2
+        positions = (cumulative - cumulative[0]) / max(cumulative[-1] - cumulative[0], 1e-12)
+        return [float(np.interp(q, positions, items)) for q in qs]
+
+
+class PairwiseCoMoments:
+    """
+    Pairwise co-moment matrices for a fixed set of numeric columns.
+
+    For every pair of columns (i, j) it keeps the number of rows where both
+    are present, the mean of each column over those rows, the sum of squared
+    deviations of each column over those rows and the sum of cross
+    deviations. This yields the pairwise-complete Pearson correlation
+    computed by `DataFrame.corr()` while using O(columns**2) memory.
+    """
+
+    def __init__(self, n_columns: int):
+        shape = (n_columns, n_columns)
+        self.n = np.zeros(shape, dtype=np.float64)
+        # mean[i, j]: mean of column i over rows where columns i and j are both present.
+        self.mean = np.zeros(shape, dtype=np.float64)
+        # m2[i, j]: squared deviations of column i over rows where i and j are present.
+        self.m2 = np.zeros(shape, dtype=np.float64)
+        # comoment[i, j]: cross deviations of columns i and j over their shared rows.
+        self.comoment = np.zeros(shape, dtype=np.float64)
+
+    def update(self, values: np.ndarray) -> None:
+        """
+        Adds a batch of rows to the accumulator.
+
+        Args:
+            values: A 2-D float array of shape (rows, columns). NaNs mark missing values.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if values.shape[0] == 0:
+            return
+        present = ~np.isnan(values)
+        mask = present.astype(np.float64)
+        # Shift by the column means first to keep the sums numerically stable.
+        with np.errstate(invalid='ignore'):
+            shift = np.nanmean(values, axis=0)
+        shift = np.where(np.isnan(shift), 0.0, shift)
+        centered = np.where(present, values - shift, 0.0)
+
+        n = mask.T @ mask
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sums = centered.T @ mask
+            mean = np.where(n > 0, sums / n, 0.0)
+            m2 = (centered ** 2).T @ mask - n * mean ** 2
+            comoment = centered.T @ centered - n * mean * mean.T
+        self._combine(n, mean + shift[:, None], m2, comoment)
+
+    def merge(self, other: "PairwiseCoMoments") -> None:
+        """Merges another accumulator into this one."""
+        self._combine(other.n, other.mean, other.m2, other.comoment)
+
+    def _combine(self, n: np.ndarray, mean: np.ndarray, m2: np.ndarray, comoment: np.ndarray) -> None:
+        total = self.n + n
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = np.where(total > 0, self.n * n / total, 0.0)
+            delta = mean - self.mean
+            self.comoment = self.comoment + comoment + delta * delta.T * weight
+            self.m2 = self.m2 + m2 + delta ** 2 * weight
+            self.mean = np.where(total > 0, self.mean + delta * n / total, 0.0)
+        self.n = total
+
+    def correlation(self) -> np.ndarray:
+        """
+        Returns the Pearson correlation matrix. Pairs without variance are NaN.
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            denominator = np.sqrt(self.m2 * self.m2.T)
+            corr = np.where(denominator > 0, self.comoment / denominator, np.nan)
+        return np.clip(corr, -1.0, 1.0)
+
+
+class HeavyHitters:
+    """
+    Misra-Gries summary of the most frequent values in a stream.
+
+    At most `capacity` counters are kept. When a chunk brings the summary
+    over capacity, the (capacity + 1)-th largest count is subtracted from
+    every counter and the non-positive ones are dropped. Each reported count
+    is a lower bound on the true frequency and undercounts by at most
+    `error`, which never exceeds total / (capacity + 1).
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.capacity = capacity
+        self.total = 0
+        self.error = 0
+        self._counts = pd.Series(dtype='int64')
+
+    def update(self, counts: pd.Series) -> None:
+        """
+        Adds the value counts of a chunk to the summary.
+
+        Args:
+            counts: A Series mapping each value to its frequency in the chunk,
+                as returned by `Series.value_counts()`.
+        """
+        if counts.empty:
+            return
+        self.total += int(counts.sum())
+        self._combine(counts)
+
+    def merge(self, other: "HeavyHitters") -> None:
+        """Merges another summary into this one."""
+        self.total += other.total
+        self.error += other.error
+        if not other._counts.empty:
+            self._combine(other._counts)
+
+    def _combine(self, counts: pd.Series) -> None:
+        combined = self._counts.add(counts, fill_value=0) if not self._counts.empty else counts
+        combined = combined.astype('int64')
+        if len(combined) > self.capacity:
+            threshold = int(combined.nlargest(self.capacity + 1).iloc[-1])
+            combined = combined - threshold
+            combined = combined[combined > 0]
+            self.error += threshold
+        self._counts = combined
+
+    def top(self, n: int = 20) -> Dict[Any, int]:
+        """Returns the `n` most frequent values with their (lower-bound) counts."""
+        return self._counts.nlargest(n).to_dict()
+
+
+class HyperLogLog:
+    """
+    HyperLogLog distinct-count estimator.
+
+    Uses 2**precision one-byte registers (16 KB at the default precision),
+    giving a relative standard error of about 1.04 / sqrt(2**precision),
+    i.e. roughly 0.8%. Adding the same value twice has no effect, so it is
+    enough to feed it the distinct values of each chunk.
+    """
+
+    def __init__(self, precision: int = 14):
+        self.precision = precision
+        self._registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, values: pd.Series) -> None:
+        """
+        Adds values to the estimator.
+
+        Args:
+            values: The values to count. Duplicates are allowed.
+        """
+        if len(values) == 0:
+            return
+        hashes = pd.util.hash_pandas_object(pd.Series(values), index=False).to_numpy(dtype=np.uint64)
+        value_bits = 64 - self.precision
+        index = (hashes >> np.uint64(value_bits)).astype(np.intp)
+        remainder = hashes & np.uint64((1 << value_bits) - 1)
+        # Position of the leftmost 1-bit in the remaining bits. The remainder is
+        # below 2**53, so the float conversion used by frexp is exact.
+        _, bit_length = np.frexp(remainder.astype(np.float64))
+        rank = (value_bits - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self._registers, index, rank)
+
+    def merge(self, other: "HyperLogLog") -> None:
+        """Merges another estimator with the same precision into this one."""
+        np.maximum(self._registers, other._registers, out=self._registers)
+
+    def estimate(self) -> int:
+        """Returns the estimated number of distinct values."""
+        m = self._registers.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self._registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self._registers == 0))
+        if raw <= 2.5 * m and zeros > 0:
+            # Small-range correction (linear counting).
+            return int(round(m * math.log(m / zeros)))
+        return int(round(raw))
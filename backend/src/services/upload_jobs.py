@@ -0,0 +1,140 @@
+"""
+Background jobs of an upload: the initial AI insight and the Parquet conversion.
+
+They run in the job workers (see `job_worker.py`). The insight is what the
+user is waiting for, so it has priority over conversions, which are
+CPU-heavy and limited to a few at a time. Their outcome is copied into the
+progress registry of the API process by `sync_upload_progress`.
+"""
+import os
+import logging
+from typing import Any, Dict, List, Optional
+
+from ..lib.repositories import get_repositories
+from .ai_service import get_ai_insights
+from .job_queue import JobContext, JobType, PermanentJobError, job_queue, STATUS_FAILED, STATUS_SUCCEEDED
+from .optimization_service import convert_to_parquet_and_update_record, remove_upload_files
+from .progress_service import progress_registry, STAGE_AI_INSIGHT_READY, STAGE_PARQUET_READY, STAGE_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+AI_INSIGHT_JOB = "ai_insight"
+PARQUET_CONVERSION_JOB = "parquet_conversion"
+
+# Jobs of each type running at the same time, across all workers.
+JOB_AI_INSIGHT_CONCURRENCY = int(os.getenv("JOB_AI_INSIGHT_CONCURRENCY", 4))
+JOB_PARQUET_CONVERSION_CONCURRENCY = int(os.getenv("JOB_PARQUET_CONVERSION_CONCURRENCY", 1))
+
+AI_INSIGHT_PRIORITY = 10
+PARQUET_CONVERSION_PRIORITY = 0
+
+
+async def run_ai_insight(payload: Dict[str, Any], job: JobContext) -> None:
+    """Generates the first AI insight of a notebook and stores the opening conversation."""
+    repositories = await get_repositories()
+    ai_insight = await get_ai_insights(payload["analysis_json"], payload["business_problem"], payload["notebook_id"])
+    await repositories.messages.add_many([
+        {"notebook_id": payload["notebook_id"], "role": "user", "content": payload["business_problem"]},
+        {"notebook_id": payload["notebook_id"], "role": "assistant", "content": ai_insight}
+    ])
+
+
+async def run_parquet_conversion(payload: Dict[str, Any], job: JobContext) -> Dict[str, Any]:
+    """
+    Uploads the Parquet copy of an upload, converting the original file if
+    the analysis did not write one. The local files are removed once the
+    job succeeds or runs out of attempts.
+    """
+    original_file_path = payload["original_file_path"]
+    parquet_path = payload.get("parquet_path")
+    if not os.path.exists(original_file_path) and not (parquet_path and os.path.exists(parquet_path)):
+        raise PermanentJobError("The uploaded file is no longer on disk.")
+    try:
+        optimized_file_path = await convert_to_parquet_and_update_record(
+            original_file_path=original_file_path,
+            original_file_name=payload["original_file_name"],
+            notebook_id=payload["notebook_id"],
+            user_id=payload["user_id"],
+            repositories=await get_repositories(),
+            parquet_path=parquet_path
+        )
+    except Exception:
+        if job.is_last_attempt:
+            remove_upload_files(original_file_path, parquet_path)
+        raise
+    remove_upload_files(original_file_path, parquet_path)
+    return {"optimized_file_path": optimized_file_path}
+
+
+job_queue.register(JobType(AI_INSIGHT_JOB, run_ai_insight, JOB_AI_INSIGHT_CONCURRENCY))
+job_queue.register(JobType(PARQUET_CONVERSION_JOB, run_parquet_conversion, JOB_PARQUET_CONVERSION_CONCURRENCY))
+
+
+def enqueue_upload_jobs(
+    notebook_id: str,
+    user_id: str,
+    business_problem: str,
+    analysis_json: Any,
+    original_file_path: Optional[str],
+    original_file_name: str,
+    parquet_path: Optional[str] = None
+) -> List[str]:
+    """
+    Queues the background jobs of an upload.
+
+    Args:
+        notebook_id: The notebook created for the upload.
+        user_id: The owner of the notebook.
+        business_problem: The question asked with the upload.
+        analysis_json: The statistical summary of the data.
+        original_file_path: The local copy of the upload, or None when the
+            upload reused the Parquet file of an earlier one with the same
+            content, in which case no conversion is queued.
+        original_file_name: The name of the uploaded file.
+        parquet_path: A Parquet file written during the analysis, if any.
+
+    Returns:
+        The IDs of the queued jobs.
+    """
+    job_ids = [job_queue.enqueue(
+        AI_INSIGHT_JOB,
+        {"notebook_id": notebook_id, "business_problem": business_problem, "analysis_json": analysis_json},
+        user_id=user_id, group_key=notebook_id, priority=AI_INSIGHT_PRIORITY
+    )]
+    if original_file_path is not None:
+        job_ids.append(job_queue.enqueue(
+            PARQUET_CONVERSION_JOB,
+            {
+                "notebook_id": notebook_id,
+                "user_id": user_id,
+                "original_file_path": original_file_path,
+                "original_file_name": original_file_name,
+                "parquet_path": parquet_path,
+            },
+            user_id=user_id, group_key=notebook_id, priority=PARQUET_CONVERSION_PRIORITY
+        ))
+    return job_ids
+
+
+def sync_upload_progress(notebook_id: str) -> None:
+    """
+    Copies the state of a notebook's upload jobs into the progress registry.
+
+    A failed insight fails the upload. A failed conversion does not, since
+    the notebook still works from the original file, as before jobs existed.
+    """
+    jobs = job_queue.list_for_group(notebook_id)
+    if not jobs:
+        return
+    for job in sorted(jobs, key=lambda j: j["finished_at"] or float("inf")):
+        if job["type"] == AI_INSIGHT_JOB:
+            if job["status"] == STATUS_FAILED:
+                progress_registry.fail(notebook_id, job["error"] or "The AI insight could not be generated.")
+                return
+            if job["status"] == STATUS_SUCCEEDED:
+                progress_registry.record_stage(notebook_id, STAGE_AI_INSIGHT_READY, job["finished_at"])
+        elif job["type"] == PARQUET_CONVERSION_JOB and job["status"] == STATUS_SUCCEEDED:
+            if job["result"] and job["result"].get("optimized_file_path"):
+                progress_registry.record_stage(notebook_id, STAGE_PARQUET_READY, job["finished_at"])
+    if all(job["status"] in (STATUS_SUCCEEDED, STATUS_FAILED) for job in jobs):
+        progress_registry.record_stage(notebook_id, STAGE_COMPLETED, max(job["finished_at"] for job in jobs))
@@ -0,0 +1,108 @@
+"""
+Service for receiving uploaded files without holding them in memory.
+"""
+import os
+import hashlib
+from typing import Any, Callable, Dict, NamedTuple, Optional
+from fastapi import UploadFile
+
+from ..lib.repositories import Repositories
+
+# Size of each read from the upload stream.
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+# Largest accepted upload, in bytes (1 GB by default).
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 1024 * 1024 * 1024))
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the maximum allowed size."""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"File exceeds the maximum upload size of {max_bytes} bytes.")
+        self.max_bytes = max_bytes
+
+
+class SavedUpload(NamedTuple):
+    size_bytes: int
+    sha256: str
+
+
+async def save_upload_to_disk(
+    file: UploadFile,
+    destination: str,
+    max_bytes: int = MAX_UPLOAD_BYTES,
+    progress_callback: Optional[Callable[[int], None]] = None
+) -> SavedUpload:
+    """
+    Copies an uploaded file to disk in fixed-size chunks.
+
+    The byte count and SHA-256 digest are computed during the copy, so the
+    file does not need to be read again to get them. A partially written
+    file is removed if the upload is rejected.
+
+    Args:
+        file: The uploaded file from the FastAPI request.
+        destination: The local path to write to.
+        max_bytes: The maximum accepted size, in bytes.
+        progress_callback: Called with the number of bytes saved so far after each chunk.
+
+    Returns:
+        The size and hex SHA-256 digest of the saved file.
+
+    Raises:
+        UploadTooLargeError: If the upload is larger than `max_bytes`.
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise UploadTooLargeError(max_bytes)
+
+    digest = hashlib.sha256()
+    size_bytes = 0
+    try:
+        with open(destination, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size_bytes += len(chunk)
+                if size_bytes > max_bytes:
+                    raise UploadTooLargeError(max_bytes)
+                digest.update(chunk)
+                buffer.write(chunk)
+                if progress_callback:
+                    progress_callback(size_bytes)
+    except UploadTooLargeError:
+        os.remove(destination)
+        raise
+    return SavedUpload(size_bytes=size_bytes, sha256=digest.hexdigest())
+
+
+async def find_processed_upload(repositories: Repositories, user_id: str, content_hash: str) -> Optional[Dict[str, Any]]:
+    """
+    Finds an earlier, fully processed upload of the same content by the same user.
+
+    Only uploads that were analyzed and have their Parquet copy are reused,
+    since a reused upload is not converted again; while an earlier upload's
+    conversion is pending or after it failed, the new upload is processed
+    normally.
+
+    Args:
+        repositories: The data access repositories.
+        user_id: The ID of the user who is uploading.
+        content_hash: The hex SHA-256 digest of the uploaded file.
+
+    Returns:
+        A dictionary with the `storage_path` of the stored file and the
+        `analysis_cache`, `data_schema` and `optimized_file_path` of its
+        notebook, or None if no fully processed upload matches.
+    """
+    rows = await repositories.files.find_by_content_hash(
+        user_id, content_hash, columns="storage_path, notebooks(analysis_cache, data_schema, optimized_file_path)"
+    )
+
+    for row in rows or []:
+        notebook = row.get("notebooks") or {}
+        if notebook.get("analysis_cache") and notebook.get("optimized_file_path"):
+            return {
+                "storage_path": row["storage_path"],
+                "analysis_cache": notebook["analysis_cache"],
+                "data_schema": notebook.get("data_schema") or {},
+                "optimized_file_path": notebook.get("optimized_file_path"),
+            }
+    return None
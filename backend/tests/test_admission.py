@@ -0,0 +1,177 @@
+import asyncio
+
+import pytest
+
+from src.lib.admission import Admission, AdmissionController, AdmissionRejected
+
+
+def test_head_of_line_timeout_wakes_smaller_requests_behind_it():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=4, max_per_user=4, memory_budget_bytes=100, queue_timeout_seconds=0.1)
+        running = await controller.admit("alice", 60)
+        large = asyncio.create_task(controller.admit("bob", 80))
+        await asyncio.sleep(0.05)
+        small = asyncio.create_task(controller.admit("carol", 30))
+        await asyncio.sleep(0)
+        await asyncio.gather(large, return_exceptions=True)
+        admitted = await asyncio.wait_for(small, 0.05)
+        return controller.stats(), running, admitted
+
+    stats, running, admitted = asyncio.run(scenario())
+    assert stats["timed_out"] == 1
+    assert (stats["running"], stats["waiting"]) == (2, 0)
+    assert admitted.user_id == "carol"
+
+
+def test_admit_and_release_track_the_load():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=2, max_per_user=2, memory_budget_bytes=100)
+        first = await controller.admit("alice", 10)
+        second = await controller.admit("bob", 20)
+        during = controller.stats()
+        first.release()
+        first.release()
+        second.release()
+        return during, controller.stats()
+
+    during, after = asyncio.run(scenario())
+    assert (during["running"], during["admitted"]) == (2, 2)
+    assert (after["running"], after["waiting"], after["memory_mb"]) == (0, 0, 0)
+
+
+def test_request_over_the_memory_budget_waits_for_a_release():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=4, max_per_user=4, memory_budget_bytes=100, queue_timeout_seconds=1)
+        running = await controller.admit("alice", 60)
+        waiting = asyncio.create_task(controller.admit("bob", 50))
+        await asyncio.sleep(0)
+        queued = controller.stats()
+        running.release()
+        admitted = await waiting
+        return queued, admitted, controller.stats()
+
+    queued, admitted, after = asyncio.run(scenario())
+    assert (queued["running"], queued["waiting"]) == (1, 1)
+    assert admitted.memory_bytes == 50
+    assert (after["running"], after["waiting"]) == (1, 0)
+
+
+def test_request_larger_than_the_budget_runs_alone():
+    async def scenario():
+        controller = AdmissionController(memory_budget_bytes=100)
+        admission = await controller.admit("alice", 500)
+        return controller.stats(), admission
+
+    stats, _ = asyncio.run(scenario())
+    assert stats["running"] == 1
+
+
+def test_waiting_requests_are_admitted_in_arrival_order():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_per_user=4, queue_timeout_seconds=1)
+        running = await controller.admit("alice", 0)
+        order = []
+
+        async def request(user_id):
+            admission = await controller.admit(user_id, 0)
+            order.append(user_id)
+            admission.release()
+
+        tasks = []
+        for user_id in ("bob", "carol", "dave"):
+            tasks.append(asyncio.create_task(request(user_id)))
+            await asyncio.sleep(0)
+        running.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["bob", "carol", "dave"]
+
+
+def test_user_at_their_limit_does_not_block_other_users():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=4, max_per_user=1, queue_timeout_seconds=1)
+        alice = await controller.admit("alice", 0)
+        alice_again = asyncio.create_task(controller.admit("alice", 0))
+        await asyncio.sleep(0)
+        bob = await asyncio.wait_for(controller.admit("bob", 0), 0.1)
+        still_waiting = not alice_again.done()
+        alice.release()
+        await alice_again
+        return still_waiting, bob
+
+    still_waiting, bob = asyncio.run(scenario())
+    assert still_waiting
+    assert bob.user_id == "bob"
+
+
+def test_user_with_too_many_waiting_requests_is_rejected():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_per_user=1, queue_timeout_seconds=1)
+        running = await controller.admit("alice", 0)
+        waiting = asyncio.create_task(controller.admit("bob", 0))
+        await asyncio.sleep(0)
+        try:
+            await controller.admit("bob", 0)
+        except AdmissionRejected as e:
+            rejected = e
+        running.release()
+        await waiting
+        return rejected, controller.stats()
+
+    rejected, stats = asyncio.run(scenario())
+    assert rejected.retry_after >= 1
+    assert stats["rejected"] == 1
+
+
+def test_full_queue_rejects_at_once():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout_seconds=1)
+        running = await controller.admit("alice", 0)
+        waiting = asyncio.create_task(controller.admit("bob", 0))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected):
+            await controller.admit("carol", 0)
+        running.release()
+        await waiting
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_request_gives_back_an_admission_granted_just_before():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, queue_timeout_seconds=1)
+        running = await controller.admit("alice", 10)
+        waiting = asyncio.create_task(controller.admit("bob", 20))
+        await asyncio.sleep(0)
+        # The release grants bob's admission, then the client goes away before bob resumes.
+        running.release()
+        waiting.cancel()
+        (result,) = await asyncio.gather(waiting, return_exceptions=True)
+        if isinstance(result, Admission):
+            # Some Python versions let wait_for return the granted result despite the
+            # cancellation; the caller then owns the admission and releases it.
+            result.release()
+        else:
+            assert isinstance(result, asyncio.CancelledError)
+        return controller.stats()
+
+    stats = asyncio.run(scenario())
+    assert (stats["running"], stats["waiting"], stats["memory_mb"]) == (0, 0, 0)
+
+
+def test_cancelled_waiting_request_leaves_the_queue():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, queue_timeout_seconds=1)
+        running = await controller.admit("alice", 0)
+        waiting = asyncio.create_task(controller.admit("bob", 0))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        queued = controller.stats()
+        running.release()
+        return queued, controller.stats()
+
+    queued, after = asyncio.run(scenario())
+    assert (queued["running"], queued["waiting"]) == (1, 0)
+    assert after["running"] == 0
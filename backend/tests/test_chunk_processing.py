@@ -0,0 +1,39 @@
+import json
+import pandas as pd
+import pytest
+
+from src.services.chunk_processing import process_spreadsheet_in_chunks
+
+
+def _write(path, text):
+    path.write_text(text)
+    return str(path)
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_parquet_copy_round_trips_decimal_column(tmp_path, parallel):
+    rows = [(f"{i}.{i % 100:02d}", i, f"name{i % 7}") for i in range(1, 2001)]
+    file_path = _write(tmp_path / "data.csv", "price,qty,name\n" + "".join(f"{p},{q},{n}\n" for p, q, n in rows))
+    parquet_path = str(tmp_path / "data.parquet")
+
+    process_spreadsheet_in_chunks(file_path, "data.csv", reader_backend="pandas", parquet_path=parquet_path, parallel=parallel)
+
+    expected = pd.read_csv(file_path)
+    actual = pd.read_parquet(parquet_path)
+    assert actual['price'].dtype == 'float64'
+    assert actual['price'].iloc[11] == pytest.approx(12.12)
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+@pytest.mark.parametrize("reader_backend", ["pandas", "pyarrow"])
+def test_analysis_of_constant_column_and_single_row_is_strict_json(tmp_path, reader_backend):
+    constant_path = _write(tmp_path / "constant.csv", "constant,value\n" + "".join(f"3,{i}\n" for i in range(10)))
+    single_row_path = _write(tmp_path / "single.csv", "a,b\n1.5,2\n")
+
+    constant = process_spreadsheet_in_chunks(constant_path, "constant.csv", reader_backend=reader_backend)
+    single_row = process_spreadsheet_in_chunks(single_row_path, "single.csv", reader_backend=reader_backend)
+
+    json.dumps(constant, allow_nan=False)
+    json.dumps(single_row, allow_nan=False)
+    assert constant['correlation_matrix']['constant']['value'] is None
+    assert single_row['descriptive_stats']['a']['std'] is None
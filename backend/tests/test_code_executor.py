@@ -0,0 +1,16 @@
+from src.services.code_executor import find_referenced_columns
+
+COLUMNS = ["price", "count", "sum", "region"]
+
+
+def test_attribute_access_selects_column():
+    assert find_referenced_columns("print(df.price.mean())", COLUMNS) == {"price"}
+
+
+def test_dataframe_method_named_like_a_column_needs_every_column():
+    assert find_referenced_columns("print(df.count())", COLUMNS) is None
+    assert find_referenced_columns("print(df.sum())", COLUMNS) is None
+
+
+def test_subscript_still_selects_column_named_like_a_method():
+    assert find_referenced_columns("print(df['count'].sum())", COLUMNS) == {"count"}
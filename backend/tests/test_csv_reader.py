@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from src.services.chunk_processing import process_spreadsheet_in_chunks
+from src.services.csv_reader import arrow_supports_options, infer_csv_options, open_arrow_csv
+
+COMMA_DELIMITED = "price,qty,name,note\n12.34,1,a,\n5.5,2,b,x\n,3,c,y\n"
+SEMICOLON_DELIMITED = "price;qty;name\n1.234,56;1;a\n7,5;2;b\n"
+TAB_DELIMITED = "price\tqty\tname\n12.34\t1\ta\n5.5\t2\tb\n"
+
+
+def _write(path, text):
+    path.write_text(text)
+    return str(path)
+
+
+def test_infer_csv_options_keeps_dot_decimal_in_comma_delimited_file(tmp_path):
+    file_path = _write(tmp_path / "data.csv", COMMA_DELIMITED)
+
+    assert infer_csv_options(file_path) == {'sep': ',', 'decimal': '.', 'thousands': None}
+
+
+def test_infer_csv_options_detects_comma_decimal_in_semicolon_delimited_file(tmp_path):
+    file_path = _write(tmp_path / "data.csv", SEMICOLON_DELIMITED)
+
+    assert infer_csv_options(file_path) == {'sep': ';', 'decimal': ',', 'thousands': '.'}
+
+
+def test_open_arrow_csv_rejects_thousands_separator(tmp_path):
+    file_path = _write(tmp_path / "data.csv", SEMICOLON_DELIMITED)
+    options = infer_csv_options(file_path)
+
+    assert not arrow_supports_options(options)
+    with pytest.raises(ValueError):
+        open_arrow_csv(file_path, options)
+
+
+@pytest.mark.parametrize("text", [COMMA_DELIMITED, TAB_DELIMITED])
+def test_arrow_and_pandas_read_the_same_values(tmp_path, text):
+    file_path = _write(tmp_path / "data.csv", text)
+    options = infer_csv_options(file_path)
+
+    expected = pd.read_csv(file_path, sep=options['sep'], decimal=options['decimal'], thousands=options['thousands'])
+    actual = pa.Table.from_batches(list(open_arrow_csv(file_path, options))).to_pandas()
+    # Arrow returns missing strings as None, pandas as NaN.
+    actual = actual.mask(actual.isna(), np.nan)
+
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+@pytest.mark.parametrize("text", [COMMA_DELIMITED, SEMICOLON_DELIMITED, TAB_DELIMITED])
+def test_parquet_copy_is_identical_for_both_backends(tmp_path, text):
+    file_path = _write(tmp_path / "data.csv", text)
+    copies = {}
+    for backend in ("pandas", "pyarrow"):
+        parquet_path = str(tmp_path / f"{backend}.parquet")
+        process_spreadsheet_in_chunks(file_path, "data.csv", reader_backend=backend, parquet_path=parquet_path, parallel=False)
+        copies[backend] = pd.read_parquet(parquet_path)
+
+    assert copies["pandas"]['price'].dtype == 'float64'
+    pd.testing.assert_frame_equal(copies["pyarrow"], copies["pandas"])
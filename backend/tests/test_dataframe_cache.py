@@ -0,0 +1,50 @@
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from src.services.dataframe_cache import DataFrameCache
+from src.services.shared_datasets import shared_datasets
+
+
+def test_share_counts_hits_and_misses_like_get():
+    cache = DataFrameCache(max_bytes=10 * 1024 * 1024)
+    cache.put(("notebook-1", 1), pd.DataFrame({"a": [1, 2, 3]}))
+
+    assert cache.share(("notebook-2", 1)) is None
+    shared = cache.share(("notebook-1", 1))
+    again = cache.share(("notebook-1", 1))
+    try:
+        assert (cache.hits, cache.misses) == (2, 1)
+    finally:
+        shared_datasets.release(shared)
+        shared_datasets.release(again)
+        cache.invalidate("notebook-1")
+
+
+def test_share_without_count_leaves_counters_unchanged():
+    cache = DataFrameCache(max_bytes=10 * 1024 * 1024)
+    cache.put(("notebook-1", 1), pd.DataFrame({"a": [1, 2, 3]}))
+
+    shared = cache.share(("notebook-1", 1), count=False)
+    try:
+        assert cache.share(("notebook-2", 1), count=False) is None
+        assert (cache.hits, cache.misses) == (0, 0)
+    finally:
+        shared_datasets.release(shared)
+        cache.invalidate("notebook-1")
+
+
+def test_failed_share_then_get_counts_one_hit(monkeypatch):
+    cache = DataFrameCache(max_bytes=10 * 1024 * 1024)
+    cache.put(("notebook-1", 1), pd.DataFrame({"a": [1, 2, 3]}))
+
+    def publish(df):
+        raise pa.ArrowInvalid("cannot convert")
+
+    monkeypatch.setattr(shared_datasets, "publish", publish)
+    with pytest.raises(pa.ArrowInvalid):
+        cache.share(("notebook-1", 1))
+    cache.get(("notebook-1", 1))
+
+    assert (cache.hits, cache.misses) == (1, 0)
+    cache.invalidate("notebook-1")
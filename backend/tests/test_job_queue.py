@@ -0,0 +1,149 @@
+import time
+
+import pytest
+
+from src.services.job_queue import (
+    JobQueue, JobType, STATUS_FAILED, STATUS_QUEUED, STATUS_RUNNING, STATUS_SUCCEEDED,
+)
+
+
+async def _noop(payload, job):
+    return None
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), lease_seconds=60)
+    queue.register(JobType("fast", _noop, max_concurrency=2, max_attempts=2))
+    queue.register(JobType("heavy", _noop, max_concurrency=1, max_attempts=1))
+    return queue
+
+
+def _make_due(queue, job_id):
+    with queue._transaction() as conn:
+        conn.execute("UPDATE jobs SET run_after = 0 WHERE id = ?", (job_id,))
+
+
+def _expire_lease(queue, job_id):
+    with queue._transaction() as conn:
+        conn.execute("UPDATE jobs SET lease_expires_at = ? WHERE id = ?", (time.time() - 1, job_id))
+
+
+def test_claim_takes_highest_priority_first_then_oldest(queue):
+    low = queue.enqueue("fast", {"n": 1}, priority=0)
+    high = queue.enqueue("fast", {"n": 2}, priority=10)
+    later_low = queue.enqueue("fast", {"n": 3}, priority=0)
+
+    claimed = [queue.claim("w1")["id"], queue.claim("w1")["id"]]
+    queue.complete(claimed[0], "w1")
+    claimed.append(queue.claim("w1")["id"])
+
+    assert claimed == [high, low, later_low]
+
+
+def test_claim_decodes_payload_and_counts_the_attempt(queue):
+    queue.enqueue("fast", {"notebook_id": "n1"})
+
+    job = queue.claim("w1")
+
+    assert job["payload"] == {"notebook_id": "n1"}
+    assert job["attempts"] == 1
+    assert queue.get(job["id"])["status"] == STATUS_RUNNING
+
+
+def test_claim_respects_concurrency_per_type(queue):
+    for _ in range(2):
+        queue.enqueue("heavy", {})
+    for _ in range(3):
+        queue.enqueue("fast", {})
+
+    claimed = [job["type"] for job in iter(lambda: queue.claim("w1"), None)]
+
+    assert sorted(claimed) == ["fast", "fast", "heavy"]
+    assert queue.stats()["heavy"] == {STATUS_QUEUED: 1, STATUS_RUNNING: 1}
+    assert queue.stats()["fast"] == {STATUS_QUEUED: 1, STATUS_RUNNING: 2}
+
+
+def test_failed_job_is_retried_after_a_delay_then_fails_for_good(queue):
+    job_id = queue.enqueue("fast", {})
+
+    job = queue.claim("w1")
+    delay = queue.fail(job_id, "w1", "boom")
+    assert delay is not None and delay > 0
+    assert queue.get(job_id)["status"] == STATUS_QUEUED
+    # The retry is not due before its delay.
+    assert queue.claim("w1") is None
+
+    _make_due(queue, job_id)
+    retry = queue.claim("w1")
+    assert (retry["id"], retry["attempts"]) == (job["id"], 2)
+    assert queue.fail(job_id, "w1", "boom again") is None
+
+    status = queue.get(job_id)
+    assert (status["status"], status["error"], status["attempts"]) == (STATUS_FAILED, "boom again", 2)
+
+
+def test_permanent_failure_skips_remaining_attempts(queue):
+    job_id = queue.enqueue("fast", {})
+    queue.claim("w1")
+
+    # What the worker does when a handler raises PermanentJobError.
+    assert queue.fail(job_id, "w1", "PermanentJobError: gone", retry=False) is None
+    assert queue.get(job_id)["status"] == STATUS_FAILED
+
+
+def test_job_with_expired_lease_is_claimed_again(queue):
+    job_id = queue.enqueue("fast", {})
+    queue.claim("dead-worker")
+    _expire_lease(queue, job_id)
+
+    job = queue.claim("w2")
+
+    assert (job["id"], job["attempts"]) == (job_id, 2)
+    # The first worker no longer holds the job.
+    assert not queue.renew(job_id, "dead-worker")
+    queue.complete(job_id, "w2", {"ok": True})
+    status = queue.get(job_id)
+    assert (status["status"], status["result"]) == (STATUS_SUCCEEDED, {"ok": True})
+
+
+def test_expired_lease_on_last_attempt_fails_the_job(queue):
+    job_id = queue.enqueue("heavy", {})
+    queue.claim("dead-worker")
+    _expire_lease(queue, job_id)
+
+    assert queue.claim("w2") is None
+    assert queue.get(job_id)["status"] == STATUS_FAILED
+
+
+def test_release_jobs_of_dead_workers_makes_them_claimable(queue):
+    job_id = queue.enqueue("fast", {})
+    queue.claim("dead-worker")
+    queue.enqueue("fast", {})
+    queue.claim("live-worker")
+
+    released = queue.release_jobs_of_dead_workers(lambda worker: worker == "live-worker")
+
+    assert released == 1
+    assert queue.claim("w2")["id"] == job_id
+
+
+def test_prune_deletes_only_old_finished_jobs(queue):
+    done = queue.enqueue("fast", {})
+    queue.claim("w1")
+    queue.complete(done, "w1")
+    waiting = queue.enqueue("heavy", {})
+
+    assert queue.prune(retention_seconds=3600) == 0
+    assert queue.prune(retention_seconds=-1) == 1
+    assert queue.get(done) is None
+    assert queue.get(waiting)["status"] == STATUS_QUEUED
+
+
+def test_get_hides_jobs_of_other_users(queue):
+    job_id = queue.enqueue("fast", {}, user_id="alice", group_key="notebook-1")
+
+    assert queue.get(job_id, "bob") is None
+    assert queue.get(job_id, "alice")["id"] == job_id
+    assert [job["id"] for job in queue.list_for_group("notebook-1", "alice")] == [job_id]
+    assert queue.list_for_group("notebook-1", "bob") == []
@@ -0,0 +1,33 @@
+from src.services.progress_service import ProgressRegistry
+
+
+def test_start_rejects_upload_id_of_another_user():
+    registry = ProgressRegistry()
+    assert registry.start("upload-1", "alice", total_bytes=100)
+    registry.record_bytes("upload-1", 10)
+
+    assert not registry.start("upload-1", "mallory")
+    assert registry.get("upload-1", "mallory") is None
+    assert registry.get("upload-1", "alice")["bytes_received"] == 10
+
+
+def test_start_replaces_own_job_with_same_id():
+    registry = ProgressRegistry()
+    registry.start("upload-1", "alice")
+    registry.record_bytes("upload-1", 10)
+
+    assert registry.start("upload-1", "alice")
+    assert registry.get("upload-1", "alice")["bytes_received"] == 0
+
+
+def test_prune_drops_old_jobs_whatever_their_stage():
+    registry = ProgressRegistry(ttl_seconds=3600, max_age_seconds=60)
+    registry.start("stale", "alice")
+    registry.attach_notebook("stale", "notebook-1")
+    registry._jobs["stale"].stages[0]["at"] -= 120
+
+    registry.start("fresh", "alice")
+
+    assert registry.get("stale", "alice") is None
+    assert registry.get("notebook-1", "alice") is None
+    assert registry.get("fresh", "alice") is not None